@@ -4,6 +4,7 @@ import csv
 csv.field_size_limit(sys.maxsize)  # make sure we can write very large csv fields
 import os
 import argparse
+import itertools
 import colored_traceback.always
 
 # if you move this script, you'll need to change this method of getting the imports
@@ -122,6 +123,9 @@ if utils.getsuffix(args.infile) in ['.csv', '.tsv'] and args.glfo_dir is None:
     print '  note: reading csv/tsv format without germline info, so need to get germline info from a separate directory; --glfo-dir was not set, so using default %s. If it doesn\'t crash, it\'s probably ok.' % default_glfo_dir
     args.glfo_dir = default_glfo_dir
 
+# with (non-airr) yaml input that's going to fasta/csv output we only need one annotation at a time, so rather than reading the whole file we read the partitions, then stream the annotations further down
+stream_input = not args.paired and not args.airr_input and utils.getsuffix(args.infile) == '.yaml' and args.plotdir is None and not args.airr_output
+
 # ----------------------------------------------------------------------------------------
 # read input
 if args.paired:
@@ -142,8 +146,26 @@ else:
             # glutils.write_glfo(args.glfo_dir + '-parsed', glfo, debug=True)
             glfd = None
         glfo, annotation_list, cpath = utils.read_airr_output(args.infile, locus=args.locus, glfo=glfo, glfo_dir=glfd, skip_other_locus=args.skip_other_locus)
+    elif stream_input:
+        import clusterpath
+        ystream = utils.stream_yaml_output(args.infile)
+        glfo, annotation_list, plines, first_event = None, None, [], None
+        for key, val in ystream:  # read up to (and including) the first event, so we have the partitions (they're before the events in the file)
+            if key == 'germline-info':
+                glfo = val
+            elif key == 'partition':
+                plines.append(val)
+            elif key == 'event':
+                first_event = val
+                break
+        cpath = clusterpath.ClusterPath()
+        if len(plines) > 0:
+            cpath.readlines(plines)
     else:
-        glfo, annotation_list, cpath = utils.read_output(args.infile, glfo_dir=args.glfo_dir, locus=args.locus)
+        columns = None
+        if utils.getsuffix(args.infile) == '.cols' and args.plotdir is None and not args.airr_output and not args.indel_reversed_seqs and utils.getsuffix(args.outfile) != '.yaml':  # with columnar input we only need to read the columns we're going to write (it'll read everything if any of them aren't in the file)
+            columns = utils.add_lists(['input_seqs'], args.extra_columns)
+        glfo, annotation_list, cpath = utils.read_output(args.infile, glfo_dir=args.glfo_dir, locus=args.locus, columns=columns)
 
 # plot
 if args.plotdir is not None:
@@ -176,8 +198,12 @@ if args.paired:
 
 # restrict to certain partitions/clusters
 if cpath is None or cpath.i_best is None:
-    clusters_to_use = [l['unique_ids'] for l in annotation_list]
-    print '  no cluster path in input file, so just using all %d sequences (in %d clusters) in annotations' % (sum(len(c) for c in clusters_to_use), len(clusters_to_use))
+    if stream_input:
+        clusters_to_use = None  # filled in below as we read the annotations
+        print '  no cluster path in input file, so just using all sequences in annotations'
+    else:
+        clusters_to_use = [l['unique_ids'] for l in annotation_list]
+        print '  no cluster path in input file, so just using all %d sequences (in %d clusters) in annotations' % (sum(len(c) for c in clusters_to_use), len(clusters_to_use))
 else:
     ipartition = cpath.i_best if args.partition_index is None else args.partition_index
     print '  found %d clusters in %s' % (len(cpath.partitions[ipartition]), 'best partition' if args.partition_index is None else 'partition at index %d (of %d)' % (ipartition, len(cpath.partitions)))
@@ -199,16 +225,8 @@ if args.airr_output:
     utils.write_airr_output(args.outfile, annotation_list, cpath=cpath, extra_columns=args.extra_columns, skip_columns=args.skip_columns)
     sys.exit(0)
 
-# condense partis info into <seqfos> for fasta/csv output
-n_skipped = 0
-seqfos = []
-annotations = {':'.join(adict['unique_ids']) : adict for adict in annotation_list}  # collect the annotations in a dictionary so they're easier to access
-for cluster in clusters_to_use:
-    if ':'.join(cluster) not in annotations:
-        n_skipped += 1
-        # print '  %s cluster with size %d not in annotations, so skipping it' % (utils.color('yellow', 'warning'), len(cluster))
-        continue
-    cluster_annotation = annotations[':'.join(cluster)]
+# ----------------------------------------------------------------------------------------
+def get_seqfos(cluster_annotation):  # condense partis info for one cluster into seqfos for fasta/csv output
     newfos = [{'name' : u, 'seq' : s} for u, s in zip(cluster_annotation['unique_ids'], cluster_annotation['seqs' if args.indel_reversed_seqs else 'input_seqs'])]
     if args.extra_columns is not None:
         for ecol in args.extra_columns:
@@ -220,7 +238,31 @@ for cluster in clusters_to_use:
                 if ecol in utils.linekeys['per_seq']:
                     ival = ival[iseq]
                 newfos[iseq][ecol] = ival
-    seqfos += newfos
+    return newfos
+
+# ----------------------------------------------------------------------------------------
+if stream_input:  # everything left in <ystream> is events, which we read one at a time, keeping only their seqfos
+    annotation_list = itertools.chain([] if first_event is None else [first_event], (val for _, val in ystream))
+keep_keys = None if clusters_to_use is None else set(':'.join(c) for c in clusters_to_use)
+if clusters_to_use is None:
+    clusters_to_use = []
+cluster_seqfos = {}  # seqfos for each cluster that we're going to write, keyed by ':'.join(uids)
+for cluster_annotation in annotation_list:
+    ukey = ':'.join(cluster_annotation['unique_ids'])
+    if keep_keys is None:
+        clusters_to_use.append(cluster_annotation['unique_ids'])
+    elif ukey not in keep_keys:
+        continue
+    cluster_seqfos[ukey] = get_seqfos(cluster_annotation)
+
+n_skipped = 0
+seqfos = []
+for cluster in clusters_to_use:
+    if ':'.join(cluster) not in cluster_seqfos:
+        n_skipped += 1
+        # print '  %s cluster with size %d not in annotations, so skipping it' % (utils.color('yellow', 'warning'), len(cluster))
+        continue
+    seqfos += cluster_seqfos[':'.join(cluster)]
 if n_skipped > 0:
     print '  missing annotations for %d sequences' % n_skipped
 
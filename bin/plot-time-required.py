@@ -14,10 +14,50 @@ sys.path.insert(1, current_script_dir)
 import utils
 
 parser = argparse.ArgumentParser()
-parser.add_argument('--actions', required=True)
+parser.add_argument('--actions')
 parser.add_argument('--timegrep', action='store_true')
+parser.add_argument('--timeline-fnames', help='colon-separated list of json timeline files written by partis --timeline-fname (or --write-timeline). If set, we print a table for each of them (and, if --plotdir is set, plot each as a gantt chart), instead of using the hardcoded values below.')
+parser.add_argument('--plotdir')
+parser.add_argument('--max-depth', type=int, help='only print/plot stages nested at most this deep')
 args = parser.parse_args()
 args.actions = utils.get_arg_list(args.actions)
+args.timeline_fnames = utils.get_arg_list(args.timeline_fnames)
+
+# ----------------------------------------------------------------------------------------
+def plot_timeline(timeline, plotname):
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import matplotlib.pyplot as plt
+    stages = timeline['stages']
+    fig, ax = plt.subplots(figsize=(12, max(3, 0.3 * len(stages))))
+    depth_colors = ['#006600', '#4b92e7', 'darkorange', 'darkred', 'grey']
+    for istage, sfo in enumerate(stages):
+        ax.barh(istage, sfo['wall'], left=sfo['start'], color=depth_colors[sfo['depth'] % len(depth_colors)], alpha=0.8)
+        ax.text(sfo['start'] + sfo['wall'], istage, ' %.1fs  %.0fmb%s' % (sfo['wall'], max(sfo['peak_rss_mb'], sfo['child_peak_rss_mb']), '' if sfo.get('n_items') is None else '  n=%d'%sfo['n_items']), va='center', fontsize=7)
+    ax.set_yticks(range(len(stages)))
+    ax.set_yticklabels(['  ' * s['depth'] + s['name'] for s in stages], fontsize=8)
+    ax.invert_yaxis()
+    ax.set_xlabel('time since start (sec)')
+    plt.tight_layout()
+    utils.prep_dir(args.plotdir, allow_other_files=True)
+    plt.savefig('%s/%s.svg' % (args.plotdir, plotname))
+    plt.close()
+
+# ----------------------------------------------------------------------------------------
+if args.timeline_fnames is not None:
+    import profiler
+    for tfname in args.timeline_fnames:
+        timeline = profiler.read_timeline(tfname)
+        if args.max_depth is not None:
+            timeline['stages'] = [s for s in timeline['stages'] if s['depth'] <= args.max_depth]
+        print '%s:' % tfname
+        print '    %s' % timeline['command']
+        profiler.print_timeline(timeline, extra_str='    ')
+        if args.plotdir is not None:
+            plot_timeline(timeline, os.path.basename(utils.getprefix(tfname)))
+    sys.exit(0)
+if args.actions is None:
+    raise Exception('have to set either --actions or --timeline-fnames')
 
 fsdir = '/fh/fast/matsen_e/dralph/work/partis-dev/_output' + '/update-17'
 # fsdir = '/fh/fast/matsen_e/processed-data/partis/clustering-paper/vollmers'  #/021-018/
@@ -9,6 +9,9 @@ import colored_traceback.always
 import collections
 import random
 import numpy
+import hashlib
+import tempfile
+import time
 
 # if you move this script, you'll need to change this method of getting the imports
 partis_dir = os.path.dirname(os.path.realpath(__file__)).replace('/bin', '')
@@ -25,6 +28,7 @@ dstr = """
 Uses vsearch (or the \'locus\' key in --input-metfname) to split the sequences in <fname> according to their loci, writing each locus to its own fasta file <locus>.fa.
 If \'paired-uids\' are available in --input-metafname, also splits the heavy sequences according to the light chain locus with which they\'re paired, resulting in subdirectories e.g. igh+igk/ and igh+igl/.
 Use --reverse-negative-strands to check both senses for each input sequence.
+All loci (and, with --reverse-negative-strands, both senses) are searched in a single vsearch run against a combined v gene db, which is cached in --locus-db-dir so it only needs to be built once for each germline dir.
 """
 parser = argparse.ArgumentParser(description=dstr,
                                  formatter_class=argparse.ArgumentDefaultsHelpFormatter)  # why tf isn't this printing the defaults?
@@ -35,6 +39,7 @@ parser.add_argument('--species', default='human', choices=('human', 'macaque', '
 parser.add_argument('--germline-dir', default=partis_dir + '/data/germlines', help='doesn\'t need to be the germlines corresponding to this sample since it\'s just so it can figure out which is igh vs igk vs igl, so the default is probably fine')
 parser.add_argument('--workdir', default=utils.choose_random_subdir('/tmp/%s/partis' % os.getenv('USER', default='partis-work')), help='working directory for vsearch')
 parser.add_argument('--vsearch-binary', help='Path to vsearch binary (vsearch binaries for linux and darwin are included in partis/bin/, so leaving this unset should work, but for other systems you need to get your own)')
+parser.add_argument('--locus-db-dir', default='/tmp/%s/partis/split-loci-dbs' % os.getenv('USER', default='partis-work'), help='directory in which to cache the combined (all loci) v gene db that we run vsearch against. Each germline dir gets its own subdir (named by a hash of its germline files), so the db is built once and then reused by subsequent runs.')
 parser.add_argument('--vsearch-threshold', type=float, default=0.4, help='default identity threshold for vsearch')
 parser.add_argument('--debug', type=int, default=1)
 parser.add_argument('--overwrite', action='store_true')
@@ -50,38 +55,76 @@ parser.add_argument('--n-random-queries', type=int, help='see partis help (altho
 parser.add_argument('--ig-or-tr', default='ig', choices=utils.locus_pairs.keys(), help='antibodies or TCRs?')
 
 # ----------------------------------------------------------------------------------------
-def use_rev_comp(pline, rline):  # decide whether positive sense <pline> or negative sense <rline> has better alignment
-    assert pline['unique_ids'][0] == rline['unique_ids'][0]
-    if rline.get('invalid', False):
-        return False
-    elif pline.get('invalid', False):
-        return True
-    elif rline['score'] > pline['score']:
-        return True
-    else:
-        return False
+def get_locus_db():  # return fname of the combined v gene fasta for all loci in --germline-dir, building it (and caching it in --locus-db-dir) if we don't already have it
+    ghash = hashlib.md5()
+    for locus in utils.sub_loci(args.ig_or_tr):
+        for fn in glutils.glfo_fnames(args.germline_dir, locus):
+            if os.path.exists(fn):
+                with open(fn) as gfile:
+                    ghash.update(gfile.read())
+    dbfname = '%s/%s/v-genes.fa' % (args.locus_db_dir, ghash.hexdigest())
+    if os.path.exists(dbfname):
+        print '    using cached locus db %s' % dbfname
+        return dbfname
+    utils.mkdir(os.path.dirname(dbfname))
+    tmpfd, tmpfname = tempfile.mkstemp(dir=os.path.dirname(dbfname), suffix='.tmp')  # write to a temp file then move it into place, so simultaneous runs can't see a partial db
+    n_genes = 0
+    with os.fdopen(tmpfd, 'w') as dbfile:
+        for locus in utils.sub_loci(args.ig_or_tr):
+            lglfo = glutils.read_glfo(args.germline_dir, locus)
+            for gene, seq in lglfo['seqs']['v'].items():
+                dbfile.write('>%s\n%s\n' % (gene, seq))
+                n_genes += 1
+    os.rename(tmpfname, dbfname)
+    print '    wrote locus db with %d v genes to %s' % (n_genes, dbfname)
+    return dbfname
 
 # ----------------------------------------------------------------------------------------
-def run_vsearch(seqfos):  # run vsearch to see if you can get a match for each locus for every sequence
-    print '  running vsearch on %d sequences:' % len(seqfos)
-    n_rev_compd, n_total = 0, 0
-    for locus in utils.sub_loci(args.ig_or_tr):
-        lglfo = glutils.read_glfo(args.germline_dir, locus)
-        annotations = utils.run_vsearch_with_duplicate_uids('search', seqfos, args.workdir + '/vsearch', args.vsearch_threshold, glfo=lglfo, print_time=True, vsearch_binary=args.vsearch_binary, get_annotations=True, expect_failure=True, extra_str='   %s  fwd:'%utils.color('blue', locus) if args.reverse_negative_strands else '    %s: '%locus)
-        assert len(annotations) == len(seqfos)
-        if args.reverse_negative_strands:  # it might be nicer to user vsearch options to run on both senses at once, but otoh this might be nicer
-            revnotations = utils.run_vsearch_with_duplicate_uids('search', revfos, args.workdir + '/vsearch', args.vsearch_threshold, glfo=lglfo, print_time=True, vsearch_binary=args.vsearch_binary, get_annotations=True, expect_failure=True, extra_str='        rev:')
-            assert len(revnotations) == len(seqfos)
-        for il, (sfo, line) in enumerate(zip(seqfos, annotations)):
-            assert sfo['name'] == line['unique_ids'][0]  # note that they're not full annotations, they just have a couple keys
-            if args.reverse_negative_strands and use_rev_comp(line, revnotations[il]):
-                sfo['seq'] = revfos[il]['seq']
-                line = revnotations[il]
-                n_rev_compd += 1
-            sfo[locus] = line  # add info for each locus to the input seqfos
-            n_total += 1
-    if args.reverse_negative_strands:
-        print '  used rev comp for %d/%d locus results (for %d seqs)' % (n_rev_compd, n_total, len(seqfos))
+def run_vsearch(seqfos):  # run one vsearch search against the v genes for all loci (and on both strands if --reverse-negative-strands is set), and add the best score (and its strand) for each locus to each seqfo
+    start = time.time()
+    dbfname = get_locus_db()
+    utils.prep_dir(args.workdir)
+    infname, outfname = args.workdir + '/input.fa', args.workdir + '/aln-info.tsv'
+    with open(infname, 'w') as fastafile:
+        for iseq, sfo in enumerate(seqfos):  # use the index as the vsearch query name, since input files can have duplicate uids
+            fastafile.write('>%d\n%s\n' % (iseq, sfo['seq']))
+    userfields = ['query', 'target', 'ids', 'qstrand']
+    cmd = utils.get_vsearch_base_cmd(args.vsearch_threshold, vsearch_binary=args.vsearch_binary)
+    cmd += ' --usearch_global %s --db %s' % (infname, dbfname)
+    cmd += ' --maxaccepts 5'  # see note in utils.run_vsearch() (and note that this is per strand)
+    cmd += ' --strand %s' % ('both' if args.reverse_negative_strands else 'plus')
+    cmd += ' --userfields %s --userout %s --quiet' % ('+'.join(userfields), outfname)
+    utils.run_cmds([{'cmd_str' : cmd, 'outfname' : outfname, 'workdir' : args.workdir}])
+
+    for sfo in seqfos:
+        sfo['lscores'] = {l : 0 for l in utils.sub_loci(args.ig_or_tr)}
+        sfo['lstrands'] = {}
+    with open(outfname) as alnfile:
+        reader = csv.DictReader(alnfile, fieldnames=userfields, delimiter='\t')
+        for line in reader:
+            sfo = seqfos[int(line['query'])]
+            locus, score = utils.get_locus(line['target']), int(line['ids'])
+            if score > sfo['lscores'][locus] or (score == sfo['lscores'][locus] and line['qstrand'] == '+'):  # on ties, prefer the forward sense
+                sfo['lscores'][locus] = score
+                sfo['lstrands'][locus] = line['qstrand']
+    os.remove(infname)
+    os.remove(outfname)
+    os.rmdir(args.workdir)
+
+    n_passed = len([s for s in seqfos if max(s['lscores'].values()) > 0])
+    print '    vsearch: %d / %d sequences matched a v gene (%s) in %.1f sec' % (n_passed, len(seqfos), 'both strands' if args.reverse_negative_strands else 'forward strand only', time.time() - start)
+
+# ----------------------------------------------------------------------------------------
+def open_locus_file(locus):  # open top-level output file for <locus> (we write each seq as soon as we know its locus, rather than keeping them all until the end)
+    ofn = paircluster.paired_fn(args.outdir, locus=locus)
+    utils.mkdir(ofn, isfile=True)
+    lfiles[locus] = open(ofn, 'w')
+
+# ----------------------------------------------------------------------------------------
+def write_seq(locus, sfo):
+    if locus not in lfiles:  # only open the failed file if we need it
+        open_locus_file(locus)
+    lfiles[locus].write('>%s\n%s\n' % (sfo['name'], sfo['seq']))
 
 # ----------------------------------------------------------------------------------------
 def write_locus_file(locus, ofos, lpair=None, extra_str='  '):
@@ -163,8 +206,6 @@ if args.n_max_queries != -1 or args.n_random_queries is not None:
 if args.fasta_info_index is not None:
     for sfo in seqfos:
         sfo['name'] = sfo['infostrs'][args.fasta_info_index]
-if args.reverse_negative_strands:
-    revfos = [{'name' : s['name'], 'seq' : utils.revcomp(s['seq'])} for s in seqfos]  # NOTE this is not on an equal footing with <seqfos>, since we add all the vsearch info to <seqfos>, then use it do decide on locus, and then to write output
 
 if os.path.exists(args.germline_dir + '/' + args.species):  # ick that is hackey
     args.germline_dir += '/' + args.species
@@ -176,34 +217,48 @@ if args.input_metafname is not None:
 if len(meta_loci) == 0:  # default: no input locus info
     run_vsearch(seqfos)
 
-# then, for each sequence, choose the locus with the best-scoring match (in practice i doubt you ever really get multiple loci with matches)
+# then, for each sequence, choose the locus with the best-scoring match (in practice i doubt you ever really get multiple loci with matches), and write it straight to that locus's file
+if args.guess_pairing_info and len(paired_uids) > 0:
+    raise Exception('can\'t/shouldn\'t guess pairing info if we already have it from elsewhere')
+print 'writing to %s/' % args.outdir
 outfos = collections.OrderedDict(((l, []) for l in utils.sub_loci(args.ig_or_tr)))
 failed_seqs = []
+lfiles = collections.OrderedDict()  # open top-level output file for each locus
+for locus in outfos:  # open all the loci's files at the start, so we get zero-length files for loci with no seqs
+    open_locus_file(locus)
+n_rev_compd = 0
 for sfo in seqfos:
     if len(meta_loci) == 0:  # default: use vsearch match scores
-        lscores = {l : sfo[l]['score'] if 'invalid' not in sfo[l] else 0 for l in utils.sub_loci(args.ig_or_tr)}
+        lscores = sfo['lscores']
         locus, max_score = sorted(lscores.items(), key=operator.itemgetter(1), reverse=True)[0]
         if max_score == 0:
             failed_seqs.append(sfo)
+            write_seq('failed', sfo)
             continue
+        if sfo['lstrands'][locus] == '-':
+            sfo['seq'] = utils.revcomp(sfo['seq'])
+            n_rev_compd += 1
     else:  # if we were passed input locus info
         locus = meta_loci[sfo['name']]
+    if args.guess_pairing_info:
+        sfo['name'] += '-' + locus
     outfos[locus].append(sfo)
-    if args.debug > 1:
+    write_seq(locus, sfo)
+    if args.debug > 1 and len(meta_loci) == 0:
         def lpstr(spair):
             l, s = spair
             return '%s %s' % (utils.locstr(l) if l==locus else l.replace('ig', ''), utils.color('red' if s!=0 else None, '%3d'%s))
-        print '   %s   %s' % ('  '.join(lpstr(s) for s in sorted(lscores.items(), key=operator.itemgetter(1), reverse=True)), sfo['name'])
+        print '   %s   %s   %s' % ('  '.join(lpstr(s) for s in sorted(lscores.items(), key=operator.itemgetter(1), reverse=True)), '-' if sfo['lstrands'][locus]=='-' else ' ', sfo['name'])
+for locus, lfile in lfiles.items():
+    lfile.close()
+    print '  %s: %d to %s' % (locus, len(failed_seqs) if locus=='failed' else len(outfos[locus]), os.path.basename(lfile.name))
 
 print 'totals: %s%s' % (' '.join(('%s %d'%(l, len(sfos))) for l, sfos in outfos.items()), '' if len(failed_seqs) == 0 else ' (%s: %d)'%(utils.color('yellow', 'failed'), len(failed_seqs)))
+if args.reverse_negative_strands:
+    print '  used rev comp for %d/%d seqs' % (n_rev_compd, len(seqfos))
 assert sum(len(ofo) for ofo in outfos.values()) + len(failed_seqs) == len(seqfos)
 
 if args.guess_pairing_info:
-    if len(paired_uids) > 0:
-        raise Exception('can\'t/shouldn\'t guess pairing info if we already have it from elsewhere')
-    for locus in outfos:
-        for ofo in outfos[locus]:
-            ofo['name'] += '-' + locus
     guessed_metafos = utils.extract_pairing_info(seqfos, droplet_id_separators=args.droplet_id_separators, droplet_id_indices=args.droplet_id_indices)
     for uid, mfo in guessed_metafos.items():
         paired_uids[uid] = mfo['paired-uids']
@@ -221,13 +276,6 @@ print '  removed %d failed uids from paired_uids' % n_removed
 if args.debug and len(paired_uids) > 0:
     print_pairing_info(outfos, paired_uids)
 
-print 'writing to %s/' % args.outdir
-if len(failed_seqs) > 0:
-    write_locus_file('failed', failed_seqs)
-
-for locus in outfos:  # first write the single files with all seqs for each locus
-    write_locus_file(locus, outfos[locus])
-
 omfname = '%s/meta.yaml' % args.outdir
 if args.guess_pairing_info:
     with open(omfname, 'w') as outfile:  # NOTE file name duplicates code in bin/partis
@@ -77,7 +77,8 @@ class AlleleFinder(object):
 
         self.seq_info = {}
 
-        self.counts, self.fitfos = {}, {}
+        self.count_keys = ['total', 'muted'] + utils.nukes  # last axis of each gene's array in <self.counts>
+        self.counts, self.fitfos = {}, {}  # counts: for each gene, int array with shape (germline position, n_mutes, count key)
         self.inferred_allele_info = []  # new alleles with respect to the template genes from which we actually inferred them, for usage internal to allelefinder
         self.new_allele_info = []  #  new alleles with respect to original template genes, for external use (distinction is important if we infer a new allele from another previously-inferred new allele)
         self.positions_to_plot = {}
@@ -119,11 +120,7 @@ class AlleleFinder(object):
 
     # ----------------------------------------------------------------------------------------
     def init_gene(self, gene):
-        self.counts[gene] = {}
-        for igl in range(len(self.glfo['seqs'][utils.get_region(gene)][gene])):
-            self.counts[gene][igl] = {}
-            for istart in range(self.args.n_max_mutations_per_segment + 1):  # istart and n_mutes are equivalent
-                self.counts[gene][igl][istart] = {n : 0 for n in ['muted', 'total'] + utils.nukes}
+        self.counts[gene] = numpy.zeros((len(self.glfo['seqs'][utils.get_region(gene)][gene]), self.args.n_max_mutations_per_segment + 1, len(self.count_keys)), dtype=numpy.int64)  # istart and n_mutes are equivalent
         self.gene_obs_counts[gene] = 0
         self.per_gene_mute_counts[gene] = Hist(self.args.n_max_mutations_per_segment - 1, 0.5, self.args.n_max_mutations_per_segment - 0.5)  # i.e. 0th (underflow) bin corresponds to zero mutations
         for side in self.n_big_del_skipped:
@@ -304,24 +301,31 @@ class AlleleFinder(object):
         return False
 
     # ----------------------------------------------------------------------------------------
-    def increment_query(self, uid, gene):
-        self.gene_obs_counts[gene] += 1
-
-        n_mutes, germline_seq, query_seq = [self.seq_info[uid][tn] for tn in ['n_mutes', 'gl_seq', 'qr_seq']]  # historical...
-        self.overall_mute_counts.fill(n_mutes)  # NOTE this is almost the same as the hists in mutefreqer.py, except those divide by sequence length, and more importantly, they don't make sure all the sequences are the same length (i.e. the base exclusions stuff)
-        self.per_gene_mute_counts[gene].fill(n_mutes)  # NOTE this is almost the same as the hists in mutefreqer.py, except those divide by sequence length, and more importantly, they don't make sure all the sequences are the same length (i.e. the base exclusions stuff)
-
-        assert len(germline_seq) == len(self.glfo['seqs'][self.region][gene]) - self.n_bases_to_exclude['5p'][gene] - self.n_bases_to_exclude['3p'][gene]
-        for ipos in range(len(germline_seq)):
-            igl = ipos + self.n_bases_to_exclude['5p'][gene]  # position in original (i.e. complete) germline gene
-
-            if germline_seq[ipos] == utils.ambig_base or query_seq[ipos] == utils.ambig_base:  # skip if either germline or query sequence is ambiguous at this position
-                continue
-
-            self.counts[gene][igl][n_mutes]['total'] += 1
-            if query_seq[ipos] != germline_seq[ipos]:  # if this position is mutated
-                self.counts[gene][igl][n_mutes]['muted'] += 1  # mark that we saw this germline position mutated once in a sequence with <n_mutes> regional mutation frequency
-            self.counts[gene][igl][n_mutes][query_seq[ipos]] += 1  # if there's a new allele, we need this to work out what the snp'd base is
+    def increment_queries(self, gene, uids):  # increment counts for all of <uids> (which all have to be from <gene>) at once
+        if len(uids) == 0:
+            return
+        self.gene_obs_counts[gene] += len(uids)
+
+        n_mutelist = numpy.array([self.seq_info[u]['n_mutes'] for u in uids], dtype=numpy.int64)
+        for n_mutes in n_mutelist:
+            self.overall_mute_counts.fill(n_mutes)  # NOTE this is almost the same as the hists in mutefreqer.py, except those divide by sequence length, and more importantly, they don't make sure all the sequences are the same length (i.e. the base exclusions stuff)
+            self.per_gene_mute_counts[gene].fill(n_mutes)  # NOTE this is almost the same as the hists in mutefreqer.py, except those divide by sequence length, and more importantly, they don't make sure all the sequences are the same length (i.e. the base exclusions stuff)
+
+        seq_len = len(self.glfo['seqs'][self.region][gene]) - self.n_bases_to_exclude['5p'][gene] - self.n_bases_to_exclude['3p'][gene]
+        assert all(len(self.seq_info[u]['gl_seq']) == seq_len for u in uids)
+        gl_chars = numpy.frombuffer(''.join(str(self.seq_info[u]['gl_seq']) for u in uids), dtype='S1').reshape(len(uids), seq_len)  # one row per query (str() since seqs read from yaml/json files are unicode, which has more than one byte per char)
+        qr_chars = numpy.frombuffer(''.join(str(self.seq_info[u]['qr_seq']) for u in uids), dtype='S1').reshape(len(uids), seq_len)
+        unambig = (gl_chars != utils.ambig_base) & (qr_chars != utils.ambig_base)  # skip positions where either germline or query sequence is ambiguous
+
+        # flattened (germline position, n_mutes) bin for each query/position, so we can fill each count key with one bincount
+        gcts = self.counts[gene]
+        n_bins = gcts.shape[0] * gcts.shape[1]
+        igls = numpy.arange(seq_len) + self.n_bases_to_exclude['5p'][gene]  # position in original (i.e. complete) germline gene
+        ibins = igls[numpy.newaxis, :] * gcts.shape[1] + n_mutelist[:, numpy.newaxis]
+        masks = {'total' : unambig, 'muted' : unambig & (qr_chars != gl_chars)}  # muted: we saw this germline position mutated in a sequence with <n_mutes> regional mutations
+        masks.update({n : unambig & (qr_chars == n) for n in utils.nukes})  # if there's a new allele, we need the query base counts to work out what the snp'd base is
+        for ikey, ckey in enumerate(self.count_keys):
+            gcts[:, :, ikey] += numpy.bincount(ibins[masks[ckey]], minlength=n_bins).reshape(gcts.shape[:2])
 
     # ----------------------------------------------------------------------------------------
     def get_residual_sum(self, xvals, yvals, errs, slope, intercept, debug=False):
@@ -440,7 +444,7 @@ class AlleleFinder(object):
         I don't think it's right yet, although it kind of works.
         In any case, shit works fine without reweighting, so I don't feel like dealing with the complication a.t.m. (especially don't want to deal with correcting the uncertainties for reweighting).
         """
-        gcts = self.counts[gene][position]  # shorthand name
+        gcts = {n_muted : dict(zip(self.count_keys, cts)) for n_muted, cts in enumerate(self.counts[gene][position].tolist())}  # shorthand name
         overall_nuke_totals = {n : 0 for n in utils.nukes}
         per_bin_nuke_totals = {n_muted : {n : 0 for n in utils.nukes} for n_muted in gcts}
         for n_muted in gcts:
@@ -470,22 +474,25 @@ class AlleleFinder(object):
         return reweighted_freqs
 
     # ----------------------------------------------------------------------------------------
-    def get_allele_finding_xyvals(self, gene, position):
+    def get_allele_finding_xyarrays(self, gene):  # (position, n_mutes) arrays of the values for each position's fit
         import fraction_uncertainty
-        gcts = self.counts[gene][position]  # shorthand name
+        obs, total = self.counts[gene][:, :, self.count_keys.index('muted')], self.counts[gene][:, :, self.count_keys.index('total')]
 
-        obs = [d['muted'] for d in gcts.values()]
+        # there's only a handful of distinct (obs, total) pairs, so only calculate the uncertainty once for each of them
+        pairs, ipairs = numpy.unique(numpy.stack([obs.ravel(), total.ravel()], axis=1), axis=0, return_inverse=True)
+        lohis = numpy.array([fraction_uncertainty.err(o, t) if t > 0 else (0., 1.) for o, t in pairs.tolist()])  # set uncertainty bounds to (0., 1.) for zero-denominator bins
+        errs = ((lohis[:, 1] - lohis[:, 0]) / 2)[ipairs].reshape(obs.shape)
 
-        lohis = [fraction_uncertainty.err(d['muted'], d['total']) if d['total'] > 0. else (0., 1.) for d in gcts.values()]  # set uncertainty bounds to (0., 1.) for zero-denominator bins
-        errs = [(hi - lo) / 2 for lo, hi in lohis]
-        weights = [1./(e*e) for e in errs]
-
-        freqs = [float(d['muted']) / d['total'] if d['total'] > 0 else 0. for d in gcts.values()]
-        total = [d['total'] for d in gcts.values()]
+        freqs = numpy.zeros(obs.shape)
+        numpy.true_divide(obs, total, out=freqs, where=total > 0)
 
-        n_mutelist = gcts.keys()
+        return {'obs' : obs, 'total' : total, 'freqs' : freqs, 'errs' : errs, 'weights' : 1. / (errs * errs)}
 
-        return {'obs' : obs, 'total' : total, 'n_mutelist' : n_mutelist, 'freqs' : freqs, 'errs' : errs, 'weights' : weights}
+    # ----------------------------------------------------------------------------------------
+    def get_allele_finding_xyvals(self, xyarrays, position):  # lists for one position (for fitting and plotting)
+        xyvals = {k : xyarrays[k][position].tolist() for k in xyarrays}
+        xyvals['n_mutelist'] = range(len(xyvals['obs']))
+        return xyvals
 
     # ----------------------------------------------------------------------------------------
     def get_both_pre_post_vals(self, gene, istart, positions_to_try_to_fit):
@@ -700,6 +707,28 @@ class AlleleFinder(object):
             print '    discontinuity:  diff / err = (%5.3f - %5.3f) / %5.3f = %.1f ?> %.1f'  % (istart_freq, last_freq, joint_freq_err, (istart_freq - last_freq) / joint_freq_err, self.big_discontinuity_factor(istart))
         return istart_freq - last_freq > self.big_discontinuity_factor(istart) * joint_freq_err
 
+    # ----------------------------------------------------------------------------------------
+    def prefilter_positions(self, gene, istart, positions_to_try_to_fit):
+        """ apply the first (cheap) cuts in fit_position() to all positions at once, returning the positions that pass (so we only do the per-position fits for them) """
+        if len(positions_to_try_to_fit) == 0:
+            return []
+        positions = numpy.array(positions_to_try_to_fit, dtype=numpy.int64)
+        xya = {k : v[positions] for k, v in self.xyarrays[gene].items()}
+        min_ibin = max(0, istart - self.max_fit_length)
+        max_ibin = min(self.args.n_max_mutations_per_segment, istart + self.max_fit_length)
+
+        passes = xya['obs'][:, istart] >= self.n_muted_min_per_bin  # enough mutated counts in the <istart>th bin
+        passes &= (xya['obs'][:, istart : max_ibin].sum(axis=1) >= self.n_muted_min) & (xya['total'][:, istart : max_ibin].sum(axis=1) >= self.n_total_min)  # enough overall post-counts
+
+        # big discontinuity between <istart - 1> and <istart> (vectorized big_discontinuity(), which indexes <bothvals>, hence the <min_ibin> offset)
+        both = {k : v[:, min_ibin : max_ibin] for k, v in xya.items()}
+        last_total, istart_total = both['total'][:, istart - 1], both['total'][:, istart]
+        total_jump = istart_total - last_total > self.big_discontinuity_factor(istart) * numpy.sqrt(numpy.maximum(last_total, istart_total))
+        freq_jump = both['freqs'][:, istart] - both['freqs'][:, istart - 1] > self.big_discontinuity_factor(istart) * numpy.maximum(both['errs'][:, istart - 1], both['errs'][:, istart])
+        passes &= (istart_total >= 4) & numpy.where(last_total < 10, total_jump, freq_jump)
+
+        return [p for p, ok in zip(positions_to_try_to_fit, passes) if ok or self.dbgfcn(p, istart)]  # dbg positions don't get skipped in fit_position(), so don't skip 'em here either
+
     # ----------------------------------------------------------------------------------------
     def fit_position(self, gene, istart, pos, prevals, postvals, bothvals, candidate_ratios, residfo, debug=False):
         dbg = self.dbgfcn(pos, istart)
@@ -716,8 +745,8 @@ class AlleleFinder(object):
                 return True
 
         # need to have enough mutated counts in the <istart>th bin (this is particularly important (partly) because it's the handle that tells us it's *this* <istart> that's correct, rather than <istart> + 1)
-        if self.counts[gene][pos][istart]['muted'] < self.n_muted_min_per_bin:
-            if returnfcn('only %d muted in <istart>th bin' % self.counts[gene][pos][istart]['muted']):
+        if self.counts[gene][pos, istart, self.count_keys.index('muted')] < self.n_muted_min_per_bin:
+            if returnfcn('only %d muted in <istart>th bin' % self.counts[gene][pos, istart, self.count_keys.index('muted')]):
                 return
 
         if sum(postvals['obs']) < self.n_muted_min or sum(postvals['total']) < self.n_total_min:
@@ -828,6 +857,7 @@ class AlleleFinder(object):
 
     # ----------------------------------------------------------------------------------------
     def fit_istart(self, gene, istart, positions_to_try_to_fit, debug=False):
+        positions_to_try_to_fit = self.prefilter_positions(gene, istart, positions_to_try_to_fit)
         bothxyvals, prexyvals, postxyvals = self.get_both_pre_post_vals(gene, istart, positions_to_try_to_fit)
         ratios, residfo = {}, {}
         for pos in positions_to_try_to_fit:
@@ -861,7 +891,7 @@ class AlleleFinder(object):
         new_seq = old_seq
         mutfo = {}
         for pos in sorted(candidfo['positions']):
-            obs_counts = {nuke : self.counts[template_gene][pos][n_candidate_snps][nuke] for nuke in utils.nukes}  # NOTE it's super important to only use the counts from sequences with <n_candidate_snps> total mutations
+            obs_counts = {nuke : int(self.counts[template_gene][pos, n_candidate_snps, self.count_keys.index(nuke)]) for nuke in utils.nukes}  # NOTE it's super important to only use the counts from sequences with <n_candidate_snps> total mutations
             sorted_obs_counts = sorted(obs_counts.items(), key=operator.itemgetter(1), reverse=True)
             original_nuke = self.glfo['seqs'][self.region][template_gene][pos]
             new_nuke = None
@@ -1003,12 +1033,9 @@ class AlleleFinder(object):
         for gene, gene_queries in itertools.groupby(sorted(queries_to_use, key=keyfunc), key=keyfunc):
             gene_queries = list(gene_queries)  # otherwise i can't print the length down there...
             clusters = utils.collapse_naive_seqs(swfo, queries=gene_queries)
-            n_representatives = 0
-            for cluster in clusters:
-                cluster_representatives = self.choose_cluster_representatives(swfo, cluster)
-                for qchosen in cluster_representatives:
-                    self.increment_query(qchosen, swfo[qchosen][self.region + '_gene'])
-                n_representatives += len(cluster_representatives)
+            representatives = [q for cluster in clusters for q in self.choose_cluster_representatives(swfo, cluster)]
+            self.increment_queries(gene, representatives)
+            n_representatives = len(representatives)
             n_total_clusters += len(clusters)
             if debug:
                 print '      %s %6d  %6d    %6d' % (utils.color_gene(gene, width=15), len(gene_queries), len(clusters), n_representatives)
@@ -1028,14 +1055,15 @@ class AlleleFinder(object):
         #             self.finalized = True
         #             return
 
-        self.xyvals = {}
+        self.xyvals, self.xyarrays = {}, {}
         self.positions_to_plot = {gene : set() for gene in self.counts}
         for gene in genes_to_use:
             if debug:
                 print ' %s %3d count%s' % (utils.color_gene(gene, width=21), self.gene_obs_counts[gene], utils.plural(self.gene_obs_counts[gene]))
-            positions = sorted(self.counts[gene])
-            self.xyvals[gene] = {pos : self.get_allele_finding_xyvals(gene, pos) for pos in positions}
-            positions_to_try_to_fit = [pos for pos in positions if sum(self.xyvals[gene][pos]['obs']) > self.n_muted_min or sum(self.xyvals[gene][pos]['total']) > self.n_total_min]  # ignore positions with neither enough mutations nor total observations
+            self.xyarrays[gene] = self.get_allele_finding_xyarrays(gene)
+            positions = range(len(self.counts[gene]))
+            self.xyvals[gene] = {pos : self.get_allele_finding_xyvals(self.xyarrays[gene], pos) for pos in positions}
+            positions_to_try_to_fit = [pos for pos, ok in zip(positions, (self.xyarrays[gene]['obs'].sum(axis=1) > self.n_muted_min) | (self.xyarrays[gene]['total'].sum(axis=1) > self.n_total_min)) if ok]  # ignore positions with neither enough mutations nor total observations
 
             # if debug and len(positions) > len(positions_to_try_to_fit):
             #     self.print_skip_debug(gene, positions, positions_to_try_to_fit)
@@ -1139,7 +1167,7 @@ class AlleleFinder(object):
                     plotting.make_allele_finding_plot(plotdir + '/' + utils.sanitize_name(gene), gene, position, self.xyvals[gene][position], xmax=self.args.n_max_mutations_per_segment, fitfos=fitfos, new_gene=new_gene)
         else:
             for gene in self.counts:  # we can make plots for the positions we didn't fit, but there's a *lot* of them and they're slow
-                for position in sorted(self.counts[gene]):
+                for position in range(len(self.counts[gene])):
                     both, pre, post = self.get_both_pre_post_vals(gene, istart=self.args.plot_and_fit_absolutely_everything, positions_to_try_to_fit=[position])
                     big_y_icpt, big_y_icpt_err = self.get_big_y(post[position])
                     big_y_icpt_bounds = self.get_big_y_icpt_bounds(big_y_icpt, big_y_icpt_err)
@@ -19,6 +19,8 @@ def ptnprint(partition, **kwargs):
 
 # ----------------------------------------------------------------------------------------
 class ClusterPath(object):
+    default_edge_length = 999999  # when making trees, it's nice to have the edges all set to something that's numeric (so the trees print), but also obvious wrong, if we forget to set somebody
+
     def __init__(self, initial_path_index=0, seed_unique_id=None, partition=None, fname=None, partition_lines=None):  # <partition> is a fully-formed partition, while <partition_lines> is straight from reading a file (perhaps could combine them, but I don't want to think through it now)
         # could probably remove path index since there's very little chance of doing smc in the future, but the path-merging code in glomerator was _very_ difficult to write, so I'm reluctant to nuke it
         self.initial_path_index = initial_path_index  # NOTE this is set to None if it's nonsensical, e.g. if we're merging several paths with different indices
@@ -166,6 +168,8 @@ class ClusterPath(object):
             self.readlines(lines, process_csv=True)
         elif utils.getsuffix(fname) == '.yaml':
             utils.read_yaml_output(fname, cpath=self)
+        elif utils.getsuffix(fname) == '.cols':
+            utils.read_columnar_output(fname, cpath=self, skip_annotations=True)
         else:
             raise Exception('unhandled annotation file suffix %s' % outfname)
 
@@ -461,28 +465,31 @@ class ClusterPath(object):
 
     # ----------------------------------------------------------------------------------------
     # make tree for the single cluster in the last partition of <partitions> (which is in general *not* the last partition in self.partitions, since the calling function stops at self.i_best)
-    def make_single_tree(self, partitions, annotations, uid_set, naive_seq_name, get_fasttrees=False, n_max_cons_seqs=10, debug=False):
-        # NOTE don't call this externally -- if you want a single tree, call make_trees() with <i_only_cluster> set
-        def getline(uidstr, uid_set=None):
-            if uidstr == naive_seq_name:
-                assert False  # shouldn't actually happen (I think)
-            elif uidstr in annotations:  # if we have this exact annotation
-                return annotations[uidstr]
-            else:
-                if uid_set is None:
-                    uid_set = set(uidstr.split(':'))  # should only get called if it's a singleton
-                # note that for internal nodes in a fasttree-derived subtree, the uids will be out of order compared the the annotation keys
-                for line in annotations.values():  # we may actually have the annotation for every subcluster (e.g. if --calculate-alternative-annotations was set), but in case we don't, this is fine
-                    # print uid_set, len(uid_set & set(line['unique_ids']))
-                    if len(uid_set & set(line['unique_ids'])) > 0:  # just take the first one with any overlap. Yeah, it's not necessarily the best, but its naive sequence probably isn't that different, and for just getting the fasttree it reeeeeeaaaallly doesn't matter
-                        return line
-            raise Exception('couldn\'t find uid %s in annotations' % uidstr)
-        def getseq(uid):
-            if uid == naive_seq_name:
-                sorted_lines = sorted([l for l in annotations.values()], key=lambda l: len(l['unique_ids']), reverse=True)  # since we're making a tree, all the annotations are by definition clonal, so it doesn't really matter, but may as well get the naive sequence from the largest one
-                return sorted_lines[0]['naive_seq']
-            else:
-                return utils.per_seq_val(getline(uid), 'seqs', uid)
+    def get_tree_line(self, annotations, naive_seq_name, uidstr, uid_set=None):
+        if uidstr == naive_seq_name:
+            assert False  # shouldn't actually happen (I think)
+        elif uidstr in annotations:  # if we have this exact annotation
+            return annotations[uidstr]
+        else:
+            if uid_set is None:
+                uid_set = set(uidstr.split(':'))  # should only get called if it's a singleton
+            # note that for internal nodes in a fasttree-derived subtree, the uids will be out of order compared the the annotation keys
+            for line in annotations.values():  # we may actually have the annotation for every subcluster (e.g. if --calculate-alternative-annotations was set), but in case we don't, this is fine
+                # print uid_set, len(uid_set & set(line['unique_ids']))
+                if len(uid_set & set(line['unique_ids'])) > 0:  # just take the first one with any overlap. Yeah, it's not necessarily the best, but its naive sequence probably isn't that different, and for just getting the fasttree it reeeeeeaaaallly doesn't matter
+                    return line
+        raise Exception('couldn\'t find uid %s in annotations' % uidstr)
+
+    # ----------------------------------------------------------------------------------------
+    def get_tree_seq(self, annotations, naive_seq_name, uid):
+        if uid == naive_seq_name:
+            sorted_lines = sorted([l for l in annotations.values()], key=lambda l: len(l['unique_ids']), reverse=True)  # since we're making a tree, all the annotations are by definition clonal, so it doesn't really matter, but may as well get the naive sequence from the largest one
+            return sorted_lines[0]['naive_seq']
+        else:
+            return utils.per_seq_val(self.get_tree_line(annotations, naive_seq_name, uid), 'seqs', uid)
+
+    # ----------------------------------------------------------------------------------------
+    def start_single_tree(self, partitions, annotations, uid_set, naive_seq_name, get_fasttrees=False, debug=False):  # make the top of the tree from the merges in <partitions>, and return info for finish_single_tree(), including the fasttree runs that it'll need (so they can be run all at once, for all trees, before calling it)
         def lget(uid_list):
             return ':'.join(uid_list)
 
@@ -492,7 +499,6 @@ class ClusterPath(object):
                 repeated_uids = [u for u, count in collections.Counter([u for c in partition for u in c]).items() if count > 1]
                 raise Exception('found %d uid%s in more than one cluster (%s)' % (len(repeated_uids), utils.plural(len(repeated_uids)), ', '.join(repeated_uids)))
 
-        default_edge_length = 999999  # it's nice to have the edges all set to something that's numeric (so the trees print), but also obvious wrong, if we forget to set somebody
         assert len(partitions[-1]) == 1
         root_label = lget(partitions[-1][0])  # we want the order of the uids in the label to correspond to the order in self.partitions
         tns = dendropy.TaxonNamespace([root_label])
@@ -509,19 +515,37 @@ class ClusterPath(object):
                 for tclust in tclusts:
                     ttaxon = dendropy.Taxon(lget(tclust))
                     tns.add_taxon(ttaxon)
-                    child = lnode.new_child(taxon=ttaxon, edge_length=default_edge_length)
+                    child = lnode.new_child(taxon=ttaxon, edge_length=self.default_edge_length)
                     child.uids = set(tclust)
                 if debug:
                     print '      ipart %d' % ipart
                     print '        split node: %d --> %s      %s --> %s' % (len(lnode.uids), ' '.join([str(len(tc)) for tc in tclusts]), lnode.taxon.label, ' '.join([c.taxon.label for c in lnode.child_node_iter()]))
 
+        fastfos = []  # leaves with more than two uids get a fasttree subtree
+        if get_fasttrees:
+            fastfos = [{'label' : l.taxon.label, 'seqfos' : [{'name' : uid, 'seq' : self.get_tree_seq(annotations, naive_seq_name, uid)} for uid in l.taxon.label.split(':')]} for l in dtree.leaf_node_iter() if len(l.uids) > 2]  # may as well add them in the right order, although I don't think it matters
+        return {'annotations' : annotations, 'uid_set' : uid_set, 'naive_seq_name' : naive_seq_name, 'get_fasttrees' : get_fasttrees, 'dtree' : dtree, 'root_label' : root_label, 'fastfos' : fastfos}
+
+    # ----------------------------------------------------------------------------------------
+    def finish_single_tree(self, tfo, fasttree_strs, n_max_cons_seqs=10, debug=False):  # <tfo> from start_single_tree(), <fasttree_strs>: fasttree newick string for each of tfo['fastfos'] (keyed by label)
+        # NOTE don't call this externally -- if you want trees, call make_trees() (or start_trees() and finish_trees())
+        annotations, uid_set, naive_seq_name, get_fasttrees, dtree, root_label = [tfo[k] for k in ['annotations', 'uid_set', 'naive_seq_name', 'get_fasttrees', 'dtree', 'root_label']]
+        tns = dtree.taxon_namespace
+        def getline(uidstr):
+            return self.get_tree_line(annotations, naive_seq_name, uidstr)
+        def getseq(uid):
+            return self.get_tree_seq(annotations, naive_seq_name, uid)
+        def lget(uid_list):
+            return ':'.join(uid_list)
+        default_edge_length = self.default_edge_length
+
         # split existing leaves, which are probably not singletons (they're probably from the initial naive sequence collapse step) into subtrees such that each leaf is a singleton
         for lnode in dtree.leaf_node_iter():
             if len(lnode.uids) == 1:
                 continue
             if get_fasttrees and len(lnode.uids) > 2:
-                seqfos = [{'name' : uid, 'seq' : getseq(uid)} for uid in lnode.taxon.label.split(':')]  # may as well add them in the right order, although I don't think it matters
-                subtree = treeutils.get_fasttree_tree(seqfos, suppress_internal_node_taxa=True)  # note that the fasttree distances get ignored below (no idea if they'd be better than what we set down there, but they probably wouldn't be consistent, so I'd rather ignore them)
+                seqfos = [{'name' : uid, 'seq' : getseq(uid)} for uid in lnode.taxon.label.split(':')]
+                subtree = treeutils.get_dtree_from_fasttree(fasttree_strs[lnode.taxon.label], [s['name'] for s in seqfos], suppress_internal_node_taxa=True)  # note that the fasttree distances get ignored below (no idea if they'd be better than what we set down there, but they probably wouldn't be consistent, so I'd rather ignore them)
                 for tmpnode in subtree.postorder_node_iter():
                     if tmpnode.is_leaf():
                         tmpnode.uids = set([tmpnode.taxon.label])
@@ -643,30 +667,44 @@ class ClusterPath(object):
         return sub_partitions, sub_annotations
 
     # ----------------------------------------------------------------------------------------
-    def make_trees(self, annotations, i_only_cluster=None, get_fasttrees=False, naive_seq_name='XnaiveX', debug=False):  # makes a tree for each cluster in the most likely (not final) partition
-        # i_only_cluster: only make the tree corresponding to the <i_only_cluster>th cluster in the best partition
+    def start_trees(self, annotations, i_only_clusters=None, get_fasttrees=False, naive_seq_name='XnaiveX', debug=False):  # start trees for each cluster in the most likely (not final) partition, returning a list of info (including the fasttree runs each will need) to pass to finish_trees()
+        # i_only_clusters: only make the trees corresponding to these clusters in the best partition
         if self.i_best is None:
-            return
+            return []
 
         partitions = self.partitions
         if self.seed_unique_id is not None:
             partitions = self.deduplicate_seed_uid(debug=debug)
 
         if debug:
-            print '  making %d tree%s over %d partitions' % (len(partitions[self.i_best]) if i_only_cluster is None else 1, 's' if i_only_cluster is None else '', self.i_best + 1)
+            n_trees = len(partitions[self.i_best]) if i_only_clusters is None else len(i_only_clusters)
+            print '  making %d tree%s over %d partitions' % (n_trees, utils.plural(n_trees), self.i_best + 1)
         if self.trees is None:
             self.trees = [None for _ in partitions[self.i_best]]
         else:
-            assert len(self.trees) == len(partitions[self.i_best])  # presumably because we were already called with <i_only_cluster> set for a different cluster
+            assert len(self.trees) == len(partitions[self.i_best])  # presumably because we were already called with <i_only_clusters> set for different clusters
+        tfos = []
         for i_cluster in range(len(partitions[self.i_best])):
-            if i_only_cluster is not None and i_cluster != i_only_cluster:
+            if i_only_clusters is not None and i_cluster not in i_only_clusters:
                 continue
             uid_set = set(partitions[self.i_best][i_cluster])  # usually the set() isn't doing anything, but sometimes I think we have uids duplicated between clusters, e.g. I think when seed partitioning (or even within a cluster, because order matters within a cluster because of bcrham caching)
             sub_partitions, sub_annotations = self.get_sub_path(uid_set, partitions=partitions, annotations=annotations)
-            self.trees[i_cluster] = self.make_single_tree(sub_partitions, sub_annotations, uid_set, naive_seq_name, get_fasttrees=get_fasttrees, debug=debug)
+            tfos.append(self.start_single_tree(sub_partitions, sub_annotations, uid_set, naive_seq_name, get_fasttrees=get_fasttrees, debug=debug))
+            tfos[-1]['i_cluster'] = i_cluster
+        return tfos
 
     # ----------------------------------------------------------------------------------------
-    def get_single_tree(self, line, get_fasttrees=False, debug=False):  # make tree for <line>
-        i_only_cluster = self.best().index(line['unique_ids'])
-        self.make_trees(annotations=utils.get_annotation_dict([line]), i_only_cluster=i_only_cluster, get_fasttrees=get_fasttrees, debug=debug)
-        return self.trees[i_only_cluster]
+    def finish_trees(self, tfos, fasttree_strs, debug=False):  # <fasttree_strs>: newick string for each fasttree run in <tfos> (keyed by label, which is unique since the clusters are disjoint)
+        for tfo in tfos:
+            self.trees[tfo['i_cluster']] = self.finish_single_tree(tfo, fasttree_strs, debug=debug)
+
+    # ----------------------------------------------------------------------------------------
+    def make_trees(self, annotations, i_only_clusters=None, get_fasttrees=False, naive_seq_name='XnaiveX', n_procs=1, workdir=None, batch_system=None, batch_options=None, tree_cachedir=None, debug=False):  # makes a tree for each cluster in the most likely (not final) partition
+        tfos = self.start_trees(annotations, i_only_clusters=i_only_clusters, get_fasttrees=get_fasttrees, naive_seq_name=naive_seq_name, debug=debug)
+        fastfos = [ffo for tfo in tfos for ffo in tfo['fastfos']]
+        fasttree_strs = {}
+        if len(fastfos) > 0:  # run fasttree for all the trees' leaves at once, so they can go in parallel
+            treestrs = treeutils.run_fasttree_pool(fastfos, workdir=workdir, n_procs=n_procs, batch_system=batch_system, batch_options=batch_options, cachedir=tree_cachedir)
+            fasttree_strs = {ffo['label'] : tstr for ffo, tstr in zip(fastfos, treestrs)}
+        self.finish_trees(tfos, fasttree_strs, debug=debug)
+
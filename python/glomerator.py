@@ -4,6 +4,7 @@ import sys
 import math
 import csv
 import time
+import numpy
 
 import utils
 from clusterpath import ClusterPath
@@ -18,7 +19,7 @@ class Glomerator(object):
 
     # ----------------------------------------------------------------------------------------
     def naive_seq_glomerate(self, naive_seqs, n_clusters, debug=False):
-        """ Perform hierarchical agglomeration (with naive hamming distance as the distance), stopping at <n_clusters> """
+        """ Perform hierarchical agglomeration (with naive hamming distance as the distance), stopping at <n_clusters>. NOTE not currently called from anywhere (it used to divvy queries among procs, but that's now done by PartitionDriver.assign_clusters_to_procs()) """
         start = time.time()
         clusters = [[names,] for names in naive_seqs.keys()]
 
@@ -27,49 +28,47 @@ class Glomerator(object):
         if debug:
             print '  max %d per cluster' % max_per_cluster
 
-        distances = {}  # cache the calculated fractional hamming distances
+        # single linkage: the distance between two clusters is the smallest hamming fraction between any of their sequences, so when we merge two clusters, the merged cluster's distances to the other clusters are just the element-wise min of the two clusters' rows
+        dmatrix = utils.hamming_distance_matrix([naive_seqs[c[0]] for c in clusters], return_fractions=True)  # index in <dmatrix> (and <sizes>, etc.) is the cluster's "slot", which is its index in the initial <clusters>, and when we merge two clusters the merged cluster takes the first one's slot
+        numpy.fill_diagonal(dmatrix, numpy.inf)
+        slot_clusters = list(clusters)
+        sizes = numpy.ones(len(clusters), dtype=int)
+        alive = numpy.ones(len(clusters), dtype=bool)
+        list_order = numpy.arange(len(clusters))  # order of each slot's cluster in <clusters>, where merged clusters go at the end (we only use this to break ties, in order to get the same results as the old version that looped over itertools.combinations(clusters, 2))
 
         # ----------------------------------------------------------------------------------------
-        def get_clusters_to_merge():
-            smallest_min_distance, clusters_to_merge = None, None
-            n_skipped = 0
-            for clust_a, clust_b in itertools.combinations(clusters, 2):  # find the two clusters which contain the pair of sequences which are closest in hamming fraction (skipping cluster pairs that would make a cluster that's too big)
-                if len(clust_a) + len(clust_b) > max_per_cluster and not glomerate.merge_whatever_you_got:  # merged cluster would be too big, so look for smaller (albeit further-apart) things to merge
-                    n_skipped += 1
-                    continue
-                min_distance = None  # find the smallest hamming distance between any two sequences in the two clusters
-                for query_a in clust_a:
-                    for query_b in clust_b:
-                        joint_key = query_a + ';' + query_b  #';'.join([query_a, query_b])
-                        if joint_key not in distances:
-                            distances[joint_key] = utils.hamming_fraction(naive_seqs[query_a], naive_seqs[query_b])
-                            distances[query_b + ';' + query_a] = distances[joint_key]  # also add with key in reverse order, in case we run into the pair that way later on
-                        if min_distance is None or distances[joint_key] < min_distance:
-                            min_distance = distances[joint_key]
-                if smallest_min_distance is None or min_distance < smallest_min_distance:
-                    smallest_min_distance = min_distance
-                    clusters_to_merge = (clust_a, clust_b)
-
-            if debug and n_skipped > 0:
-                print '      skipped: %d ' % n_skipped
-
-            return clusters_to_merge
+        def get_clusters_to_merge():  # find the two clusters which contain the pair of sequences which are closest in hamming fraction (skipping cluster pairs that would make a cluster that's too big)
+            allowed = alive[:, None] & alive[None, :]
+            if not glomerate.merge_whatever_you_got:  # merged cluster would be too big, so look for smaller (albeit further-apart) things to merge
+                allowed &= sizes[:, None] + sizes[None, :] <= max_per_cluster
+            tmpdists = numpy.where(allowed, dmatrix, numpy.inf)
+            min_distance = tmpdists.min()
+            if min_distance == numpy.inf:
+                return None
+            slot_pairs = [sorted(p, key=lambda s: list_order[s]) for p in zip(*numpy.nonzero(tmpdists == min_distance))]
+            return min(slot_pairs, key=lambda p: (list_order[p[0]], list_order[p[1]]))  # the first one in list order
 
         # ----------------------------------------------------------------------------------------
         def glomerate():
             if debug:
-                print '    current ', ' '.join([str(len(cl)) for cl in clusters])
-            clusters_to_merge = get_clusters_to_merge()
-            if clusters_to_merge is None:  # if we didn't find a suitable pair
+                print '    current ', ' '.join([str(sizes[s]) for s in sorted(numpy.flatnonzero(alive), key=lambda s: list_order[s])])
+            slots_to_merge = get_clusters_to_merge()
+            if slots_to_merge is None:  # if we didn't find a suitable pair
                 if debug:
                     print '    didn\'t find shiznitz'
                 glomerate.merge_whatever_you_got = True  # next time through, merge whatever's best regardless of size
             else:
+                sa, sb = slots_to_merge
                 if debug:
-                    print '    merging', len(clusters_to_merge[0]), len(clusters_to_merge[1])
-                clusters.append(clusters_to_merge[0] + clusters_to_merge[1])
-                clusters.remove(clusters_to_merge[0])
-                clusters.remove(clusters_to_merge[1])
+                    print '    merging', sizes[sa], sizes[sb]
+                slot_clusters[sa] = slot_clusters[sa] + slot_clusters[sb]
+                slot_clusters[sb] = None
+                dmatrix[sa, :] = numpy.minimum(dmatrix[sa, :], dmatrix[sb, :])
+                dmatrix[:, sa] = dmatrix[sa, :]
+                dmatrix[sa, sa] = numpy.inf
+                sizes[sa] += sizes[sb]
+                alive[sb] = False
+                list_order[sa] = list_order.max() + 1
 
         # ----------------------------------------------------------------------------------------
         def homogenize():
@@ -92,9 +91,10 @@ class Glomerator(object):
         # da bizniz
         glomerate.merge_whatever_you_got = False  # merge the best pair, even if together they'll be to big
 
-        while len(clusters) > n_clusters:
+        while numpy.count_nonzero(alive) > n_clusters:
             glomerate()
-        
+        clusters = [slot_clusters[s] for s in sorted(numpy.flatnonzero(alive), key=lambda s: list_order[s])]
+
         if len(clusters) > 1:  # homogenize if partition is non-trivial
             clusters.sort(key=len)
 
@@ -253,8 +253,16 @@ def run_bios2mds(n_components, n_clusters, seqfos, base_workdir, seed, aligned=F
     return partition
 
 # ----------------------------------------------------------------------------------------
-def run_sklearn_mds(n_components, n_clusters, seqfos, seed, reco_info=None, region=None, aligned=False, n_init=4, max_iter=300, eps=1e-3, n_jobs=-1, plotdir=None, debug=False):
+def triangulate_landmark_coords(landmark_pos, landmark_dists, dists_to_landmarks):  # landmark mds (de silva & tenenbaum 2004): place each seq using its (squared) distances to the landmarks, whose positions we already have
+    lmean = landmark_pos.mean(axis=0)
+    pinv = numpy.linalg.pinv(landmark_pos - lmean)  # n_components x n_landmarks (works for any centered embedding, since the constant terms are orthogonal to it)
+    mean_sq_dists = (landmark_dists**2).mean(axis=0)
+    return lmean - 0.5 * numpy.dot(dists_to_landmarks**2 - mean_sq_dists, pinv.T)
+
+# ----------------------------------------------------------------------------------------
+def run_sklearn_mds(n_components, n_clusters, seqfos, seed, reco_info=None, region=None, aligned=False, n_init=4, max_iter=300, eps=1e-3, n_jobs=-1, max_full_size=2000, n_landmarks=500, plotdir=None, debug=False):
     # NOTE set <n_components> to None to run plain kmeans, without mds TODO clean this up
+    # if there's more than <max_full_size> seqs, we only calculate distances to <n_landmarks> randomly chosen landmark seqs, run mds on the landmarks, then triangulate the rest (for plain kmeans, we cluster on the distances to the landmarks)
 
     start = time.time()
     assert n_clusters is not None
@@ -270,28 +278,32 @@ def run_sklearn_mds(n_components, n_clusters, seqfos, seed, reco_info=None, regi
             print 'align'
         seqfos = utils.align_many_seqs(seqfos)
 
-    if debug:
-        print '  distances'
-    # translations = string.maketrans('ACGT-', '01234')
-    # def convert(seq):
-    #     return [int(c) for c in seq.translate(translations)]
-    # converted_seqs = [convert(x['seq']) for x in seqfos]
-    # similarities = scipy.spatial.distance.pdist(converted_seqs, 'hamming')
-    # similarities = scipy.spatial.distance.squareform(similarities)
-    similarities = scipy.spatial.distance.squareform([utils.hamming_fraction(seqfos[i]['seq'], seqfos[j]['seq']) for i in range(len(seqfos)) for j in range(i + 1, len(seqfos))])
     random_state = numpy.random.RandomState(seed=seed)
+    seqs = [sfo['seq'] for sfo in seqfos]
+    use_landmarks = len(seqfos) > max_full_size
+    if debug:
+        print '  distances%s' % (' to %d landmarks' % n_landmarks if use_landmarks else '')
+    if use_landmarks:
+        ilandmarks = numpy.sort(random_state.choice(len(seqfos), size=min(n_landmarks, len(seqfos)), replace=False))
+        similarities = utils.hamming_distance_matrix(seqs, seqlist2=[seqs[i] for i in ilandmarks], return_fractions=True)  # n_seqs x n_landmarks
+    else:
+        similarities = utils.hamming_distance_matrix(seqs, return_fractions=True)
 
     pos = None
     if n_components is not None:
         if debug:
             print '  mds'
         mds = sys.modules['sklearn'].manifold.MDS(n_components=n_components, n_init=n_init, max_iter=max_iter, eps=eps, random_state=random_state, dissimilarity="precomputed", n_jobs=n_jobs)
-        pos = mds.fit_transform(similarities)
+        if use_landmarks:
+            landmark_dists = similarities[ilandmarks]
+            pos = triangulate_landmark_coords(mds.fit_transform(landmark_dists), landmark_dists, similarities)
+        else:
+            pos = mds.fit_transform(similarities)
         # pos = mds.fit(similarities).embedding_
 
     if debug:
         print '    kmeans clustering with %d clusters' % n_clusters
-    kmeans = sys.modules['sklearn'].cluster.KMeans(n_clusters=n_clusters, random_state=random_state).fit(pos if pos is not None else similarities)
+    kmeans = sys.modules['sklearn'].cluster.KMeans(n_clusters=n_clusters, random_state=random_state).fit(pos if pos is not None else similarities)  # reuses the same distance matrix (or, with landmarks, the distances to the landmarks) for plain kmeans
     pcvals = {seqfos[iseq]['name'] : pos[iseq] if pos is not None else None for iseq in range(len(seqfos))}
     labels = {seqfos[iseq]['name'] : kmeans.labels_[iseq] for iseq in range(len(seqfos))}
     partition = utils.group_seqs_by_value(pcvals.keys(), lambda q: labels[q])
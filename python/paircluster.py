@@ -213,7 +213,18 @@ def concat_heavy_chain(lpairs, lp_infos, dont_deep_copy=False):  # yeah yeah thi
     return glfos, antn_lists, joint_cpaths
 
 # ----------------------------------------------------------------------------------------
-def find_seq_pairs(antn_lists, ig_or_tr='ig'):
+def get_uid_antn_index(antn_lists, require_unique=False):  # map from each uid in <antn_lists> (dict keyed by locus) to (locus, annotation, index of uid in annotation), so we don't have to go searching through all the annotations for each uid
+    uid_index = {}
+    for ltmp, alist in antn_lists.items():
+        for antn in alist:
+            for iseq, uid in enumerate(antn['unique_ids']):
+                if require_unique and uid in uid_index:  # if you don't set <require_unique>, uids in more than one annotation point to the last one
+                    raise Exception('uid %s in more than one annotation (sizes %d and %d, loci %s and %s)' % (uid, len(uid_index[uid][1]['unique_ids']), len(antn['unique_ids']), uid_index[uid][0], ltmp))
+                uid_index[uid] = (ltmp, antn, iseq)
+    return uid_index
+
+# ----------------------------------------------------------------------------------------
+def find_seq_pairs(antn_lists, ig_or_tr='ig', uid_index=None):
     # ----------------------------------------------------------------------------------------
     def handle_atntn(ltmp, antn):
         for iseq, (tid, pids, iseq) in enumerate(zip(antn['unique_ids'], antn['paired-uids'], antn['input_seqs'])):
@@ -221,16 +232,16 @@ def find_seq_pairs(antn_lists, ig_or_tr='ig'):
             if len(pids) == 0:  # add all the unpaired seqs
                 ofo = {'%s_id'%tstr : tid, '%s_locus'%tstr : ltmp, '%s_seq'%tstr : iseq, '%s_id'%ostr : '', '%s_locus'%ostr : '', '%s_seq'%ostr : ''}
             elif len(pids) == 1 and tstr == 'h':  # write h/l pairs when <ltmp> is the h locus
-                lfo = all_seqs.get(pids[0], '')  # it really should be in there, but whatever i don't want to crash if it isn't
-                ofo = {'h_id' : tid, 'h_locus' : ltmp, 'h_seq' : iseq, 'l_id' : pids[0], 'l_locus' : lfo['locus'], 'l_seq' : lfo['seq']}
+                l_locus, l_antn, l_iseq = uid_index[pids[0]]  # it really should be in there
+                ofo = {'h_id' : tid, 'h_locus' : ltmp, 'h_seq' : iseq, 'l_id' : pids[0], 'l_locus' : l_locus, 'l_seq' : l_antn['input_seqs'][l_iseq]}
             else:
                 continue
             ofo['h_antn'] = antn
-            ofo['l_antn'] = all_antns[ofo['l_id']]
+            ofo['l_antn'] = uid_index[ofo['l_id']][1]
             outfos.append(ofo)
     # ----------------------------------------------------------------------------------------
-    all_seqs = {u : {'seq' : s, 'locus' : l} for l, alist in antn_lists.items() for a in alist for u, s in zip(a['unique_ids'], a['input_seqs'])}
-    all_antns = {u : l for llist in antn_lists.values() for l in llist for u in l['unique_ids']}
+    if uid_index is None:
+        uid_index = get_uid_antn_index(antn_lists)
     outfos = []
     for ltmp in sorted(antn_lists):
         for antn in antn_lists[ltmp]:
@@ -273,7 +284,8 @@ def find_cluster_pairs(lp_infos, lpair, antn_lists=None, required_keys=None, qui
         print '          sizes'
         print '          h   l    l index'
     n_skipped = {k : 0 for k in required_keys + ['zero-len-paired-uids', 'too-small']}
-    unpaired_l_clusts = [c for c in l_part]
+    l_clids = utils.get_cluster_ids([u for c in l_part for u in c], l_part)  # uid --> index of its cluster(s) in <l_part>, so we don't have to look through every light cluster for each heavy cluster
+    unpaired_l_iclusts = set(range(len(l_part)))
     for h_clust in h_part:
         h_atn = h_atn_dict[':'.join(h_clust)]
 
@@ -281,24 +293,25 @@ def find_cluster_pairs(lp_infos, lpair, antn_lists=None, required_keys=None, qui
             for rk in set(required_keys) - set(h_atn):
                 n_skipped[rk] += 1
             continue
-        if len(getpids(h_atn)) == 0:
+        h_pids = getpids(h_atn)
+        if len(h_pids) == 0:
             n_skipped['zero-len-paired-uids'] += 1
             continue
 
-        l_clusts = [c for c in l_part if len(set(getpids(h_atn)) & set(c)) > 0]
+        l_iclusts = sorted(set(i for p in h_pids for i in l_clids.get(p, [])))  # sorted, so they're in the same order as <l_part>
+        l_clusts = [l_part[i] for i in l_iclusts]
         if len(l_clusts) != 1:
             if not quiet:
-                l_overlaps = [set(getpids(h_atn)) & set(c) for c in l_clusts]
-                print '  %s found %d light clusters (rather than 1) for heavy cluster with size %d (%d pids) (overlaps: %s)' % (utils.color('yellow', 'warning'), len(l_clusts), len(h_clust), len(getpids(h_atn)), ' '.join(str(len(o)) for o in l_overlaps))
+                l_overlaps = [set(h_pids) & set(c) for c in l_clusts]
+                print '  %s found %d light clusters (rather than 1) for heavy cluster with size %d (%d pids) (overlaps: %s)' % (utils.color('yellow', 'warning'), len(l_clusts), len(h_clust), len(h_pids), ' '.join(str(len(o)) for o in l_overlaps))
                 print '         h clust %s' % ':'.join(utils.color('blue_bkg', u) for u in h_clust)
                 for il, lct in enumerate(l_clusts):
-                    tpids = getpids(h_atn)
-                    print '        %s %s' % ('l clusts' if il==0 else '        ', ':'.join(utils.color('blue_bkg' if u in tpids else None, u) for u in lct))
+                    print '        %s %s' % ('l clusts' if il==0 else '        ', ':'.join(utils.color('blue_bkg' if u in h_pids else None, u) for u in lct))
             continue
         assert len(l_clusts) == 1
         if ':'.join(l_clusts[0]) not in l_atn_dict:
             print '      %s missing annotation for light chain (size %d, paired with size %d) when finding cluster pairs%s%s' % (utils.color('yellow', 'warning'), len(l_clusts[0]), len(h_clust), ' '+':'.join(l_clusts[0]) if len(l_clusts[0])<30 else '', ' '+':'.join(h_clust) if len(h_clust) < 30 else '')
-            unpaired_l_clusts.remove(l_clusts[0])  # i guess i want to remove it from here? i guess we know who it's paired with, but there's no annotation so we can't do anything with it
+            unpaired_l_iclusts.remove(l_iclusts[0])  # i guess i want to remove it from here? i guess we know who it's paired with, but there's no annotation so we can't do anything with it
             continue
         l_atn = l_atn_dict[':'.join(l_clusts[0])]
         if min_cluster_size is not None and any(len(l['unique_ids']) < min_cluster_size for l in [h_atn, l_atn]):
@@ -307,11 +320,11 @@ def find_cluster_pairs(lp_infos, lpair, antn_lists=None, required_keys=None, qui
         h_atn['loci'] = [lpair[0] for _ in h_atn['unique_ids']]  # this kind of sucks, but it seems like the best option a.t.m. (see note in event.py)
         l_atn['loci'] = [lpair[1] for _ in l_atn['unique_ids']]
         lp_antn_pairs.append((h_atn, l_atn))
-        unpaired_l_clusts.remove(l_clusts[0])
+        unpaired_l_iclusts.remove(l_iclusts[0])
         if debug:
-            print '        %3d %3d   %3d' % (len(h_clust), len(l_clusts[0]), l_part.index(l_clusts[0]))
-    if len(unpaired_l_clusts) > 0:
-        print '    %s: %d unpaired light cluster%s after finding h/l cluster pairs' % ('+'.join(lpair), len(unpaired_l_clusts), utils.plural(len(unpaired_l_clusts)))
+            print '        %3d %3d   %3d' % (len(h_clust), len(l_clusts[0]), l_iclusts[0])
+    if len(unpaired_l_iclusts) > 0:
+        print '    %s: %d unpaired light cluster%s after finding h/l cluster pairs' % ('+'.join(lpair), len(unpaired_l_iclusts), utils.plural(len(unpaired_l_iclusts)))
         # this is just too verbose atm (and hopefully not necessary?)
         # for lc in unpaired_l_clusts:
         #     if ':'.join(lc) not in l_atn_dict:
@@ -488,11 +501,11 @@ def untranslate_pids(ploci, init_partitions, antn_lists, l_translations, joint_p
         antn_dict[ch] = utils.get_annotation_dict(antn_lists[ploci[ch]])
 
 # ----------------------------------------------------------------------------------------
-def pair_unpaired_seqs_with_paired_family(ploci, unpaired_seqs, cluster_pairs, antn_lists, debug=False):
+def pair_unpaired_seqs_with_paired_family(ploci, unpaired_seqs, cluster_pairs, uid_index, debug=False):  # <uid_index>: from get_uid_antn_index() on the h and l single chain annotations (with require_unique set)
     # note that at this point these are *single* chain annotations, and/since we've only just made the joint partition
     # ----------------------------------------------------------------------------------------
     def get_pids(atn, uid):
-        pds = atn['paired-uids'][atn['unique_ids'].index(uid)]
+        pds = atn['paired-uids'][uid_index[uid][2]]
         assert len(pds) in [0, 1]  # just to make sure
         return pds
     # ----------------------------------------------------------------------------------------
@@ -519,7 +532,7 @@ def pair_unpaired_seqs_with_paired_family(ploci, unpaired_seqs, cluster_pairs, a
         print '        size     recipr    N fixed         %s   %s' % tuple(utils.wfmt(s, 2*mlen, jfmt='-') for s, mlen in zip(('heavy', 'light'), max_lens))
         print '       h     l   paired    h     l       %s%s   %s%s' % tuple(utils.wfmt(s, mlen, jfmt='-') for mlen in max_lens for s in ['before', 'after'])
     # ----------------------------------------------------------------------------------------
-    all_atns = {u : utils.get_single_entry([l for l in antn_lists[ploci[tch]] if u in l['unique_ids']]) for cp in cluster_pairs for tch, c in zip('hl', cp) for u in c}
+    all_atns = {u : uid_index[u][1] for cp in cluster_pairs for c in cp for u in c}
     for cpair in cluster_pairs:
         h_atns, l_atns = [[all_atns[u] for u in tclust] for c, tclust in zip('hl', cpair)]
         all_pids = {u : get_pids(l, u) for tclust, alist in zip(cpair, (h_atns, l_atns)) for u, l in zip(tclust, alist)}
@@ -532,7 +545,7 @@ def pair_unpaired_seqs_with_paired_family(ploci, unpaired_seqs, cluster_pairs, a
         for tch, unlist, oklist in zip('hl', unp_ids, ok_ids):
             for unid in unlist:
                 nearid = unpaired_seqs[ploci[tch]][unid]['nearest-paired']  # pair all unpaired seqs with their nearest paired seq (which i think makes sense since the paired seqs are the ones that are providing the actual information about what family the unpaired seqs are paired with)
-                all_atns[unid]['paired-uids'][all_atns[unid]['unique_ids'].index(unid)] = [all_pids[nearid][0]]
+                all_atns[unid]['paired-uids'][uid_index[unid][2]] = [all_pids[nearid][0]]
         if debug:
             after_pids = {u : get_pids(l, u) for tclust, alist in zip(cpair, (h_atns, l_atns)) for u, l in zip(tclust, alist)}
             bcstrs, acstrs = [cstrs(cpair, pdlist) for pdlist in (all_pids, after_pids)]
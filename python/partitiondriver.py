@@ -12,6 +12,7 @@ import random
 from collections import OrderedDict
 from subprocess import Popen, check_call, PIPE, CalledProcessError, check_output
 import copy
+import shutil
 import multiprocessing
 import operator
 import traceback
@@ -31,6 +32,7 @@ from performanceplotter import PerformancePlotter
 from partitionplotter import PartitionPlotter
 from hist import Hist
 import seqfileopener
+from profiler import Profiler, profiled
 
 # ----------------------------------------------------------------------------------------
 class PartitionDriver(object):
@@ -44,11 +46,16 @@ class PartitionDriver(object):
 
         utils.prep_dir(self.args.workdir)
         self.my_gldir = self.args.workdir + '/' + glutils.glfo_dir
+        self.resident_glfo = None  # if set, this glfo is already written to self.my_gldir, and we leave it there between bcrham steps (see cluster_with_bcrham())
 
         self.vs_info, self.sw_info = None, None
+        self.sw_rerun_cache = None  # per-query info from the previous sw pass, so the next one (during parameter caching) only needs to rerun queries affected by germline changes
         self.duplicates = {}
         self.bcrham_proc_info = None
         self.timing_info = []  # it would be really nice to clean up both this and bcrham_proc_info
+        self.profiler = Profiler()  # per-stage time/memory info, written to --timeline-fname
+        self.predicted_proc_costs = None  # if using --bcrham-load-balancing cost-model, predicted (relative) cost for each proc in the current step
+        self.load_balance_info = []  # predicted vs actual per-proc times for each step (for tuning the cost model)
         self.istep = None  # stupid hack to get around network file system issues (see self.subworkidr()
         self.subworkdirs = []  # arg. same stupid hack
 
@@ -63,6 +70,7 @@ class PartitionDriver(object):
         self.hmm_cachefname = self.args.workdir + '/hmm_cached_info.csv'
         self.hmm_outfname = self.args.workdir + '/hmm_output.csv'
         self.cpath_progress_dir = '%s/cluster-path-progress' % self.args.workdir  # write the cluster paths for each clustering step to separate files in this dir
+        self.checkpoint_state = None  # if --resume is set, clustering state from the checkpoint in --checkpoint-dir (see write_checkpoint())
 
         if self.args.outfname is not None:
             utils.prep_dir(dirname=None, fname=self.args.outfname, allow_other_files=True)
@@ -124,7 +132,11 @@ class PartitionDriver(object):
         self.all_actions = actions
         for tmpaction in actions:
             self.current_action = tmpaction  # NOTE gets changed on the fly below, I think just in self.get_annotations_for_partitions() (which is kind of hackey, but I can't figure out a way to improve on it that wouldn't involve wasting a foolish amount of time rewriting things. Bottom line is that the control flow for different actions is really complicated, and that complexity is going to show up somewhere)
+            self.profiler.start(tmpaction, n_items=len(self.input_info) if self.input_info is not None else None)
             self.action_fcns[tmpaction]()
+            self.profiler.stop(tmpaction)
+        if self.args.timeline_fname is not None:
+            self.profiler.write(self.args.timeline_fname)
 
     # ----------------------------------------------------------------------------------------
     def clean(self):
@@ -191,7 +203,8 @@ class PartitionDriver(object):
                 raise Exception('--persistent-cachefname %s has unexpected header list %s' % (self.args.persistent_cachefname, reader.fieldnames))
 
     # ----------------------------------------------------------------------------------------
-    def run_waterer(self, count_parameters=False, write_parameters=False, write_cachefile=False, look_for_cachefile=False, require_cachefile=False, dbg_str=''):
+    @profiled('sw')
+    def run_waterer(self, count_parameters=False, write_parameters=False, write_cachefile=False, look_for_cachefile=False, require_cachefile=False, incremental=False, keep_rerun_cache=False, dbg_str=''):  # <incremental>: carry forward results from the previous pass for unaffected queries; <keep_rerun_cache>: keep the info that the next pass needs to do that
         print 'smith-waterman%s' % (('  (%s)' % dbg_str) if dbg_str != '' else '')
         sys.stdout.flush()
 
@@ -204,7 +217,8 @@ class PartitionDriver(object):
                           count_parameters=count_parameters,
                           parameter_out_dir=self.sw_param_dir if write_parameters else None,
                           plot_annotation_performance=self.args.plot_annotation_performance,
-                          duplicates=self.duplicates, pre_failed_queries=pre_failed_queries, aligned_gl_seqs=self.aligned_gl_seqs, vs_info=self.vs_info)
+                          duplicates=self.duplicates, pre_failed_queries=pre_failed_queries, aligned_gl_seqs=self.aligned_gl_seqs, vs_info=self.vs_info,
+                          rerun_cache=self.sw_rerun_cache if incremental and not self.args.full_sw_reruns else None, keep_rerun_cache=keep_rerun_cache and not self.args.full_sw_reruns)
 
         cache_path = self.sw_cache_path(find_any=require_cachefile)
         cachefname = cache_path + ('.yaml' if self.args.sw_cachefname is None else utils.getsuffix(self.args.sw_cachefname))  # use yaml, unless csv was explicitly set on the command line
@@ -224,6 +238,8 @@ class PartitionDriver(object):
 
         self.sw_info = waterer.info
         self.sw_glfo = waterer.glfo  # ick
+        self.sw_rerun_cache = waterer.rerun_cache  # None unless <keep_rerun_cache> is set (and we actually ran sw)
+        self.profiler.add_info(n_items=len(self.sw_info['queries']), label=dbg_str)
         for uid, dupes in waterer.duplicates.items():  # <waterer.duplicates> is <self.duplicates> OR'd into any new duplicates from this run
             self.duplicates[uid] = dupes
 
@@ -255,16 +271,19 @@ class PartitionDriver(object):
 
         # remove unlikely alleles (can only remove v alleles here, since we're using vsearch annotations, but that's ok since it's mostly a speed optimization)
         if not self.args.dont_remove_unlikely_alleles:
+            self.profiler.start('remove-unlikely-alleles')
             self.set_vsearch_info(get_annotations=(self.args.debug_allele_finding and self.args.is_simu))  # we only use the annotations to print some debug info in alleleremover
             alremover = AlleleRemover(self.glfo, self.args, simglfo=self.simglfo, reco_info=self.reco_info)
             alremover.finalize({'v' : self.vs_info['gene-counts']}, annotations=(None if len(self.vs_info['annotations']) == 0 else self.vs_info['annotations']), debug=self.args.debug_allele_finding)
             glutils.remove_genes(self.glfo, alremover.genes_to_remove)
             self.vs_info = None  # don't want to keep this around, since it has alignments against all the genes we removed (also maybe memory control)
             alremover = None  # memory control (not tested)
+            self.profiler.stop('remove-unlikely-alleles')
 
         # (re-)add [new] alleles
         if self.args.allele_cluster:
-            self.run_waterer(dbg_str='new-allele clustering')
+            self.profiler.start('allele-clustering')
+            self.run_waterer(incremental=True, keep_rerun_cache=True, dbg_str='new-allele clustering')
             alclusterer = AlleleClusterer(self.args, glfo=self.glfo, reco_info=self.reco_info, simglfo=self.simglfo)
             alcluster_alleles = alclusterer.get_alleles(self.sw_info, debug=self.args.debug_allele_finding, plotdir=None if self.args.plotdir is None else self.args.plotdir + '/sw/alcluster')
             if len(alcluster_alleles) > 0:
@@ -272,9 +291,11 @@ class PartitionDriver(object):
                 if self.aligned_gl_seqs is not None:
                     glutils.add_missing_alignments(self.glfo, self.aligned_gl_seqs, debug=True)
             alclusterer = None
+            self.profiler.stop('allele-clustering', n_new_alleles=len(alcluster_alleles))
 
         if not self.args.dont_find_new_alleles:
-            self.run_waterer(dbg_str='new-allele fitting')
+            self.profiler.start('allele-finding')
+            self.run_waterer(incremental=True, keep_rerun_cache=True, dbg_str='new-allele fitting')
             alfinder = AlleleFinder(self.glfo, self.args)
             new_allele_info = alfinder.increment_and_finalize(self.sw_info, debug=self.args.debug_allele_finding)  # incrementing and finalizing are intertwined since it needs to know the distribution of 5p and 3p deletions before it can increment
             if self.args.plotdir is not None:
@@ -284,9 +305,10 @@ class PartitionDriver(object):
                 glutils.add_new_alleles(self.glfo, new_allele_info, debug=True, simglfo=self.simglfo, use_template_for_codon_info=False)  # <remove_template_genes> stuff is handled in <new_allele_info> (also note, can't use template for codon info since we may have already removed it)
                 if self.aligned_gl_seqs is not None:
                     glutils.add_missing_alignments(self.glfo, self.aligned_gl_seqs, debug=True)
+            self.profiler.stop('allele-finding', n_new_alleles=len(new_allele_info))
 
         # get and write sw parameters
-        self.run_waterer(count_parameters=True, write_parameters=True, write_cachefile=True, dbg_str='writing parameters')
+        self.run_waterer(count_parameters=True, write_parameters=True, write_cachefile=True, incremental=True, dbg_str='writing parameters')
         self.write_hmms(self.sw_param_dir)  # note that this modifies <self.glfo>
         if self.args.only_smith_waterman:
             if self.args.outfname is not None:  # NOTE this is _not_ identical to the sw cache file (e.g. padding, failed query writing, plus probably other stuff)
@@ -328,9 +350,11 @@ class PartitionDriver(object):
             self.write_hmms(self.final_multi_paramdir)  # note that this modifies <self.glfo>
 
     # ----------------------------------------------------------------------------------------
+    @profiled('tree-metrics')
     def calc_tree_metrics(self, annotation_dict, annotation_list=None, cpath=None):
         if annotation_list is None:
             annotation_list = annotation_dict.values()
+        self.profiler.add_info(n_items=len(annotation_list))
         if self.current_action == 'get-selection-metrics' and self.args.input_metafnames is not None:  # presumably if you're running 'get-selection-metrics' with --input-metafnames set, that means you didn't add the affinities (+ other metafo) when you partitioned, so we need to add it now
             seqfileopener.read_input_metafo(self.args.input_metafnames, annotation_list)
         if self.args.seed_unique_id is not None:  # restrict to seed cluster in the best partition (clusters from non-best partition have duplicate uids, which then make fasttree barf, and it doesn't seem worth the trouble to fix it now)
@@ -340,7 +364,7 @@ class PartitionDriver(object):
         treeutils.add_smetrics(self.args, self.args.selection_metrics_to_calculate, annotation_dict, self.args.lb_tau, cpath=cpath, reco_info=self.reco_info, treefname=self.args.treefname,
                                use_true_clusters=self.reco_info is not None, base_plotdir=self.args.plotdir, ete_path=self.args.ete_path, workdir=self.args.workdir,
                                outfname=self.args.selection_metric_fname, only_use_best_partition=self.args.only_print_best_partition, glfo=self.glfo, gctree_outdir=None if self.args.outfname is None or not self.args.run_gctree else os.path.dirname(utils.fpath(self.args.outfname)),
-                               debug=self.args.debug)
+                               tree_cachedir=self.args.tree_cachedir, debug=self.args.debug)
 
     # ----------------------------------------------------------------------------------------
     def parse_existing_annotations(self, annotation_list, ignore_args_dot_queries=False, process_csv=False):
@@ -486,10 +510,10 @@ class PartitionDriver(object):
                 if 'unique_ids' not in reader.fieldnames:
                     raise Exception('not an annotation file: %s' % outfname)
                 annotation_list = list(reader)
-        elif utils.getsuffix(outfname) == '.yaml':  # new way
+        elif utils.getsuffix(outfname) in ['.yaml', '.cols']:  # new way
             # NOTE replaces <self.glfo>, which is definitely what we want (that's the point of putting glfo in the yaml file), but it's still different behavior than if reading a csv
             assert self.glfo is None  # make sure bin/partis successfully figured out that we would be reading the glfo from the yaml output file
-            self.glfo, annotation_list, cpath = utils.read_yaml_output(outfname, n_max_queries=self.args.n_max_queries, dont_add_implicit_info=True, seed_unique_id=self.args.seed_unique_id)  # add implicit info below, so we can skip some of 'em
+            self.glfo, annotation_list, cpath = utils.read_output(outfname, n_max_queries=self.args.n_max_queries, dont_add_implicit_info=True, seed_unique_id=self.args.seed_unique_id)  # add implicit info below, so we can skip some of 'em
         else:
             raise Exception('unhandled annotation file suffix %s' % outfname)
 
@@ -537,19 +561,28 @@ class PartitionDriver(object):
     def partition(self):
         """ Partition sequences in <self.input_info> into clonally related lineages """
         print 'partitioning     (with %s)' % self.sub_param_dir
+        if self.args.checkpoint_dir is not None and not self.args.resume and os.path.exists(self.checkpoint_fname('state')):  # otherwise we'd remove it in cluster_with_bcrham(), and it could represent a lot of work
+            raise Exception('found checkpoint from a previous run in --checkpoint-dir %s, but --resume isn\'t set (either set --resume to restart from it, or remove the dir/choose a different one to start from scratch)' % self.args.checkpoint_dir)
         if self.sw_info is None:
             self.run_waterer(look_for_cachefile=not self.args.write_sw_cachefile, write_cachefile=self.args.write_sw_cachefile, count_parameters=False)  # self.args.count_parameters)  # run smith-waterman
-        if len(self.sw_info['queries']) == 0:
+        if len(self.sw_info['queries']) == 0 and self.args.existing_output_fname is None:
             if self.args.outfname is not None:
                 self.write_output([], set())
             return
         if self.args.only_smith_waterman:
             return
+        if self.args.resume:
+            self.checkpoint_state = self.read_checkpoint()
+        if self.args.existing_output_fname is not None:
+            self.add_to_existing_partition()
+            return
 
         print 'hmm'
 
         # pre-cache hmm naive seq for each single query NOTE <self.current_action> is still 'partition' for this (so that we build the correct bcrham command line)
-        if self.args.persistent_cachefname is None or not os.path.exists(self.hmm_cachefname):  # if the default (no persistent cache file), or if a not-yet-existing persistent cache file was specified
+        if self.checkpoint_state is not None:
+            print '  --resume: using naive sequences from checkpoint hmm cache file'  # restored in cluster_with_bcrham()
+        elif self.args.persistent_cachefname is None or not os.path.exists(self.hmm_cachefname):  # if the default (no persistent cache file), or if a not-yet-existing persistent cache file was specified
             print 'caching all %d naive sequences' % len(self.sw_info['queries'])  # this used to be a speed optimization, but now it's so we have better naive sequences for the pre-bcrham collapse
             if self.args.synthetic_distance_based_partition:
                 self.write_fake_cache_file([[q] for q in self.sw_info['queries']])
@@ -568,6 +601,96 @@ class PartitionDriver(object):
         self.get_annotations_for_partitions(cpath)
 
         self.check_partition(cpath.partitions[cpath.i_best])
+        self.remove_checkpoint()
+
+    # ----------------------------------------------------------------------------------------
+    def read_existing_families(self):  # read the best partition and its annotations from --existing-output-fname (and also return, for each uid, the annotation that it's in plus its index in that annotation)
+        _, antn_list, cpath = utils.read_output(self.args.existing_output_fname, skip_failed_queries=True)  # NOTE the annotations have implicit info added with the file's glfo, but we check below that its genes are all in ours
+        partition = cpath.best() if cpath is not None else utils.get_partition_from_annotation_list(antn_list)
+        overlap = set(self.input_info) & set(u for c in partition for u in c)
+        if len(overlap) > 0:
+            raise Exception('%d uid%s from --infname already in --existing-output-fname %s: %s' % (len(overlap), utils.plural(len(overlap)), self.args.existing_output_fname, ' '.join(sorted(overlap)[:10])))
+        missing_genes = set(l[r + '_gene'] for l in antn_list for r in utils.regions) - set(g for r in utils.regions for g in self.glfo['seqs'][r])
+        if len(missing_genes) > 0:
+            raise Exception('genes in --existing-output-fname %s not in current germline set (you probably want to use the same --parameter-dir as for the existing output): %s' % (self.args.existing_output_fname, ' '.join(utils.color_gene(g) for g in sorted(missing_genes))))
+        antn_dict = utils.get_annotation_dict(antn_list)
+        uid_antns = {u : (line, iseq) for line in antn_list for iseq, u in enumerate(line['unique_ids'])}  # families whose annotation isn't under their own key (e.g. if the hmm failed on them) get their seqs from here
+        missing_uids = set(u for c in partition for u in c) - set(uid_antns)
+        if len(missing_uids) > 0:
+            raise Exception('%d uid%s in the best partition in --existing-output-fname %s %s in any annotation (e.g. it was written with --dont-calculate-annotations), so we don\'t have their sequences: %s' % (len(missing_uids), utils.plural(len(missing_uids)), self.args.existing_output_fname, 'isn\'t' if len(missing_uids) == 1 else 'aren\'t', ' '.join(sorted(missing_uids)[:10])))
+        print '  --existing-output-fname: read %d families with %d seqs from %s' % (len(partition), sum(len(c) for c in partition), self.args.existing_output_fname)
+        return partition, antn_dict, uid_antns
+
+    # ----------------------------------------------------------------------------------------
+    def find_affected_families(self, partition, antn_dict):  # return indices (in <partition>) of existing families with the same cdr3 length as, and naive hfrac less than the upper naive hamming bound to, at least one new sequence, i.e. that could possibly merge with a new seq (plus any families without their own annotation)
+        hfrac_max = self.get_hfrac_bounds(self.sub_param_dir)[1]
+        fam_lines, new_lines = {}, {}  # cdr3 length : list of (family index, annotation), and same for new seqs (but without the index)
+        affected_families = set()
+        for ifam, cluster in enumerate(partition):
+            if ':'.join(cluster) in antn_dict:
+                line = antn_dict[':'.join(cluster)]
+                fam_lines.setdefault(line['cdr3_length'], []).append((ifam, line))
+            else:  # it can be missing e.g. if the hmm failed on it, in which case we don't know its naive seq, and anyway we'd need to reannotate it, so it has to go through sw and clustering with the new seqs
+                affected_families.add(ifam)
+        n_unannotated = len(affected_families)
+        if n_unannotated > 0:
+            print '    %d existing famil%s without annotations will be rerun with the new seqs' % (n_unannotated, 'y' if n_unannotated == 1 else 'ies')
+        for query in self.sw_info['queries']:
+            new_lines.setdefault(self.sw_info[query]['cdr3_length'], []).append(self.sw_info[query])
+        for cdr3_length, nlines in new_lines.items():
+            if cdr3_length not in fam_lines:
+                continue
+            flines = [l for _, l in fam_lines[cdr3_length]]
+            n_left = min(l['codon_positions']['v'] for l in flines + nlines)  # compare the same stretch of sequence around the cdr3 (sw and hmm naive seqs have different padding)
+            n_right = min(len(l['naive_seq']) - l['codon_positions']['v'] - cdr3_length for l in flines + nlines)
+            def trimseq(line):
+                return line['naive_seq'][line['codon_positions']['v'] - n_left : line['codon_positions']['v'] + cdr3_length + n_right]
+            fseqs = [trimseq(l) for l in flines]
+            for nline in nlines:
+                hfracs = utils.hamming_distances_to_seq(trimseq(nline), fseqs, return_fractions=True)
+                affected_families |= set(fam_lines[cdr3_length][i][0] for i in numpy.flatnonzero(hfracs <= hfrac_max))
+        return affected_families
+
+    # ----------------------------------------------------------------------------------------
+    def add_to_existing_partition(self):  # add the new seqs in <self.input_info> to the families in --existing-output-fname: only families that could merge with a new seq (plus the new seqs) go through clustering, while the rest are left exactly as they were (along with their annotations)
+        partition, antn_dict, uid_antns = self.read_existing_families()
+        affected_families = self.find_affected_families(partition, antn_dict)
+        untouched_partition = [c for i, c in enumerate(partition) if i not in affected_families]
+        affected_partition = [partition[i] for i in sorted(affected_families)]
+        new_queries = list(self.sw_info['queries'])
+        print '    %d / %d existing families (with %d / %d seqs) are close enough to at least one of the %d new seqs to cluster with them' % (len(affected_partition), len(partition), sum(len(c) for c in affected_partition), sum(len(c) for c in partition), len(new_queries))
+
+        if len(affected_partition) > 0:  # add the affected families' seqs to the input info, and rerun sw on them together with the new seqs (so all the sw info, e.g. padding, is consistent)
+            for cluster in affected_partition:
+                for uid in cluster:
+                    line, iseq = uid_antns[uid]
+                    self.input_info[uid] = {'unique_ids' : [uid], 'seqs' : [line['input_seqs'][iseq]]}
+                    for mkey in [k for k in utils.input_metafile_keys.values() if k in line]:
+                        self.input_info[uid][mkey] = [line[mkey][iseq]]
+                    if 'duplicates' in line and len(line['duplicates'][iseq]) > 0:
+                        self.duplicates[uid] = line['duplicates'][iseq]
+            self.sw_info = None
+            self.run_waterer(dbg_str='new seqs plus affected families')
+        sw_queries = set(self.sw_info['queries'])
+        new_queries = [q for q in new_queries if q in sw_queries]  # a few could have been removed as duplicates of seqs in the affected families
+
+        new_clusters = []
+        if len(sw_queries) > 0:
+            print 'hmm'
+            print 'caching all %d naive sequences' % len(sw_queries)
+            self.run_hmm('viterbi', self.sub_param_dir, precache_all_naive_seqs=True)
+            initial_partition = []
+            for cluster in affected_partition:  # existing families start as single clusters (but split by sw cdr3 length, since bcrham needs it to be the same within each cluster)
+                sw_cluster = [u for u in cluster if u in sw_queries]
+                if len(sw_cluster) > 0:
+                    initial_partition += utils.group_seqs_by_value(sw_cluster, lambda u: self.sw_info[u]['cdr3_length'])
+            if len(new_queries) > 0:
+                initial_partition += utils.collapse_naive_seqs(self.synth_sw_info(new_queries), split_by_cdr3=True)
+            new_clusters = self.cluster_with_bcrham(initial_partition=initial_partition).best()
+
+        final_cpath = ClusterPath(seed_unique_id=self.args.seed_unique_id, partition=untouched_partition + new_clusters)
+        self.get_annotations_for_partitions(final_cpath, existing_annotations={':'.join(c) : antn_dict[':'.join(c)] for c in untouched_partition if ':'.join(c) in antn_dict})
+        self.remove_checkpoint()
 
     # ----------------------------------------------------------------------------------------
     def split_seeded_clusters(self, old_cpath):  # NOTE similarity to clusterpath.remove_unseeded_clusters()
@@ -668,44 +791,7 @@ class PartitionDriver(object):
             print 'merging shared clusters'
             cpath.print_partitions()
 
-        # find every pair of clusters that has some overlap
-        cluster_groups = []
-        if debug:
-            print ' making cluster_groups'
-        for iclust in range(len(partition)):
-            for jclust in range(iclust + 1, len(partition)):
-                if len(set(partition[iclust]) & set(partition[jclust])) > 0:
-                    if debug:
-                        print '  %d %d' % (iclust, jclust)
-                    cluster_groups.append(set([iclust, jclust]))
-
-        # merge these pairs of clusters into groups
-        while True:
-            no_more_merges = True
-            for cp1, cp2 in itertools.combinations(cluster_groups, 2):
-                if len(cp1 & cp2) > 0:
-                    if debug:
-                        print '  merging %s and %s' % (cp1, cp2)
-                    cluster_groups.append(cp1 | cp2)
-                    cluster_groups.remove(cp1)
-                    cluster_groups.remove(cp2)
-                    no_more_merges = False
-                    break  # we've modified it now, so we have to go back and remake the iterator
-            if no_more_merges:
-                break
-
-        # actually merge the groups of clusters
-        new_clusters = []
-        for cgroup in cluster_groups:
-            new_clusters.append(list(set([uid for iclust in cgroup for uid in partition[iclust]])))
-        if debug:
-            print ' removing'
-        for iclust in sorted([i for cgroup in cluster_groups for i in cgroup], reverse=True):
-            if debug:
-                print '    %d' % iclust
-            partition.pop(iclust)
-        for nclust in new_clusters:
-            partition.append(nclust)
+        partition[:] = utils.merge_overlapping_clusters(partition, debug=debug)  # modify in place, so it's still cpath's best partition
 
         if debug:
             cpath.print_partitions()
@@ -731,9 +817,9 @@ class PartitionDriver(object):
         return synth_sw_info
 
     # ----------------------------------------------------------------------------------------
-    def init_cpath(self, n_procs):
+    def init_cpath(self, n_procs, initial_partition=None):  # <initial_partition>: start from this instead of collapsing identical naive seqs
         initial_nseqs = len(self.sw_info['queries'])  # NOTE um, maybe I should change this to the number of clusters, now that we're doing some preclustering here?
-        initial_nsets = utils.collapse_naive_seqs(self.synth_sw_info(self.sw_info['queries']), split_by_cdr3=True, debug=True)
+        initial_nsets = utils.collapse_naive_seqs(self.synth_sw_info(self.sw_info['queries']), split_by_cdr3=True, debug=True) if initial_partition is None else initial_partition
         cpath = ClusterPath(seed_unique_id=self.args.seed_unique_id)
         cpath.add_partition(initial_nsets, logprob=0., n_procs=n_procs)  # NOTE sw info excludes failed sequences (and maybe also sequences with different cdr3 length)
         os.makedirs(self.cpath_progress_dir)
@@ -787,13 +873,20 @@ class PartitionDriver(object):
         return merged_cp
 
     # ----------------------------------------------------------------------------------------
-    def cluster_with_bcrham(self):
+    @profiled('clustering')
+    def cluster_with_bcrham(self, initial_partition=None):
         tmpstart = time.time()
         self.set_force_args = False  # annoying shenanigans to make sure that if both --seed-unique-id and either of --n-final-clusters or --min-largest-cluster-size are set, that the "force" args are set in bcrham *before* we remove unseeded seqs
         n_procs = self.args.n_procs
-        cpath, initial_nseqs = self.init_cpath(n_procs)
-        self.n_proc_list = []
-        self.istep = 0
+        if self.checkpoint_state is None:
+            cpath, initial_nseqs = self.init_cpath(n_procs, initial_partition=initial_partition)
+            self.n_proc_list = []
+            self.istep = 0
+            self.remove_checkpoint()  # don't want to leave around anything from a previous run (there can't be a state file at this point, see partition(), but there could be e.g. files from a run killed while writing its first checkpoint)
+        else:
+            cpath, initial_nseqs, n_procs = self.restore_checkpoint()
+        glutils.write_glfo(self.my_gldir, self.glfo)  # write the germline files once for all the clustering steps (rather than rewriting and removing them for each step)
+        self.resident_glfo = self.glfo
         start = time.time()
         while n_procs > 0:
             if n_procs > len(cpath.bmx()):
@@ -806,6 +899,9 @@ class PartitionDriver(object):
                 break
             n_procs, cpath = self.prepare_next_iteration(cpath, initial_nseqs)
             self.istep += 1
+            self.write_checkpoint(cpath, n_procs, initial_nseqs)
+        glutils.remove_glfo_files(self.my_gldir, self.args.locus)
+        self.resident_glfo = None
 
         if self.args.max_cluster_size is not None:
             print '   --max-cluster-size (partitiondriver): merging shared clusters'
@@ -814,8 +910,87 @@ class PartitionDriver(object):
         cpath = self.merge_cpaths_from_previous_steps(cpath)
 
         print '      loop time: %.1f' % (time.time()-start)
+        self.profiler.add_info(n_items=sum(len(c) for c in cpath.best()), n_steps=len(self.n_proc_list))
         return cpath
 
+    # ----------------------------------------------------------------------------------------
+    def checkpoint_fname(self, ftype, istep=None):
+        if ftype == 'state':
+            return '%s/state.json' % self.args.checkpoint_dir
+        elif ftype == 'hmm-cache':
+            return '%s/hmm-cache.csv' % self.args.checkpoint_dir
+        elif ftype == 'cpath-progress':
+            return '%s/cluster-path-progress/istep-%d.csv' % (self.args.checkpoint_dir, istep)
+        else:
+            assert False
+
+    # ----------------------------------------------------------------------------------------
+    def write_checkpoint(self, cpath, n_procs, initial_nseqs):  # write everything we need to restart clustering at the start of step <self.istep>: the partition we're about to run on, the n procs schedule and other step-to-step state, the rng states, plus copies of the hmm cache file and cpath progress files
+        # ----------------------------------------------------------------------------------------
+        def copy_file(fname, ckfname):  # copy to a tmp file, then move it into place, so we never leave a partially-written file if we get killed
+            shutil.copyfile(fname, ckfname + '.tmp')
+            os.rename(ckfname + '.tmp', ckfname)
+        # ----------------------------------------------------------------------------------------
+        if self.args.checkpoint_dir is None:
+            return
+        start = time.time()
+        utils.prep_dir(os.path.dirname(self.checkpoint_fname('cpath-progress', istep=0)), allow_other_files=True)
+        for istep in range(self.istep):  # the earlier ones should already be there, but they're small
+            copy_file(self.get_cpath_progress_fname(istep), self.checkpoint_fname('cpath-progress', istep=istep))
+        copy_file(self.hmm_cachefname, self.checkpoint_fname('hmm-cache'))
+        np_rstate = numpy.random.get_state()
+        state = {'random_seed' : self.args.random_seed, 'queries' : utils.uidhashstr(':'.join(sorted(self.sw_info['queries']))), 'partition' : cpath.bmx(),
+                 'istep' : self.istep, 'n_procs' : n_procs, 'n_proc_list' : self.n_proc_list, 'initial_nseqs' : initial_nseqs, 'set_force_args' : self.set_force_args,
+                 'unseeded_seqs' : self.unseeded_seqs, 'small_cluster_seqs' : self.small_cluster_seqs, 'timing_info' : self.timing_info, 'bcrham_proc_info' : self.bcrham_proc_info,
+                 'naive_hamming_bounds' : self.cached_naive_hamming_bounds, 'random_state' : random.getstate(), 'numpy_random_state' : [np_rstate[0], np_rstate[1].tolist()] + list(np_rstate[2:])}
+        with open(self.checkpoint_fname('state') + '.tmp', 'w') as ckfile:  # the state file goes last, so it only points to a step once all that step's files are in place
+            json.dump(state, ckfile)
+        os.rename(self.checkpoint_fname('state') + '.tmp', self.checkpoint_fname('state'))
+        print '      wrote checkpoint for step %d to %s (%.1f sec)' % (self.istep, self.args.checkpoint_dir, time.time() - start)
+
+    # ----------------------------------------------------------------------------------------
+    def read_checkpoint(self):
+        if not os.path.exists(self.checkpoint_fname('state')):
+            print '  --resume: no checkpoint in %s, so starting from scratch' % self.args.checkpoint_dir
+            return None
+        with open(self.checkpoint_fname('state')) as ckfile:
+            state = json.load(ckfile)
+        print '  --resume: read checkpoint for clustering step %d from %s' % (state['istep'], self.args.checkpoint_dir)
+        if state['random_seed'] != self.args.random_seed:
+            print '    setting --random-seed to checkpoint value %d (was %d), so bcrham does the same thing as it would have without the interruption' % (state['random_seed'], self.args.random_seed)
+            self.args.random_seed = state['random_seed']
+        return state
+
+    # ----------------------------------------------------------------------------------------
+    def restore_checkpoint(self):  # set up the state at the start of the checkpoint step (in cluster_with_bcrham()), i.e. the opposite of write_checkpoint()
+        def strlist(ulist):  # json gives us unicode
+            return None if ulist is None else [str(u) for u in ulist]
+        state = self.checkpoint_state
+        if state['queries'] != utils.uidhashstr(':'.join(sorted(self.sw_info['queries']))):
+            raise Exception('queries passing smith-waterman differ from those in checkpoint %s (make sure you\'re running the same command, on the same input, as before)' % self.args.checkpoint_dir)
+        os.makedirs(self.cpath_progress_dir)
+        for istep in range(state['istep']):
+            shutil.copyfile(self.checkpoint_fname('cpath-progress', istep=istep), self.get_cpath_progress_fname(istep))
+        shutil.copyfile(self.checkpoint_fname('hmm-cache'), self.hmm_cachefname)
+        self.istep, self.n_proc_list, self.set_force_args = state['istep'], state['n_proc_list'], state['set_force_args']
+        self.unseeded_seqs, self.small_cluster_seqs = strlist(state['unseeded_seqs']), strlist(state['small_cluster_seqs'])
+        self.timing_info, self.bcrham_proc_info = state['timing_info'], state['bcrham_proc_info']
+        if state['naive_hamming_bounds'] is not None:
+            self.cached_naive_hamming_bounds = state['naive_hamming_bounds']
+        random.setstate((state['random_state'][0], tuple(state['random_state'][1]), state['random_state'][2]))
+        np_rstate = state['numpy_random_state']
+        numpy.random.set_state((np_rstate[0], numpy.array(np_rstate[1], dtype=numpy.uint32)) + tuple(np_rstate[2:]))
+        self.checkpoint_state = None  # only want to resume once
+        print '    resuming clustering at step %d with %d clusters and %d proc%s' % (self.istep, len(state['partition']), state['n_procs'], utils.plural(state['n_procs']))
+        return ClusterPath(seed_unique_id=self.args.seed_unique_id, partition=[strlist(c) for c in state['partition']]), state['initial_nseqs'], state['n_procs']
+
+    # ----------------------------------------------------------------------------------------
+    def remove_checkpoint(self):
+        if self.args.checkpoint_dir is None or not os.path.exists(self.args.checkpoint_dir):
+            return
+        utils.prep_dir(self.args.checkpoint_dir, wildlings=['state.json*', 'hmm-cache.csv*', 'istep-*.csv*'], subdirs=['cluster-path-progress'], rm_subdirs=True)
+        os.rmdir(self.args.checkpoint_dir)
+
     # ----------------------------------------------------------------------------------------
     def check_partition(self, partition):
         uids = set([uid for cluster in partition for uid in cluster])
@@ -865,7 +1040,8 @@ class PartitionDriver(object):
         return antn_dict, set()  # maybe empty set for hmm failures makes sense since we're not actually running hmm?
 
     # ----------------------------------------------------------------------------------------
-    def get_annotations_for_partitions(self, cpath):  # we used to try to have glomerator.cc try to guess what annoations to write (using ::WriteAnnotations()), but now we go back and rerun a separate bcrham process just to get the annotations we want, partly for that control, but also partly because we typically want all these annotations calculated without any uid translation.
+    @profiled('annotate-partition')
+    def get_annotations_for_partitions(self, cpath, existing_annotations=None):  # <existing_annotations>: annotations (keyed by uid str) for clusters in <cpath> that we don't need to recalculate NOTE we used to try to have glomerator.cc try to guess what annoations to write (using ::WriteAnnotations()), but now we go back and rerun a separate bcrham process just to get the annotations we want, partly for that control, but also partly because we typically want all these annotations calculated without any uid translation.
         # ----------------------------------------------------------------------------------------
         def get_clusters_to_annotate():
             clusters_to_annotate = cpath.best()
@@ -901,7 +1077,13 @@ class PartitionDriver(object):
             return
         self.added_extra_clusters_to_annotate = False
         clusters_to_annotate = get_clusters_to_annotate()
-        if len(clusters_to_annotate) == 0:
+        if existing_annotations is None:
+            existing_annotations = {}
+        elif len(existing_annotations) > 0:
+            clusters_to_annotate = [c for c in clusters_to_annotate if ':'.join(c) not in existing_annotations]
+            print '    using %d existing cluster annotation%s' % (len(existing_annotations), utils.plural(len(existing_annotations)))
+        self.profiler.add_info(n_items=len(clusters_to_annotate))
+        if len(clusters_to_annotate) == 0 and len(existing_annotations) == 0:
             print '  no final clusters'
             return
         action_cache = self.current_action  # hackey, but probably not worth trying (more) to improve
@@ -909,11 +1091,14 @@ class PartitionDriver(object):
         clusters_to_annotate = sorted(clusters_to_annotate, key=len, reverse=True)  # as opposed to in clusterpath, where we *don't* want to sort by size, it's nicer to have them sorted by size here, since then as you're scanning down a long list of cluster annotations you know once you get to the singletons you won't be missing something big
         n_procs = min(self.args.n_procs, len(clusters_to_annotate))  # we want as many procs as possible, since the large clusters can take a long time (depending on if we're translating...), but in general we treat <self.args.n_procs> as the maximum allowable number of processes
         print 'getting annotations for final partition%s%s' % (' (including additional clusters)' if len(clusters_to_annotate) > len(cpath.best()) else '', ' (with star tree annotation since --subcluster-annotation-size is None)' if self.args.subcluster_annotation_size is None else '')
-        if self.args.use_sw_annotations or self.args.naive_vsearch:
+        if len(clusters_to_annotate) == 0:  # only existing annotations
+            all_annotations, hmm_failures = OrderedDict(), set()
+        elif self.args.use_sw_annotations or self.args.naive_vsearch:
             print '    using sw annotations (to make a multi-seq annotation for each cluster) instead of running hmm since either --use-sw-annotations or --naive-vsearch/--fast were set'
             all_annotations, hmm_failures = self.convert_sw_annotations(clusters_to_annotate)
         else:
             _, all_annotations, hmm_failures = self.run_hmm('viterbi', self.sub_param_dir, n_procs=n_procs, partition=clusters_to_annotate, count_parameters=self.args.count_parameters, parameter_out_dir=self.final_multi_paramdir, dont_print_annotations=True)  # have to print annotations below so we can also print the cpath
+        all_annotations.update(existing_annotations)
         if self.args.get_selection_metrics:
             self.calc_tree_metrics(all_annotations, cpath=cpath)  # adds tree metrics to <annotations>
 
@@ -973,6 +1158,7 @@ class PartitionDriver(object):
         return cached_naive_seqs
 
     # ----------------------------------------------------------------------------------------
+    @profiled('naive-vsearch')
     def cluster_with_naive_vsearch_or_swarm(self, parameter_dir=None):
         start = time.time()
 
@@ -986,18 +1172,18 @@ class PartitionDriver(object):
             naive_seq_list.append((uid, cached_naive_seqs[uid]))
 
         all_naive_seqs, naive_seq_hashes = utils.collapse_naive_seqs_with_hashes(naive_seq_list, self.sw_info)
+        self.profiler.add_info(n_items=len(naive_seq_list))
 
         print '    using hfrac bound for vsearch %.3f' % threshold
 
+        cdr3_lengths = sorted(all_naive_seqs)  # one vsearch run for each cdr3 length class (small classes are packed together into jobs that run vsearch once for each class), with up to --n-procs jobs at a time
+        print '    running vsearch %d times (once for each cdr3 length class, %d at a time)' % (len(cdr3_lengths), self.args.n_procs)
+        sys.stdout.flush()
+        hash_partitions = utils.run_vsearch_cluster_batches([all_naive_seqs[c] for c in cdr3_lengths], self.args.workdir + '/vsearch', threshold, n_procs=self.args.n_procs, vsearch_binary=self.args.vsearch_binary)
+
         partition = []
-        print '    running vsearch %d times (once for each cdr3 length class):' % len(all_naive_seqs),
-        for cdr3_length, sub_naive_seqs in all_naive_seqs.items():
-            sub_hash_partition = utils.run_vsearch('cluster', sub_naive_seqs, self.args.workdir + '/vsearch', threshold, vsearch_binary=self.args.vsearch_binary)
-            sub_uid_partition = [[uid for hashstr in hashcluster for uid in naive_seq_hashes[cdr3_length][hashstr]] for hashcluster in sub_hash_partition]
-            partition += sub_uid_partition
-            print '.',
-            sys.stdout.flush()
-        print ''
+        for cdr3_length, hash_partition in zip(cdr3_lengths, hash_partitions):
+            partition += [[uid for hashstr in hashcluster for uid in naive_seq_hashes[cdr3_length][hashstr]] for hashcluster in hash_partition]
 
         ccfs = [None, None]
         if not self.args.is_data:  # it's ok to always calculate this since it's only ever for one partition
@@ -1052,7 +1238,7 @@ class PartitionDriver(object):
         cmd_str += ' --outfile ' + csv_outfname
         cmd_str += ' --locus ' + self.args.locus
         cmd_str += ' --random-seed ' + str(self.args.random_seed)
-        if n_procs > 1:  # only cache vals for sequence sets with newly-calculated vals (initial cache file is copied to each subdir)
+        if n_procs > 1:  # only cache vals for sequence sets with newly-calculated vals (all the subprocs read the initial cache file in place, and each writes its new vals to its own subdir, which we then append to the initial file)
             cmd_str += ' --only-cache-new-vals'
 
         if self.args.dont_rescale_emissions:
@@ -1142,10 +1328,10 @@ class PartitionDriver(object):
         def get_outfname(iproc):
             return self.hmm_outfname.replace(self.args.workdir, self.subworkdir(iproc, n_procs))
         # ----------------------------------------------------------------------------------------
-        def get_cmd_str(iproc):  # all this does at this point is replace workdir with sub-workdir in hmm input, output, and cache file arguments
+        def get_cmd_str(iproc):  # all this does at this point is replace workdir with sub-workdir in hmm input, output, and output cache file arguments (the input cache file is shared, i.e. read in place by all subprocs)
             strlist = cmd_str.split()
             for istr in range(len(strlist)):
-                if strlist[istr] == self.hmm_infname or strlist[istr] == self.hmm_cachefname or strlist[istr] == self.hmm_outfname:
+                if strlist[istr] == self.hmm_infname or strlist[istr] == self.hmm_outfname or (strlist[istr] == self.hmm_cachefname and strlist[istr - 1] == '--output-cachefname'):
                     strlist[istr] = strlist[istr].replace(self.args.workdir, self.subworkdir(iproc, n_procs))
             return ' '.join(strlist)
 
@@ -1161,6 +1347,7 @@ class PartitionDriver(object):
                   for iproc in range(n_procs)]
         utils.run_cmds(cmdfos, batch_system=self.args.batch_system, batch_options=self.args.batch_options, batch_config_fname=self.args.batch_config_fname, debug='print' if self.args.debug else None)
         self.print_partition_dbgfo()
+        self.check_load_balance()
 
         self.check_wait_times(time.time()-start)
         sys.stdout.flush()
@@ -1365,6 +1552,7 @@ class PartitionDriver(object):
         return None, OrderedDict([(skey(l['unique_ids']), l) for l in annotation_list]), all_hmm_failures
 
     # ----------------------------------------------------------------------------------------
+    @profiled('hmm')
     def run_hmm(self, algorithm, parameter_in_dir, parameter_out_dir='', count_parameters=False, n_procs=None, precache_all_naive_seqs=False, partition=None, shuffle_input=False, is_subcluster_recursed=False, dont_print_annotations=False):
         """ 
         Run bcrham, possibly with many processes, and parse and interpret the output.
@@ -1381,13 +1569,15 @@ class PartitionDriver(object):
             if len(nsets) < n_procs:
                 # print '  note: reducing N procs to the number of nsets %d --> %d' % (n_procs, len(nsets))
                 n_procs = len(nsets)
+        self.profiler.add_info(algorithm=algorithm, n_items=len(nsets), n_procs=n_procs, istep=self.istep if self.current_action == 'partition' else None, precache=precache_all_naive_seqs)
 
         if self.args.subcluster_annotation_size is not None and algorithm == 'viterbi' and not is_subcluster_recursed and not precache_all_naive_seqs and any(self.subcl_split(len(c)) for c in nsets):
             assert not shuffle_input
             return self.run_subcluster_annotate(nsets, parameter_in_dir, count_parameters=count_parameters, parameter_out_dir=parameter_out_dir, dont_print_annotations=dont_print_annotations, debug=self.args.debug)
 
         self.write_to_single_input_file(self.hmm_infname, nsets, parameter_in_dir, shuffle_input=shuffle_input)  # single file gets split up later if we've got more than one process
-        glutils.write_glfo(self.my_gldir, self.glfo)
+        if self.resident_glfo is not self.glfo:
+            glutils.write_glfo(self.my_gldir, self.glfo)
         if time.time() - start > 0.1:
             print '        hmm prep time: %.1f' % (time.time() - start)
 
@@ -1400,7 +1590,8 @@ class PartitionDriver(object):
         self.execute(cmd_str, n_procs)
         exec_time = time.time() - exec_start
 
-        glutils.remove_glfo_files(self.my_gldir, self.args.locus)
+        if self.resident_glfo is not self.glfo:
+            glutils.remove_glfo_files(self.my_gldir, self.args.locus)
 
         cpath, annotations, hmm_failures = None, None, None
         if self.current_action == 'partition' or n_procs > 1:
@@ -1419,6 +1610,7 @@ class PartitionDriver(object):
             print '         infra time: %.1f' % (step_time - exec_time)  # i.e. time for non-executing, infrastructure time
         print '      hmm step time: %.1f' % step_time
         self.timing_info.append({'exec' : exec_time, 'total' : step_time})  # NOTE in general, includes pre-cache step
+        self.profiler.add_info(exec_wall=exec_time)
 
         return cpath, annotations, hmm_failures
 
@@ -1645,21 +1837,15 @@ class PartitionDriver(object):
             return open(self.subworkdir(siproc, n_procs) + '/' + os.path.basename(infname), mode)
         def get_writer(sub_outfile):
             return csv.DictWriter(sub_outfile, reader.fieldnames, delimiter=' ')
-        def copy_cache_files(n_procs):
-            cmdfos = [{'cmd_str' : 'cp ' + self.hmm_cachefname + ' ' + self.subworkdir(iproc, n_procs) + '/',
-                       'workdir' : self.subworkdir(iproc, n_procs),
-                       'outfname' : self.subworkdir(iproc, n_procs) + '/' + os.path.basename(self.hmm_cachefname)}
-                      for iproc in range(n_procs)]
-            utils.run_cmds(cmdfos)
-
-        # initialize output/cache files
+
+        proc_assignments = self.assign_clusters_to_procs(info, n_procs, debug=self.args.debug)
+
+        # initialize output files (we used to also copy the whole cache file to each subdir, but now the subprocs read it in place, see get_hmm_cmd_str())
         for iproc in range(n_procs):
             utils.prep_dir(self.subworkdir(iproc, n_procs))
             sub_outfile = get_sub_outfile(iproc, 'w')
             get_writer(sub_outfile).writeheader()
             sub_outfile.close()  # can't leave 'em all open the whole time 'cause python has the thoroughly unreasonable idea that one oughtn't to have thousands of files open at once
-        if self.current_action == 'partition' and os.path.exists(self.hmm_cachefname):  # copy cachefile to this subdir (first clause is just for so when we're getting cluster annotations we don't copy over the cache files)
-            copy_cache_files(n_procs)
 
         seed_clusters_to_write = seeded_clusters.keys()  # the keys in <seeded_clusters> that we still need to write
         for iproc in range(n_procs):
@@ -1679,11 +1865,74 @@ class PartitionDriver(object):
 
             # then loop over the non-seeded clusters
             for iquery in range(len(info)):
-                if iquery % n_procs != iproc:
+                if proc_assignments[iquery] != iproc:
                     continue
                 writer.writerow(info[iquery])
             sub_outfile.close()
 
+    # ----------------------------------------------------------------------------------------
+    def assign_clusters_to_procs(self, info, n_procs, pair_cost_factor=0.05, debug=False):  # return list with the index of the proc to which we send each line in <info> (each of which is a bcrham input line, i.e. a cluster)
+        self.predicted_proc_costs = None
+        if self.current_action != 'partition' or self.args.bcrham_load_balancing == 'round-robin':
+            return [iquery % n_procs for iquery in range(len(info))]
+
+        # estimate cost for each cluster: calculating naive seqs and logprobs is roughly linear in (subsampled) cluster size times sequence length
+        costs = []
+        for line in info:
+            seqs = line['seqs'].split(':')
+            costs.append(min(len(seqs), self.args.biggest_logprob_cluster_to_calculate) * len(seqs[0]))
+        # ----------------------------------------------------------------------------------------
+        def chunk_cost(cost_sum, n_clusters):  # ...plus a term for the pairwise comparisons among clusters with the same cdr3 length that end up in the same proc (this is where the neighborhood density comes in)
+            return cost_sum * (1. + pair_cost_factor * n_clusters)
+
+        # group clusters into chunks of the same cdr3 length: bcrham can only merge clusters with the same cdr3 length, so we want to keep them together, but if a cdr3 class is too expensive for one chunk we have to split it up (since we shuffle the input each step, the chunks are different each time)
+        cdr3_classes = OrderedDict()
+        for iquery, line in enumerate(info):
+            if line['cdr3_length'] not in cdr3_classes:
+                cdr3_classes[line['cdr3_length']] = []
+            cdr3_classes[line['cdr3_length']].append(iquery)
+        max_chunk_cost = sum(chunk_cost(sum(costs[i] for i in iqs), len(iqs)) for iqs in cdr3_classes.values()) / (2. * n_procs)  # half the mean per-proc cost, so there's enough chunks for the bin packing to even things out
+        chunks = []  # list of (cost, list of query indices)
+        for iqlist in cdr3_classes.values():
+            cost_sum, chunk = 0., []
+            for iquery in iqlist:
+                if len(chunk) > 0 and chunk_cost(cost_sum + costs[iquery], len(chunk) + 1) > max_chunk_cost:
+                    chunks.append((chunk_cost(cost_sum, len(chunk)), chunk))
+                    cost_sum, chunk = 0., []
+                cost_sum += costs[iquery]
+                chunk.append(iquery)
+            chunks.append((chunk_cost(cost_sum, len(chunk)), chunk))
+
+        # longest processing time first: give each chunk (in order of decreasing cost) to the proc with the smallest total so far
+        proc_assignments = [None for _ in info]
+        self.predicted_proc_costs = [0. for _ in range(n_procs)]
+        for ccost, chunk in sorted(chunks, key=operator.itemgetter(0), reverse=True):
+            iproc = min(range(n_procs), key=lambda i: self.predicted_proc_costs[i])
+            for iquery in chunk:
+                proc_assignments[iquery] = iproc
+            self.predicted_proc_costs[iproc] += ccost
+        if debug:
+            print '    assigned %d clusters in %d chunks (%d cdr3 lengths) to %d procs with predicted costs: %s' % (len(info), len(chunks), len(cdr3_classes), n_procs, ' '.join('%.0f' % c for c in self.predicted_proc_costs))
+
+        return proc_assignments
+
+    # ----------------------------------------------------------------------------------------
+    def check_load_balance(self):  # compare the predicted per-proc costs from assign_clusters_to_procs() to the actual times that bcrham reported
+        if self.predicted_proc_costs is None or self.bcrham_proc_info is None:
+            return
+        actual_times = [procinfo['time']['bcrham'] for procinfo in self.bcrham_proc_info]
+        predicted_costs = self.predicted_proc_costs
+        self.predicted_proc_costs = None
+        if None in actual_times or len(actual_times) != len(predicted_costs) or sum(predicted_costs) == 0.:
+            return
+        time_per_cost = sum(actual_times) / sum(predicted_costs)  # scale factor converting cost units to seconds (assuming the model's shape is right)
+        predicted_times = [time_per_cost * c for c in predicted_costs]
+        self.load_balance_info.append({'istep' : self.istep, 'predicted' : predicted_times, 'actual' : actual_times, 'time_per_cost' : time_per_cost})
+        print '          load balance:  max/mean per-proc time  predicted %.2f  actual %.2f' % (max(predicted_times) / numpy.mean(predicted_times), max(actual_times) / numpy.mean(actual_times) if sum(actual_times) > 0. else float('nan'))
+        if self.args.debug:
+            print '               predicted: %s' % ' '.join('%6.1f' % t for t in predicted_times)
+            print '                  actual: %s' % ' '.join('%6.1f' % t for t in actual_times)
+
     # ----------------------------------------------------------------------------------------
     def merge_subprocess_files(self, fname, n_procs, include_outfile=False):
         subfnames = []
@@ -1733,6 +1982,10 @@ class PartitionDriver(object):
         non_out_infnames = [fn for fn in infnames if fn != outfname]
         if len(non_out_infnames) == 0:
             raise Exception('merge_files() called with <infnames> consisting only of <outfname>')
+        non_out_infnames = [fn for fn in non_out_infnames if os.path.exists(fn)]
+        if len(non_out_infnames) == 0:
+            print '    nothing to merge into %s' % outfname
+            return
         cmd = 'cat ' + ' '.join(non_out_infnames) + ' | grep -v \'' + header + '\''
         cmd += ' >>' + outfname
         try:
@@ -1748,7 +2001,7 @@ class PartitionDriver(object):
             check_call(['mv', tmpfname, outfname])
 
         for infname in infnames:
-            if infname != outfname:
+            if infname != outfname and os.path.exists(infname):  # a subproc with nothing new to cache may not have written its sub cache file
                 os.remove(infname)
 
     # ----------------------------------------------------------------------------------------
@@ -1757,7 +2010,7 @@ class PartitionDriver(object):
         cpath = None  # it would be nice to figure out a cleaner way to do this
         if self.current_action == 'partition':  # merge partitions from several files
             if n_procs > 1:
-                self.merge_subprocess_files(self.hmm_cachefname, n_procs, include_outfile=True)  # sub cache files only have new info
+                self.merge_subprocess_files(self.hmm_cachefname, n_procs, include_outfile=True)  # sub cache files only have new info, so we just append them to the shared one
 
             if not precache_all_naive_seqs:
                 if n_procs == 1:
@@ -1782,6 +2035,7 @@ class PartitionDriver(object):
         return cpath
 
     # ----------------------------------------------------------------------------------------
+    @profiled('write-hmms')
     def write_hmms(self, parameter_dir):
         """ Write hmm model files to <parameter_dir>/hmms, using information from <parameter_dir> """
         if self.args.dont_write_parameters:
@@ -1794,6 +2048,7 @@ class PartitionDriver(object):
         hmm_dir = parameter_dir + '/hmms'
         utils.prep_dir(hmm_dir, '*.yaml')
         glutils.restrict_to_observed_genes(self.glfo, parameter_dir)  # this is kind of a weird place to put this... it would make more sense to read the glfo from the parameter dir, but I don't want to mess around with changing that a.t.m.
+        self.profiler.add_info(n_items=sum(len(self.glfo['seqs'][r]) for r in utils.regions))
 
         if self.args.debug:
             print 'to %s' % parameter_dir + '/hmms',
@@ -2299,6 +2554,7 @@ class PartitionDriver(object):
         return annotations_to_use, hmm_failures
 
     # ----------------------------------------------------------------------------------------
+    @profiled('write-output')
     def write_output(self, annotation_list, hmm_failures, cpath=None, dont_write_failed_queries=False, write_sw=False, outfname=None, extra_headers=None):
         if outfname is None:
             outfname = self.args.outfname
@@ -2307,6 +2563,7 @@ class PartitionDriver(object):
             assert annotation_list is None
             annotation_list = [self.sw_info[q] for q in self.input_info if q in self.sw_info['queries']]
 
+        self.profiler.add_info(n_items=len(annotation_list) if annotation_list is not None else None, outfname=outfname)
         failed_queries = None
         if not dont_write_failed_queries:  # write empty lines for seqs that failed either in sw or the hmm
             failed_queries = [{'unique_ids' : [uid], 'invalid' : True, 'input_seqs' : self.input_info[uid]['seqs']} for uid in self.sw_info['failed-queries'] | hmm_failures]  # <uid> *needs* to be single-sequence (but there shouldn't really be any way for it to not be)
@@ -2341,7 +2598,7 @@ class PartitionDriver(object):
                 cpath.write(outfname, self.args.is_data, partition_lines=partition_lines)  # don't need to pass in reco_info/true_partition since we passed them when we got the partition lines
             annotation_fname = outfname if cpath is None else self.args.cluster_annotation_fname
             utils.write_annotations(annotation_fname, self.glfo, annotation_list, headers, failed_queries=failed_queries)
-        elif utils.getsuffix(outfname) == '.yaml':
+        elif utils.getsuffix(outfname) in ['.yaml', '.cols']:
             utils.write_annotations(outfname, self.glfo, annotation_list, headers, failed_queries=failed_queries, partition_lines=partition_lines, use_pyyaml=self.args.write_full_yaml_output, dont_write_git_info=self.args.dont_write_git_info)
         else:
             raise Exception('unhandled annotation file suffix %s' % outfname)
@@ -306,11 +306,11 @@ def process(args):
             print '%s --batch-options contains \'-e\' or \'-o\', but we add these automatically since we need to be able to parse each job\'s stdout and stderr. You can control the directory under which they\'re written with --workdir (which is currently %s).' % (utils.color('red', 'warning'), args.workdir)
 
     if args.outfname is not None and not args.presto_output and not args.airr_output and not args.generate_trees:
-        if utils.getsuffix(args.outfname) not in ['.csv', '.yaml']:
+        if utils.getsuffix(args.outfname) not in ['.csv', '.yaml', '.cols']:
             raise Exception('unhandled --outfname suffix %s' % utils.getsuffix(args.outfname))
-        if utils.getsuffix(args.outfname) != '.yaml':
+        if utils.getsuffix(args.outfname) == '.csv':
             print '  %s --outfname uses deprecated file format %s. This will still mostly work ok, but the new default .yaml format doesn\'t have to do all the string conversions by hand (so is less buggy), and includes annotations, partitions, and germline info in the same file (so you don\'t get crashes or inconsistent results if you don\'t keep track of what germline info goes with what output file).' % (utils.color('yellow', 'note:'), utils.getsuffix(args.outfname))
-        if args.action in ['view-annotations', 'view-partitions'] and utils.getsuffix(args.outfname) == '.yaml':
+        if args.action in ['view-annotations', 'view-partitions'] and utils.getsuffix(args.outfname) in ['.yaml', '.cols']:
             raise Exception('have to use \'view-output\' action to view .yaml output files')
 
     if args.presto_output:
@@ -332,7 +332,7 @@ def process(args):
         else:
             if utils.getsuffix(args.outfname) == '.tsv':
                 print '  note: writing only airr .tsv to %s' % args.outfname
-            elif utils.getsuffix(args.outfname) in ['.yaml', '.csv']:
+            elif utils.getsuffix(args.outfname) in ['.yaml', '.csv', '.cols']:
                 print '  note: writing both partis %s to %s and airr .tsv to %s' % (utils.getsuffix(args.outfname), args.outfname, utils.replace_suffix(args.outfname, '.tsv'))
             else:
                 raise Exception('--outfname suffix has to be either .tsv or .yaml if --airr-output is set (got %s)' % utils.getsuffix(args.outfname))
@@ -342,6 +342,8 @@ def process(args):
 
     if args.cluster_annotation_fname is None and args.outfname is not None and utils.getsuffix(args.outfname) == '.csv':  # if it wasn't set on the command line (<outfname> _was_ set), _and_ if we were asked for a csv, then use the old file name format
         args.cluster_annotation_fname = utils.insert_before_suffix('-cluster-annotations', args.outfname)
+    if args.write_timeline and args.timeline_fname is None and args.outfname is not None:
+        args.timeline_fname = utils.getprefix(args.outfname) + '-timeline.json'
 
     if args.calculate_alternative_annotations and args.outfname is None and args.paired_outdir is None:
         raise Exception('have to specify --outfname in order to calculate alternative annotations')
@@ -394,6 +396,17 @@ def process(args):
     if args.action == 'annotate' and args.plot_partitions and args.input_partition_fname is None:  # could set this up to use e.g. --simultaneous-true-clonal-seqs as well, but it can't atm
         print '  %s running annotate with --plot-partitions, but --input-partition-fname is not set, which likely means the partitions will be trivial/singleton partitions' % utils.color('yellow', 'warning')
 
+    if args.resume and args.checkpoint_dir is None:
+        raise Exception('--checkpoint-dir must be set if --resume is set')
+    if args.paired_loci and args.checkpoint_dir is not None and args.paired_outdir is None:
+        raise Exception('--paired-outdir must be set if --checkpoint-dir is set with --paired-loci (otherwise the single chain output files for loci that finished before the interruption are in a tmp work dir, so we can\'t skip them on --resume)')
+
+    if args.existing_output_fname is not None:
+        if args.action != 'partition' or args.paired_loci:
+            raise Exception('--existing-output-fname only makes sense for single-locus \'partition\' action')
+        if args.is_simu or args.seed_unique_id is not None or args.naive_vsearch or args.simultaneous_true_clonal_seqs:
+            raise Exception('--existing-output-fname not implemented together with --is-simu, --seed-unique-id, --naive-vsearch, or --simultaneous-true-clonal-seqs')
+
     if args.make_per_gene_per_base_plots and not args.make_per_gene_plots:  # the former doesn't do anything unless the latter is turned on
         args.make_per_gene_plots = True
 
@@ -0,0 +1,89 @@
+import time
+import sys
+import json
+import platform
+import resource
+import functools
+
+import utils
+
+# ----------------------------------------------------------------------------------------
+# per-stage wall time, cpu time (for both this process and any subprocesses that we've waited on), peak rss, and item counts, written as a json timeline (see bin/plot-time-required.py for reading/plotting)
+#  - stages can be nested (e.g. sw within allele finding within cache-parameters), and each stage's <parent> is the index of the stage that was open when it started
+#  - peak rss values are the high water marks up to the end of the stage (the os doesn't tell us per-stage peaks), and for children it's the largest single subprocess (e.g. one bcrham proc), not the sum
+class Profiler(object):
+    def __init__(self):
+        self.start_time = time.time()
+        self.stages = []  # one dict for each started stage, in order of starting
+        self.open_stages = []  # indices in <self.stages> of stages that are currently running (innermost is last)
+
+    # ----------------------------------------------------------------------------------------
+    def snapshot(self):
+        rself, rchild = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        rss_factor = 1. / (1024 * 1024) if platform.system() == 'Darwin' else 1. / 1024  # ru_maxrss is bytes on mac, kb on linux (we want mb)
+        return {'wall' : time.time(), 'cpu' : rself.ru_utime + rself.ru_stime, 'child_cpu' : rchild.ru_utime + rchild.ru_stime,
+                'peak_rss_mb' : rss_factor * rself.ru_maxrss, 'child_peak_rss_mb' : rss_factor * rchild.ru_maxrss}
+
+    # ----------------------------------------------------------------------------------------
+    def start(self, name, **kwargs):  # <kwargs> are added to the stage's info (e.g. n_items, n_procs)
+        sfo = {'name' : name, 'parent' : self.open_stages[-1] if len(self.open_stages) > 0 else None, 'depth' : len(self.open_stages), 'initial' : self.snapshot()}
+        sfo.update(kwargs)
+        self.open_stages.append(len(self.stages))
+        self.stages.append(sfo)
+
+    # ----------------------------------------------------------------------------------------
+    def add_info(self, **kwargs):  # add info (usually item counts) to the innermost running stage
+        if len(self.open_stages) == 0:
+            raise Exception('no running stage to add info to')
+        self.stages[self.open_stages[-1]].update(kwargs)
+
+    # ----------------------------------------------------------------------------------------
+    def stop(self, name, **kwargs):
+        open_names = [self.stages[i]['name'] for i in self.open_stages]
+        if name not in open_names:
+            raise Exception('tried to stop stage \'%s\', but it isn\'t running (running stages: %s)' % (name, ' '.join(open_names)))
+        while self.stages[self.open_stages[-1]]['name'] != name:  # if an exception skipped the stop() for any inner stages, stop them now (so we don't mask the original exception)
+            self.stop(self.stages[self.open_stages[-1]]['name'])
+        sfo = self.stages[self.open_stages.pop()]
+        sfo.update(kwargs)
+        initial, final = sfo.pop('initial'), self.snapshot()
+        sfo['start'] = initial['wall'] - self.start_time
+        for key in ['wall', 'cpu', 'child_cpu']:
+            sfo[key] = final[key] - initial[key]
+        for key in ['peak_rss_mb', 'child_peak_rss_mb']:
+            sfo[key] = final[key]
+
+    # ----------------------------------------------------------------------------------------
+    def write(self, fname):
+        if len(self.open_stages) > 0:
+            print '  %s writing timeline with %d stage%s still running: %s' % (utils.wrnstr(), len(self.open_stages), utils.plural(len(self.open_stages)), ' '.join(self.stages[i]['name'] for i in self.open_stages))
+        utils.prep_dir(dirname=None, fname=fname, allow_other_files=True)
+        with open(fname, 'w') as tfile:
+            json.dump({'command' : ' '.join(sys.argv), 'start_time' : self.start_time, 'total_wall' : time.time() - self.start_time, 'stages' : [s for s in self.stages if 'wall' in s]}, tfile, indent=1)
+        print '  wrote timeline with %d stages to %s' % (len([s for s in self.stages if 'wall' in s]), fname)
+
+# ----------------------------------------------------------------------------------------
+def profiled(name):  # decorator to run a method as a stage (in the Profiler at <self.profiler>)
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            self.profiler.start(name)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.profiler.stop(name)
+        return wrapper
+    return decorator
+
+# ----------------------------------------------------------------------------------------
+def read_timeline(fname):
+    with open(fname) as tfile:
+        return json.load(tfile)
+
+# ----------------------------------------------------------------------------------------
+def print_timeline(timeline, extra_str=''):
+    print '%s%-45s %9s %9s %9s %9s %9s %8s' % (extra_str, 'stage', 'start', 'wall', 'cpu', 'child cpu', 'rss (mb)', 'items')
+    for sfo in timeline['stages']:
+        istr = '' if sfo.get('n_items') is None else str(sfo['n_items'])
+        print '%s%-45s %9.1f %9.1f %9.1f %9.1f %9.0f %8s' % (extra_str, '  ' * sfo['depth'] + sfo['name'], sfo['start'], sfo['wall'], sfo['cpu'], sfo['child_cpu'], max(sfo['peak_rss_mb'], sfo['child_peak_rss_mb']), istr)
+    print '%s%-45s %9s %9.1f' % (extra_str, 'total', '', timeline['total_wall'])
@@ -538,8 +538,8 @@ class Recombinator(object):
         reco_event.set_post_erosion_codon_positions()
 
     # ----------------------------------------------------------------------------------------
-    def write_mute_freqs(self, reco_event, reco_seq_fname, per_base_freqs=None, debug=False):  # unsurprisingly, this function profiles out to be kind of a dumb way to do it, in terms of run time
-        # write per-position mute freqs, but also collects per-base (per-ACGT) freqs (<per_base_freqs>) and returns them if they're needed
+    def get_final_mute_freqs(self, reco_event, per_base_freqs=None, debug=False):  # unsurprisingly, this function profiles out to be kind of a dumb way to do it, in terms of run time
+        # return per-position mute freqs, but also collects per-base (per-ACGT) freqs (<per_base_freqs>) if they're needed
         # ----------------------------------------------------------------------------------------
         def get_pbfreqs(naive_base, pbcounts=None, inuke=None, rgene=None):
             def def_count(base, count=None):  # default, i.e. if we have no other information (this is used twice, first to set all bases if we have no info, and second [if <count> is set] to set pseudocount values if we don't have enough counts for some/all bases)
@@ -645,6 +645,13 @@ class Recombinator(object):
             final_total += final_freqs[inuke]
         assert utils.is_normed(final_total / float(len(final_seq)))
 
+        return final_freqs
+
+    # ----------------------------------------------------------------------------------------
+    def write_mute_freqs(self, reco_event, reco_seq_fname, per_base_freqs=None, debug=False):
+        final_seq = reco_event.recombined_seq
+        final_freqs = self.get_final_mute_freqs(reco_event, per_base_freqs=per_base_freqs, debug=debug)
+
         # write the input file for bppseqgen, one base per line
         with open(reco_seq_fname, 'w') as reco_seq_file:
             # NOTE really not sure why this doesn't really [seems to require an "extra" column] work with csv.DictWriter, but it doesn't -- bppseqgen barfs (I think maybe it expects a different newline character? don't feel like working it out)
@@ -777,12 +784,16 @@ class Recombinator(object):
             if seqfo['name'] == dummy_name_so_bppseqgen_doesnt_break:  # in the unlikely (impossible unless we change tree generators and don't tell them to use the same leaf names) event that we get a non-dummy leaf with this name, it'll fail at the assertion just below
                 continue
             mutated_seqs[seqfo['name'].strip('\'')] = seqfo['seq']
+        self.set_final_seqs(reco_event, mutated_seqs, 'bppseqgen output %s' % cmdfo['outfname'])
+        os.remove(cmdfo['outfname'])
+
+    # ----------------------------------------------------------------------------------------
+    def set_final_seqs(self, reco_event, mutated_seqs, srcstr):  # <mutated_seqs>: leaf seqs keyed by leaf name
         try:  # make sure names are all of form t<n>, and keep track of which sequences goes with which name (have to keep around the t<n> labels so we can translate the tree labels, in event.py)
             names_seqs = [('t' + str(iseq + 1), mutated_seqs['t' + str(iseq + 1)]) for iseq in range(len(mutated_seqs))]
         except KeyError as ke:
-            raise Exception('leaf name %s not as expected in bppseqgen output %s' % (ke, cmdfo['outfname']))
+            raise Exception('leaf name %s not as expected in %s' % (ke, srcstr))
         assert treeutils.get_n_leaves(reco_event.tree) == len(names_seqs)
-        os.remove(cmdfo['outfname'])
 
         assert len(reco_event.final_seqs) == 0
         reco_event.leaf_names = []  # i'm pretty sure there's a good reason this starts as None but the seqs start as a length zero list, but I don't remember it
@@ -793,6 +804,63 @@ class Recombinator(object):
             reco_event.leaf_names.append(name)
             reco_event.final_codon_positions.append(copy.deepcopy(reco_event.post_erosion_codon_positions))  # separate codon positions for each sequence, because of shm indels
 
+    # ----------------------------------------------------------------------------------------
+    def get_gtr_eigen(self, region='v'):  # eigen decomposition of the normalized GTR rate matrix for the bio++-style parameters in self.mute_models (i.e. the same ones we pass to bppseqgen), with bases in ACGT order
+        pvals = {p : float(v) for p, v in self.mute_models[region]['gtr'].items()}
+        theta, theta1, theta2 = [pvals[p] for p in ['theta', 'theta1', 'theta2']]  # gc content, A/(A+T), G/(G+C)
+        pis = numpy.array([theta1 * (1 - theta), (1 - theta2) * theta, theta2 * theta, (1 - theta1) * (1 - theta)])
+        a, b, c, d, e = [pvals[p] for p in 'abcde']
+        exch = numpy.array([[0, d, 1, b], [d, 0, e, a], [1, e, 0, c], [b, a, c, 0]])  # bio++ convention (A<->G is fixed to 1)
+        qmat = exch * pis[numpy.newaxis, :]
+        numpy.fill_diagonal(qmat, -qmat.sum(axis=1))
+        qmat /= -numpy.dot(pis, numpy.diag(qmat))  # normalize to one substitution per unit time at equilibrium
+        sqpis = numpy.sqrt(pis)
+        evals, symvecs = numpy.linalg.eigh(qmat * sqpis[:, numpy.newaxis] / sqpis[numpy.newaxis, :])  # reversible, so this is symmetric
+        return evals, symvecs / sqpis[:, numpy.newaxis], symvecs.T * sqpis[numpy.newaxis, :]  # exp(Qt) = evecs * exp(evals t) * inv_evecs
+
+    # ----------------------------------------------------------------------------------------
+    def get_discrete_gamma_rates(self, alpha, n_cats=4):  # mean rate in each of <n_cats> equal-probability bins of a mean-1 gamma (the discretized gamma that bio++ uses for Gamma(n=4, alpha=...))
+        bounds = scipy.stats.gamma.ppf(numpy.linspace(0, 1, n_cats + 1), alpha, scale=1. / alpha)
+        return n_cats * numpy.diff(scipy.stats.gamma.cdf(bounds, alpha + 1, scale=1. / alpha))
+
+    # ----------------------------------------------------------------------------------------
+    def evolve_seqs(self, reco_event):  # in-process alternative to bppseqgen: evolve the recombined seq down <reco_event.tree> with the same per-position substitution models that prepare_bppseqgen() sets up, and return the leaf seqs
+        nukes = sorted(utils.nukes)  # ACGT (same order as bio++)
+        full_seq = reco_event.recombined_seq
+        seq_len = len(full_seq)
+        per_base_freqs = {} if not self.args.no_per_base_mutation else None
+        site_rates = numpy.array(self.get_final_mute_freqs(reco_event, per_base_freqs=per_base_freqs))
+        edge_multiplier = 1.
+        pis = None
+        if not self.args.no_per_base_mutation:  # default: HKY85 with kappa=1 (i.e. F81) at each position, with the per-base freqs as equilibrium freqs
+            edge_multiplier = self.per_base_mutation_multiplier  # see note in __init__()
+            pis = numpy.array([[pbf[n] for n in nukes] for pbf in per_base_freqs['final']])
+        elif self.args.mutate_from_scratch:  # JC69 (F81 with flat freqs), with either constant or gamma rates across sites
+            pis = numpy.full((seq_len, len(nukes)), 1. / len(nukes))
+            if self.args.flat_mute_freq:
+                site_rates = numpy.ones(seq_len)
+            else:
+                site_rates = numpy.random.choice(self.get_discrete_gamma_rates(float(self.mute_models['v']['gamma']['alpha'])), size=seq_len)
+        else:  # gtr with per-position rates
+            evals, evecs, inv_evecs = self.get_gtr_eigen()
+        if pis is not None:
+            f81_mus = 1. / (1. - (pis**2).sum(axis=1))  # normalize each position's model to one substitution per unit time at equilibrium (as bio++ does)
+            cum_pis = numpy.cumsum(pis, axis=1)
+
+        node_states = {}
+        for node in reco_event.tree.preorder_node_iter():
+            parent_states = numpy.array([nukes.index(n) for n in full_seq]) if node.parent_node is None else node_states[node.parent_node]
+            tlen = edge_multiplier * (node.edge_length if node.edge_length is not None else 0.)  # NOTE includes root edge (that's what the dummy leaf in prepare_bppseqgen() is for)
+            if pis is not None:  # each position either keeps its base, or redraws one from its equilibrium freqs (which may give back the same base)
+                redraw = numpy.random.uniform(size=seq_len) < 1. - numpy.exp(-f81_mus * site_rates * tlen)
+                states = parent_states.copy()
+                states[redraw] = (numpy.random.uniform(size=(redraw.sum(), 1)) > cum_pis[redraw]).sum(axis=1)
+            else:  # row of exp(Q * rate * t) for each position's current base
+                tprobs = numpy.einsum('lk,lk,kb->lb', evecs[parent_states], numpy.exp(numpy.outer(site_rates * tlen, evals)), inv_evecs)
+                states = (numpy.random.uniform(size=(seq_len, 1)) > numpy.cumsum(tprobs, axis=1)).sum(axis=1)
+            node_states[node] = numpy.minimum(states, len(nukes) - 1)  # in case rounding leaves the cumulative probs a hair below 1
+        return {n.taxon.label : ''.join(nukes[s] for s in node_states[n]) for n in reco_event.tree.leaf_node_iter()}
+
     # ----------------------------------------------------------------------------------------
     def add_shm_indels(self, reco_event):
         # NOTE that it will eventually make sense to add shared indel mutation according to the chosen tree -- i.e., probably, with some probability apply an indel instead of a point mutation
@@ -844,15 +912,17 @@ class Recombinator(object):
             print '  chose tree with total height %f%s' % (mheight, (' (includes factor %.2f from --mutation-multiplier)' % self.args.mutation_multiplier) if self.args.mutation_multiplier is not None else '')
             print '    regional heights:  %s' % ('   '.join(['%s %.3f' % (r, mheight * self.treeinfo['branch-length-ratios'][r]) for r in utils.regions]))
 
-        cmdfos = []
-        self.prepare_bppseqgen(cmdfos, reco_event, seed=irandom)
-        assert len(cmdfos) == 1  # used to be one cmd for each region
-
         start = time.time()
-        utils.run_cmds(cmdfos, sleep=False, clean_on_success=True)
-        self.validation_values['bpp-times'].append(time.time()-start)
-
-        self.read_bppseqgen_output(cmdfos[0], reco_event)
+        if self.args.mutation_simulator == 'numpy':
+            self.set_final_seqs(reco_event, self.evolve_seqs(reco_event), 'numpy mutation simulation')
+            self.validation_values['bpp-times'].append(time.time()-start)
+        else:
+            cmdfos = []
+            self.prepare_bppseqgen(cmdfos, reco_event, seed=irandom)
+            assert len(cmdfos) == 1  # used to be one cmd for each region
+            utils.run_cmds(cmdfos, sleep=False, clean_on_success=True)
+            self.validation_values['bpp-times'].append(time.time()-start)
+            self.read_bppseqgen_output(cmdfos[0], reco_event)
 
         self.add_shm_indels(reco_event)
         reco_event.setline(irandom)  # set the line here because we use it when checking tree simulation, and want to make sure the uids are always set at the same point in the workflow
@@ -860,7 +930,7 @@ class Recombinator(object):
             self.check_tree_simulation(reco_event)
 
         if self.args.debug:
-            print '  bppseqgen ran on the following tree (mean depth %.3f, imbalance %.4f) in %.2fs:' % (treeutils.get_mean_leaf_height(tree=reco_event.tree), treeutils.get_imbalance(reco_event.tree), self.validation_values['bpp-times'][-1])
+            print '  %s ran on the following tree (mean depth %.3f, imbalance %.4f) in %.2fs:' % (self.args.mutation_simulator, treeutils.get_mean_leaf_height(tree=reco_event.tree), treeutils.get_imbalance(reco_event.tree), self.validation_values['bpp-times'][-1])
             print treeutils.get_ascii_tree(dendro_tree=reco_event.tree, extra_str='      ')
             utils.print_reco_event(reco_event.line, extra_str='    ')
 
@@ -0,0 +1,233 @@
+import sys
+import time
+import numpy
+from collections import OrderedDict
+
+import utils
+
+# in-process smith-waterman, used in place of ig-sw (packages/ig-sw/src/ig_align/ig_align.c) by python/waterer.py if --sw-backend is 'numpy'
+#  - follows ig-sw's conventions: local alignment with affine gaps (a gap of length l costs gap_open + l * gap_extend), ambiguous bases score zero, v is aligned against the whole query, then j against whatever's to the right of the best v match, then d against whatever's between the best v and j matches, and within each region we keep all matches within <max_drop> of the best
+#  - unlike ig-sw, each query can have its own mismatch score and gap open penalty, so we don't need a separate process for each combination
+#  - vectorized over a batch of queries, all the germline genes in a region, and all positions along the genes (we only loop over query positions). The horizontal gap term is computed with a running max, which is exact since a gap opened right after another gap in the same direction is never better than extending it.
+
+base_codes = numpy.full(256, 4, dtype=numpy.uint8)  # A, C, G, T --> 0, 1, 2, 3, everything else (ambiguous) --> 4 (and padding is 5)
+for ibase, base in enumerate('ACGT'):
+    base_codes[ord(base)] = ibase
+    base_codes[ord(base.lower())] = ibase
+pad_code = 5
+pad_score = -1000  # score for aligning anything to padding (has to be negative enough that we never extend an alignment into the padding, but small enough that we don't overflow int16)
+neg_inf = -10000  # for initializing gap scores
+
+# ----------------------------------------------------------------------------------------
+def encode(seq):
+    return base_codes[numpy.frombuffer(str(seq), dtype=numpy.uint8)]
+
+# ----------------------------------------------------------------------------------------
+def pad_code_arrays(code_arrays, min_len=1):  # return 2d array with each of <code_arrays> padded on the right to the same length
+    padded = numpy.full((len(code_arrays), max([min_len] + [len(c) for c in code_arrays])), pad_code, dtype=numpy.uint8)
+    for icode, codes in enumerate(code_arrays):
+        padded[icode, : len(codes)] = codes
+    return padded
+
+# ----------------------------------------------------------------------------------------
+def scoring_matrix(match, mismatch):
+    mat = numpy.zeros((pad_code + 1, pad_code + 1), dtype=numpy.int16)
+    mat[:4, :4] = -mismatch
+    numpy.fill_diagonal(mat[:4, :4], match)
+    mat[pad_code, :] = pad_score
+    mat[:, pad_code] = pad_score
+    return mat
+
+# ----------------------------------------------------------------------------------------
+# local alignment of each of the <nb> queries in <qcodes> (nb x lq) against each of the <nt> targets in <tcodes> ((1 or nb) x nt x lt), with per-query scoring matrices <mats> (nb x 6 x 6) and gap open penalties <gap_opens> (nb)
+# returns best scores, and (inclusive) query and target end positions, each nb x nt (end positions are -1 if there's no positive-scoring alignment)
+# if <stop_scores> (nb x nt) is set, the end positions are instead those of the first cell (in query-major order) whose score reaches the stop score (which is how we find start positions, by running on reversed sequences)
+def local_align(qcodes, tcodes, mats, gap_opens, gap_extend=1, stop_scores=None):
+    nb, lq = qcodes.shape
+    nt, lt = tcodes.shape[1:]
+    shape = (nb, nt, lt)
+    profile = mats[numpy.arange(nb).reshape(nb, 1, 1, 1), numpy.arange(pad_code + 1).reshape(1, pad_code + 1, 1, 1), tcodes[:, None, :, :]]  # nb x 6 x nt x lt: score for each query base code against each target position
+    gopen_ext = (gap_opens + gap_extend).astype(numpy.int16).reshape(nb, 1, 1)
+    gap_opens = gap_opens.astype(numpy.int16).reshape(nb, 1, 1)
+    jgaps = (numpy.arange(lt) * gap_extend).astype(numpy.int16)  # cost of extending a horizontal gap out to each target position
+
+    hmat = numpy.zeros(shape, dtype=numpy.int16)  # best score ending at each cell in the current query row
+    fmat = numpy.full(shape, neg_inf, dtype=numpy.int16)  # best score ending in a vertical gap (i.e. a query base aligned to nothing) at each cell
+    emat = numpy.full(shape, neg_inf, dtype=numpy.int16)  # best score ending in a horizontal gap (target base aligned to nothing)
+    hdiag = numpy.zeros(shape, dtype=numpy.int16)
+    tmpmat = numpy.zeros(shape, dtype=numpy.int16)
+    best_scores = numpy.zeros((nb, nt), dtype=numpy.int16)
+    qends = numpy.full((nb, nt), -1, dtype=numpy.int32)
+    tends = numpy.full((nb, nt), -1, dtype=numpy.int32)
+    brange = numpy.arange(nb)
+    for iq in range(lq):  # everything in here is in place, since allocating new arrays for every query position is a big chunk of the time
+        numpy.subtract(hmat, gopen_ext, out=tmpmat)
+        numpy.subtract(fmat, gap_extend, out=fmat)
+        numpy.maximum(fmat, tmpmat, out=fmat)
+        hdiag[:, :, 1:] = hmat[:, :, :-1]
+        hdiag[:, :, 0] = 0
+        hdiag += profile[brange, qcodes[:, iq]]
+        numpy.maximum(hdiag, fmat, out=hmat)
+        numpy.maximum(hmat, 0, out=hmat)
+        numpy.add(hmat, jgaps, out=tmpmat)
+        numpy.maximum.accumulate(tmpmat, axis=2, out=tmpmat)
+        emat[:, :, 1:] = tmpmat[:, :, :-1]
+        emat[:, :, 1:] -= gap_opens
+        emat[:, :, 1:] -= jgaps[1:]
+        numpy.maximum(hmat, emat, out=hmat)
+
+        row_max = hmat.max(axis=2)
+        if stop_scores is None:
+            improved = row_max > best_scores
+            if improved.any():
+                best_scores[improved] = row_max[improved]
+                qends[improved] = iq
+                tends[improved] = hmat.argmax(axis=2)[improved]
+        else:
+            reached = (row_max >= stop_scores) & (qends < 0)
+            if reached.any():
+                best_scores[reached] = row_max[reached]
+                qends[reached] = iq
+                tends[reached] = (hmat >= stop_scores[:, :, None]).argmax(axis=2)[reached]
+                if (qends >= 0).all():
+                    break
+
+    return best_scores, qends, tends
+
+# ----------------------------------------------------------------------------------------
+def global_align_cigar(qcodes, tcodes, mat, gap_open, gap_extend):  # plain (non-vectorized) global alignment with traceback, only used to get the cigar for the (rare) local alignments that have indels
+    nq, nt = len(qcodes), len(tcodes)
+    scores = {s : [[neg_inf for _ in range(nt + 1)] for _ in range(nq + 1)] for s in 'MID'}  # best score ending in match/mismatch (M), query base against gap (I), or gap against target base (D)
+    ptrs = {s : [[None for _ in range(nt + 1)] for _ in range(nq + 1)] for s in 'MID'}
+    scores['M'][0][0] = 0
+    for iq in range(1, nq + 1):
+        scores['I'][iq][0], ptrs['I'][iq][0] = -(gap_open + iq * gap_extend), 'M' if iq == 1 else 'I'
+    for it in range(1, nt + 1):
+        scores['D'][0][it], ptrs['D'][0][it] = -(gap_open + it * gap_extend), 'M' if it == 1 else 'D'
+    for iq in range(1, nq + 1):
+        for it in range(1, nt + 1):
+            for state, (pq, pt) in [('M', (iq - 1, it - 1)), ('I', (iq - 1, it)), ('D', (iq, it - 1))]:
+                best_prev, best_val = None, neg_inf
+                for prev in 'MID':
+                    val = scores[prev][pq][pt]
+                    if state != 'M':
+                        val -= gap_extend if prev == state else gap_open + gap_extend
+                    if val > best_val:
+                        best_prev, best_val = prev, val
+                if state == 'M':
+                    best_val += mat[qcodes[iq - 1], tcodes[it - 1]]
+                scores[state][iq][it], ptrs[state][iq][it] = best_val, best_prev
+
+    codes = []
+    state = max('MID', key=lambda s: scores[s][nq][nt])
+    iq, it = nq, nt
+    while iq > 0 or it > 0:
+        codes.append(state)
+        prev = ptrs[state][iq][it]
+        if state in 'MI':
+            iq -= 1
+        if state in 'MD':
+            it -= 1
+        state = prev
+    codes = ''.join(reversed(codes))
+    cigars = []
+    for code in codes:
+        if len(cigars) > 0 and cigars[-1][0] == code:
+            cigars[-1][1] += 1
+        else:
+            cigars.append([code, 1])
+    return ''.join('%d%s' % (l, c) for c, l in cigars)
+
+# ----------------------------------------------------------------------------------------
+def align_region(qcode_list, offsets, tnames, tcodes, mats, gap_opens, gap_extend, max_drop):  # align each query in <qcode_list> against all the targets, returning a list (for each query) of matches within <max_drop> of the best, sorted by decreasing score
+    nb = len(qcode_list)
+    qcodes = pad_code_arrays(qcode_list)
+    scores, qends, tends = local_align(qcodes, tcodes[None, :, :], mats, gap_opens, gap_extend=gap_extend)
+
+    pairs = []  # (iquery, itarget) for each match we're keeping
+    for ib in range(nb):
+        if scores[ib].max() <= 0:
+            continue
+        for it in numpy.flatnonzero(scores[ib] >= scores[ib].max() - max_drop):
+            pairs.append((ib, it))
+    if len(pairs) == 0:
+        return [[] for _ in range(nb)]
+
+    # find start positions by aligning the reversed sequences up to the end positions, and stopping when we reach the best score
+    rev_qcodes = pad_code_arrays([qcode_list[ib][: qends[ib, it] + 1][::-1] for ib, it in pairs])
+    rev_tcodes = pad_code_arrays([tcodes[it, : tends[ib, it] + 1][::-1] for ib, it in pairs])[:, None, :]
+    pair_ibs = numpy.array([ib for ib, _ in pairs])
+    stop_scores = numpy.array([[scores[ib, it]] for ib, it in pairs], dtype=numpy.int16)
+    _, rev_qends, rev_tends = local_align(rev_qcodes, rev_tcodes, mats[pair_ibs], gap_opens[pair_ibs], gap_extend=gap_extend, stop_scores=stop_scores)
+
+    matches = [[] for _ in range(nb)]
+    for ipair, (ib, it) in enumerate(pairs):
+        qend, tend = int(qends[ib, it]), int(tends[ib, it])  # int() so numpy ints don't end up in the annotations (which breaks json output)
+        qstart, tstart = qend - int(rev_qends[ipair, 0]), tend - int(rev_tends[ipair, 0])
+        qsub, tsub = qcode_list[ib][qstart : qend + 1], tcodes[it, tstart : tend + 1]
+        if len(qsub) == len(tsub) and mats[ib][qsub, tsub].sum() == scores[ib, it]:  # no indels
+            cigarstr = '%dM' % len(qsub)
+        else:
+            cigarstr = global_align_cigar(qsub, tsub, mats[ib], int(gap_opens[ib]), gap_extend)
+        matches[ib].append({'gene' : tnames[it], 'score' : int(scores[ib, it]), 'qrbounds' : (offsets[ib] + qstart, offsets[ib] + qend + 1), 'glbounds' : (tstart, tend + 1), 'cigarstr' : cigarstr})
+    for ib in range(nb):
+        matches[ib] = sorted(matches[ib], key=lambda m: m['score'], reverse=True)  # stable, so ties stay in germline order
+    return matches
+
+# ----------------------------------------------------------------------------------------
+# align each (name, seq) in <queries> against the germline genes in <glfo>, returning an OrderedDict with a list of matches for each query (each match is a dict with keys 'gene', 'score', 'qrbounds', 'glbounds', 'cigarstr', ordered like ig-sw's sam output)
+# <mismatches> and <gap_opens> are dicts with the mismatch score and gap open penalty for each query
+def align_queries(queries, glfo, match_score, mismatches, gap_opens, gap_extend=1, max_drop=50, batch_size=20, debug=False):
+    start = time.time()
+    targets = {}
+    for region in utils.getregions(glfo['locus']):
+        tnames = list(glfo['seqs'][region])
+        targets[region] = (tnames, pad_code_arrays([encode(glfo['seqs'][region][g]) for g in tnames]))
+
+    all_matches = OrderedDict()
+    sorted_queries = sorted(queries, key=lambda q: len(q[1]))  # batch queries of similar length together to minimize padding
+    for ibatch in range(0, len(sorted_queries), batch_size):
+        batch = sorted_queries[ibatch : ibatch + batch_size]
+        qcode_list = [encode(seq) for _, seq in batch]
+        mats = numpy.array([scoring_matrix(match_score, mismatches[name]) for name, _ in batch])
+        gopens = numpy.array([gap_opens[name] for name, _ in batch])
+        batch_matches = align_region(qcode_list, [0 for _ in batch], targets['v'][0], targets['v'][1], mats, gopens, gap_extend, max_drop)
+
+        # then j against what's to the right of the best v, and d against what's between the best v and best j
+        ibs = [ib for ib in range(len(batch)) if len(batch_matches[ib]) > 0 and len(qcode_list[ib]) - batch_matches[ib][0]['qrbounds'][1] > 2]
+        v_ends = {ib : batch_matches[ib][0]['qrbounds'][1] for ib in ibs}
+        j_starts = {}
+        for region in [r for r in ['j', 'd'] if r in targets]:
+            if region == 'd':
+                ibs = [ib for ib in ibs if ib in j_starts and j_starts[ib] - v_ends[ib] > 0]
+            if len(ibs) == 0:
+                continue
+            sub_qcodes = [qcode_list[ib][v_ends[ib] : j_starts[ib] if region == 'd' else None] for ib in ibs]
+            sub_matches = align_region(sub_qcodes, [v_ends[ib] for ib in ibs], targets[region][0], targets[region][1], mats[ibs], gopens[ibs], gap_extend, max_drop)
+            for ib, smatches in zip(ibs, sub_matches):
+                batch_matches[ib] += smatches
+                if region == 'j' and len(smatches) > 0:
+                    j_starts[ib] = smatches[0]['qrbounds'][0]
+
+        for (name, _), matches in zip(batch, batch_matches):
+            all_matches[name] = matches
+
+    if debug:
+        print '    aligned %d queries in %.1f sec' % (len(queries), time.time() - start)
+    return OrderedDict((name, all_matches[name]) for name, _ in queries)
+
+# ----------------------------------------------------------------------------------------
+# best local alignment score of each of <seqs> against each of <target_seqs> (no start positions or cigars, so it's much cheaper than align_queries()), as a len(seqs) x len(target_seqs) array
+# <mismatches> and <gap_opens> are lists with the mismatch score and gap open penalty for each seq
+def score_queries(seqs, target_seqs, match_score, mismatches, gap_opens, gap_extend=1, batch_size=20):
+    scores = numpy.zeros((len(seqs), len(target_seqs)), dtype=numpy.int16)
+    if len(seqs) == 0 or len(target_seqs) == 0:
+        return scores
+    tcodes = pad_code_arrays([encode(s) for s in target_seqs])
+    isorted = sorted(range(len(seqs)), key=lambda i: len(seqs[i]))  # batch queries of similar length together to minimize padding
+    for ibatch in range(0, len(isorted), batch_size):
+        ibs = isorted[ibatch : ibatch + batch_size]
+        mats = numpy.array([scoring_matrix(match_score, mismatches[i]) for i in ibs])
+        bscores, _, _ = local_align(pad_code_arrays([encode(seqs[i]) for i in ibs]), tcodes[None, :, :], mats, numpy.array([gap_opens[i] for i in ibs]), gap_extend=gap_extend)
+        scores[ibs] = bscores
+    return scores
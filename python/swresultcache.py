@@ -0,0 +1,82 @@
+import os
+import json
+import hashlib
+import tempfile
+
+import utils
+
+# ----------------------------------------------------------------------------------------
+# cross-run cache of raw smith-waterman matches for single sequences (used by waterer.py if --sw-result-cachedir is set), so e.g. a rerun on a sample with a few new sequences, or on a new timepoint from the same donor, only has to align sequences we haven't seen before
+#  - content-addressed: each germline set + sw settings combination gets its own subdir (named by a hash of all the gene seqs and codon positions, plus the match score, max drop, and backend), in which each entry is keyed by a hash of the query sequence (i.e. whatever was passed to sw, so with any indels reversed) plus its mismatch and gap open
+#  - entries are spread over json shard files by the first few characters of their key, and we only read the shards we need
+#  - writing new entries re-reads each shard and writes to a temp file that's then moved into place, so simultaneous runs sharing a cache dir can only lose each other's new entries (i.e. cause cache misses), not corrupt anything
+class SWResultCache(object):
+    def __init__(self, cachedir, glfo, match_score, max_drop, backend, n_shard_chars=3):
+        self.n_shard_chars = n_shard_chars
+        glstrs = []
+        for region in utils.regions:
+            codon = utils.conserved_codons[glfo['locus']].get(region)
+            for gene in sorted(glfo['seqs'][region]):
+                glstrs.append('%s %s %s' % (gene, glfo['seqs'][region][gene], glfo[codon + '-positions'][gene] if codon is not None else ''))
+        self.setting_str = 'locus %s match %d max-drop %d backend %s' % (glfo['locus'], match_score, max_drop, backend)
+        self.dirname = '%s/%s' % (cachedir, hashlib.md5(self.setting_str + '\n' + '\n'.join(glstrs)).hexdigest())
+        self.shards = {}  # entries that we've read from each shard (only read when needed)
+        self.new_entries = {}  # entries from this run that aren't yet written
+        self.n_hits, self.n_misses = 0, 0
+
+    # ----------------------------------------------------------------------------------------
+    def key(self, seq, mismatch, gap_open):
+        return hashlib.md5('%s %d %d' % (seq, mismatch, gap_open)).hexdigest()
+
+    # ----------------------------------------------------------------------------------------
+    def shard_fname(self, ishard):
+        return '%s/%s.json' % (self.dirname, ishard)
+
+    # ----------------------------------------------------------------------------------------
+    def read_shard(self, ishard):
+        if not os.path.exists(self.shard_fname(ishard)):
+            return {}
+        with open(self.shard_fname(ishard)) as sfile:
+            return json.load(sfile)
+
+    # ----------------------------------------------------------------------------------------
+    def get(self, seq, mismatch, gap_open):  # return the seq that sw output and its list of matches (in the same format as ig-sw or the numpy backend) for input seq <seq>, or (None, None) if it isn't in the cache
+        key = self.key(seq, mismatch, gap_open)
+        ishard = key[ : self.n_shard_chars]
+        if ishard not in self.shards:
+            self.shards[ishard] = self.read_shard(ishard)
+        if key not in self.shards[ishard]:
+            self.n_misses += 1
+            return None, None
+        self.n_hits += 1
+        entry = self.shards[ishard][key]
+        return str(entry['seq']), [{'gene' : str(m['gene']), 'score' : m['score'], 'qrbounds' : tuple(m['qrbounds']), 'glbounds' : tuple(m['glbounds']), 'cigarstr' : str(m['cigarstr'])} for m in entry['matches']]  # json gives us unicode, and lists instead of tuples
+
+    # ----------------------------------------------------------------------------------------
+    def add(self, seq, mismatch, gap_open, output_seq, matches):  # <seq>: what we passed to sw, <output_seq>: what it gave back (should be the same, but we don't want to assume that)
+        key = self.key(seq, mismatch, gap_open)
+        if key in self.shards.get(key[ : self.n_shard_chars], {}):
+            return
+        self.new_entries[key] = {'seq' : output_seq, 'matches' : [{'gene' : m['gene'], 'score' : int(m['score']), 'qrbounds' : [int(i) for i in m['qrbounds']], 'glbounds' : [int(i) for i in m['glbounds']], 'cigarstr' : m['cigarstr']} for m in matches]}  # int() since the numpy backend gives us numpy ints
+
+    # ----------------------------------------------------------------------------------------
+    def write(self):
+        if len(self.new_entries) == 0:
+            return
+        if not os.path.exists(self.dirname + '/settings.txt'):
+            utils.mkdir(self.dirname)
+            with open(self.dirname + '/settings.txt', 'w') as sfile:  # not used for anything, just so you can tell what's what
+                sfile.write(self.setting_str + '\n')
+        new_shards = {}
+        for key, entry in self.new_entries.items():
+            new_shards.setdefault(key[ : self.n_shard_chars], {})[key] = entry
+        for ishard, entries in new_shards.items():
+            shard = self.read_shard(ishard)  # re-read, in case another run wrote to it since we read it
+            shard.update(entries)
+            tmpfd, tmpfname = tempfile.mkstemp(dir=self.dirname, suffix='.tmp')
+            with os.fdopen(tmpfd, 'w') as tmpfile:
+                json.dump(shard, tmpfile)
+            os.rename(tmpfname, self.shard_fname(ishard))
+            self.shards[ishard] = shard
+        print '      wrote %d new sw result%s to cache in %s' % (len(self.new_entries), utils.plural(len(self.new_entries)), self.dirname)
+        self.new_entries = {}
@@ -19,6 +19,7 @@ import time
 import math
 import json
 import pickle
+import hashlib
 import warnings
 import traceback
 if StrictVersion(dendropy.__version__) < StrictVersion('4.0.0'):  # not sure on the exact version I need, but 3.12.0 is missing lots of vital tree fcns
@@ -799,20 +800,77 @@ def collapse_zero_length_leaves(dtree, sequence_uids, debug=False):  # <sequence
         # print dtree.as_string(schema='newick').strip()
 
 # ----------------------------------------------------------------------------------------
-def get_fasttree_tree(seqfos, naive_seq=None, naive_seq_name='XnaiveX', taxon_namespace=None, suppress_internal_node_taxa=False, debug=False):
-    if debug:
-        print '    running FastTree on %d sequences plus a naive' % len(seqfos)
+fasttree_opts = '-gtr -nt'  # NOTE changing these changes the cache keys in fasttree_cache_fname(), which is what we want
+
+# ----------------------------------------------------------------------------------------
+def fasttree_input_str(seqfos, naive_seq=None, naive_seq_name='XnaiveX'):
     uid_list = [sfo['name'] for sfo in seqfos]
     if any(uid_list.count(u) > 1 for u in uid_list):
         raise Exception('duplicate uid(s) in seqfos for FastTree, which\'ll make it crash: %s' % ' '.join(u for u in uid_list if uid_list.count(u) > 1))
-    with tempfile.NamedTemporaryFile() as tmpfile:
-        if naive_seq is not None:
-            tmpfile.write('>%s\n%s\n' % (naive_seq_name, naive_seq))
-        for sfo in seqfos:
-            tmpfile.write('>%s\n%s\n' % (sfo['name'], sfo['seq']))  # NOTE the order of the leaves/names is checked when reading bppseqgen output
-        tmpfile.flush()  # BEWARE if you forget this you are fucked
-        with open(os.devnull, 'w') as fnull:
-            treestr = subprocess.check_output('./bin/FastTree -gtr -nt ' + tmpfile.name, shell=True, stderr=fnull)
+    fstrs = []
+    if naive_seq is not None:
+        fstrs.append('>%s\n%s\n' % (naive_seq_name, naive_seq))
+    for sfo in seqfos:
+        fstrs.append('>%s\n%s\n' % (sfo['name'], sfo['seq']))  # NOTE the order of the leaves/names is checked when reading bppseqgen output
+    return ''.join(fstrs)
+
+# ----------------------------------------------------------------------------------------
+def fasttree_cache_fname(cachedir, fastastr):  # cached trees are keyed by a hash of the exact input alignment (including the naive seq) plus the FastTree options
+    return '%s/%s.nwk' % (cachedir, hashlib.md5(fasttree_opts + '\n' + fastastr).hexdigest())
+
+# ----------------------------------------------------------------------------------------
+# run FastTree on each entry in <fastfos> (dicts with key 'seqfos', and optionally 'naive_seq' and 'naive_seq_name'), returning a list of the resulting newick strings in the same order
+#  - runs up to <n_procs> at a time (or on <batch_system>), starting with the largest families so we don't end up waiting on one big one at the end
+#  - if <cachedir> is set, trees for alignments we've already seen are read from there instead of rerun (and new ones are written there)
+#  - if <workdir> isn't set we use a local temp dir, so it has to be set if <batch_system> is (since jobs on other nodes can't see our /tmp)
+def run_fasttree_pool(fastfos, workdir=None, n_procs=1, batch_system=None, batch_options=None, cachedir=None, print_time=False, debug=False):
+    if workdir is None and batch_system is not None:
+        raise Exception('have to set <workdir> to run fasttree with batch system %s (otherwise the work files would be in a local temp dir that jobs on other nodes may not be able to read)' % batch_system)
+    fastastrs = [fasttree_input_str(ffo['seqfos'], naive_seq=ffo.get('naive_seq'), naive_seq_name=ffo.get('naive_seq_name', 'XnaiveX')) for ffo in fastfos]
+    treestrs = [None for _ in fastfos]
+    if cachedir is not None:
+        for ifo, fstr in enumerate(fastastrs):
+            cfn = fasttree_cache_fname(cachedir, fstr)
+            if os.path.exists(cfn):
+                treestrs[ifo] = get_treestr_from_file(cfn)
+    i_to_run = sorted([i for i, t in enumerate(treestrs) if t is None], key=lambda i: len(fastfos[i]['seqfos']), reverse=True)
+    if len(i_to_run) > 0:
+        start = time.time()
+        tmp_workdir = workdir is None
+        if tmp_workdir:
+            workdir = tempfile.mkdtemp()
+        ftdir = '%s/fasttree' % workdir
+        cmdfos = []
+        for ifo in i_to_run:
+            subwd = '%s/itree-%d' % (ftdir, ifo)
+            utils.mkdir(subwd)
+            ifn, ofn = '%s/input.fa' % subwd, '%s/tree.nwk' % subwd
+            with open(ifn, 'w') as infile:
+                infile.write(fastastrs[ifo])
+            cmdstr = '%s/bin/FastTree %s -out %s %s' % (utils.get_partis_dir(), fasttree_opts, ofn, ifn)
+            cmdfos.append({'cmd_str' : cmdstr, 'workdir' : subwd, 'outfname' : ofn, 'workfnames' : [ifn, ofn]})
+        utils.run_cmds(cmdfos, n_max_procs=n_procs, batch_system=batch_system, batch_options=batch_options, ignore_stderr=True)  # fasttree writes a bunch of progress info to stderr
+        if cachedir is not None:
+            utils.mkdir(cachedir)
+        for ifo, cfo in zip(i_to_run, cmdfos):
+            treestrs[ifo] = get_treestr_from_file(cfo['outfname'])
+            if cachedir is not None:
+                with open(fasttree_cache_fname(cachedir, fastastrs[ifo]), 'w') as cfile:
+                    cfile.write(treestrs[ifo])
+            for fn in cfo['workfnames']:
+                os.remove(fn)
+            os.rmdir(cfo['workdir'])
+        os.rmdir(ftdir)
+        if tmp_workdir:
+            os.rmdir(workdir)
+        if debug or print_time:
+            print '      ran fasttree for %d tree%s with %d proc%s%s (%.1fs)' % (len(i_to_run), utils.plural(len(i_to_run)), n_procs, utils.plural(n_procs), '' if len(i_to_run) == len(fastfos) else ' (read %d more from cache)' % (len(fastfos) - len(i_to_run)), time.time() - start)
+    elif debug or print_time:
+        print '      read all %d fasttree trees from cache %s' % (len(fastfos), cachedir)
+    return treestrs
+
+# ----------------------------------------------------------------------------------------
+def get_dtree_from_fasttree(treestr, uid_list, naive_seq_name='XnaiveX', taxon_namespace=None, suppress_internal_node_taxa=False, debug=False):
     if debug:
         print '      converting FastTree newick string to dendro tree'
     dtree = get_dendro_tree(treestr=treestr, taxon_namespace=taxon_namespace, ignore_existing_internal_node_labels=not suppress_internal_node_taxa, suppress_internal_node_taxa=suppress_internal_node_taxa, debug=debug)
@@ -825,6 +883,13 @@ def get_fasttree_tree(seqfos, naive_seq=None, naive_seq_name='XnaiveX', taxon_na
 
     return dtree
 
+# ----------------------------------------------------------------------------------------
+def get_fasttree_tree(seqfos, naive_seq=None, naive_seq_name='XnaiveX', taxon_namespace=None, suppress_internal_node_taxa=False, cachedir=None, debug=False):
+    if debug:
+        print '    running FastTree on %d sequences plus a naive' % len(seqfos)
+    treestr = run_fasttree_pool([{'seqfos' : seqfos, 'naive_seq' : naive_seq, 'naive_seq_name' : naive_seq_name}], cachedir=cachedir)[0]
+    return get_dtree_from_fasttree(treestr, [sfo['name'] for sfo in seqfos], naive_seq_name=naive_seq_name, taxon_namespace=taxon_namespace, suppress_internal_node_taxa=suppress_internal_node_taxa, debug=debug)
+
 # ----------------------------------------------------------------------------------------
 def node_mtpy(multifo, node):  # number of reads/contigs/whatever (depending on context) with the same sequence
     if multifo is None or node.taxon.label not in multifo or multifo[node.taxon.label] is None:  # most all of them should be in there, but for instance I'm not adding the dummy branch nodes
@@ -834,7 +899,96 @@ def node_mtpy(multifo, node):  # number of reads/contigs/whatever (depending on
 # ----------------------------------------------------------------------------------------
 # copied from https://github.com/nextstrain/augur/blob/master/base/scores.py
 # also see explanation here https://photos.app.goo.gl/gtjQziD8BLATQivR6
-def set_lb_values(dtree, tau, seq_len, metrics_to_calc=None, dont_normalize=False, multifo=None, use_old_multiplicity_method=False, debug=False):
+def set_lb_values(dtree, tau, seq_len, metrics_to_calc=None, dont_normalize=False, multifo=None, use_old_multiplicity_method=False, use_dendropy=False, debug=False):
+    """ calculate lb values on <dtree>, either with the (default) array-based version, or the original dendropy node-by-node version (they should give the same values, so the latter is mostly useful for cross checking) """
+    lbfcn = set_lb_values_dendropy if use_dendropy else set_lb_values_arrays
+    return lbfcn(dtree, tau, seq_len, metrics_to_calc=metrics_to_calc, dont_normalize=dont_normalize, multifo=multifo, use_old_multiplicity_method=use_old_multiplicity_method, debug=debug)
+
+# ----------------------------------------------------------------------------------------
+def get_lb_tree_arrays(dtree, multifo=None):  # parent index/branch length array representation of <dtree>, with nodes in preorder (so each node's parent comes before it)
+    nodes = list(dtree.preorder_node_iter())
+    node_indices = {n : i for i, n in enumerate(nodes)}
+    labels = [n.taxon.label for n in nodes]
+    parents = numpy.array([-1 if n.parent_node is None else node_indices[n.parent_node] for n in nodes], dtype=int)
+    lengths = numpy.array([0. if n.parent_node is None or n.edge.length is None else n.edge.length for n in nodes])  # distance to parent (zero for root)
+    mtpys = numpy.array([node_mtpy(multifo, n) for n in nodes], dtype=float)
+    depths = numpy.zeros(len(nodes), dtype=int)  # number of branches between each node and root
+    for inode in range(1, len(nodes)):
+        depths[inode] = depths[parents[inode]] + 1
+    return labels, parents, lengths, mtpys, depths
+
+# ----------------------------------------------------------------------------------------
+def get_lb_messages(parents, lengths, depths, tau, own_mtpys=None, extra_up_sums=None):
+    """
+    vectorized version of the up/down message passing in set_lb_values_dendropy(): for each node in the arrays from get_lb_tree_arrays(), returns <up> (message to its parent), <down> (message from its parent), and <child_sums> (sum of its children's <up>)
+    <own_mtpys>: multiplicity factor on each node's own contribution (for the old multiplicity method), <extra_up_sums>: fixed extra amount in each node's <child_sums> (e.g. from dummy multiplicity nubs)
+    loops over depth (so a tree's height, rather than its number of nodes, sets the number of numpy calls)
+    """
+    decays = numpy.exp(-lengths / tau)
+    own_contribs = tau * (1 - decays)  # contribution of each node to its parent's lbi: zero if the two are very close, increasing toward asymptote of <tau> for distances near 1/tau (integral from 0 to l of decaying exponential)
+    if own_mtpys is not None:
+        own_contribs *= own_mtpys
+    child_sums = numpy.zeros(len(parents)) if extra_up_sums is None else numpy.array(extra_up_sums, dtype=float)
+    up, down = numpy.zeros(len(parents)), numpy.zeros(len(parents))
+    depth_order = numpy.argsort(depths, kind='mergesort')
+    depth_bounds = numpy.searchsorted(depths[depth_order], numpy.arange(depths.max() + 2))
+    depth_indices = [depth_order[depth_bounds[d] : depth_bounds[d + 1]] for d in range(depths.max() + 1)]
+    for idxs in reversed(depth_indices):  # postorder (children first): each node's up message is its children's up messages decayed by the distance to its parent, plus its own contribution
+        up[idxs] = decays[idxs] * child_sums[idxs] + own_contribs[idxs]
+        if depths[idxs[0]] > 0:
+            numpy.add.at(child_sums, parents[idxs], up[idxs])
+    for idxs in depth_indices:  # preorder (parents first): each node's down message is its parent's down message plus its siblings' up messages, decayed by the distance to its parent, plus its own contribution
+        if depths[idxs[0]] == 0:
+            down[idxs] = own_contribs[idxs]
+        else:
+            pidxs = parents[idxs]
+            down[idxs] = decays[idxs] * (down[pidxs] + child_sums[pidxs] - up[idxs]) + own_contribs[idxs]
+    return up, down, child_sums
+
+# ----------------------------------------------------------------------------------------
+def get_lb_vals_from_messages(down, child_sums, total_length):
+    lbvals = {'lbi' : down + child_sums,
+              'lbr' : numpy.where(down > 0., child_sums / numpy.where(down > 0., down, 1.), child_sums),  # it might make more sense to not include the branch between <node> and its parent in either the numerator or denominator (here it's included in the denominator), but this way I don't have to change any of the calculations above
+              'lbf' : child_sums * 100. / total_length}
+    return lbvals
+
+# ----------------------------------------------------------------------------------------
+def set_lb_values_arrays(dtree, tau, seq_len, metrics_to_calc=None, dont_normalize=False, multifo=None, use_old_multiplicity_method=False, n_tau_lengths=10, debug=False):
+    """
+    array-based equivalent of set_lb_values_dendropy(): instead of adding dummy branches to (a copy of) the tree, the dummy root branch becomes the root's branch length (the root's down message is then from a parent with no other children), and the dummy multiplicity nubs become a fixed extra amount in each node's sum of up messages
+    """
+    if debug:
+        print '    setting %s values with tau %.4f' % (' and '.join(metrics_to_calc), tau)
+    labels, parents, lengths, mtpys, depths = get_lb_tree_arrays(dtree, multifo=multifo)
+    lengths[0] = n_tau_lengths * tau  # dummy branch above root (same length as in get_tree_with_dummy_branches())
+    if use_old_multiplicity_method:  # insert multiplicity into integrals
+        up, down, child_sums = get_lb_messages(parents, lengths, depths, tau, own_mtpys=mtpys)
+        total_length = lengths.sum()
+    else:  # N-1 dummy branches of length <tau> from each node
+        up, down, child_sums = get_lb_messages(parents, lengths, depths, tau, extra_up_sums=(mtpys - 1) * tau * (1 - numpy.exp(-1.)))
+        total_length = lengths.sum() + tau * (mtpys - 1).sum()
+    lbvals = get_lb_vals_from_messages(down, child_sums, total_length)
+    lbvals['lbr'][0] = 0.
+
+    returnfo = {m : {} for m in metrics_to_calc}
+    for metric in metrics_to_calc:
+        mvals = lbvals[metric]
+        if metric == 'lbi' and not dont_normalize:
+            assert seq_len is not None
+            mvals = normalize_lb_val(metric, mvals, tau, seq_len)
+        returnfo[metric] = {l : float(v) for l, v in zip(labels, mvals)}
+
+    if debug:
+        max_width = str(max(len(l) for l in labels))
+        print ('   %s      %s      multi') % (utils.wfmt('node', max_width), ''.join('%s'%utils.wfmt(m, 9, jfmt='-') for m in metrics_to_calc))
+        for inode, label in enumerate(labels):
+            multi_str = '' if multifo is None else str(int(mtpys[inode]))
+            print ('    %' + max_width + 's  %s    %3s') % (label, ''.join('%8.3f ' % returnfo[m][label] for m in metrics_to_calc), multi_str)
+
+    return returnfo
+
+# ----------------------------------------------------------------------------------------
+def set_lb_values_dendropy(dtree, tau, seq_len, metrics_to_calc=None, dont_normalize=False, multifo=None, use_old_multiplicity_method=False, debug=False):
     """
     traverses <dtree> in postorder and preorder to calculate the up and downstream tree length exponentially weighted by distance, then adds them as LBI (and divides as LBR)
     use_old_multiplicity_method: insert multiplicity into integrals (below), which is equivalent to adding N-1 branches between the node and its parent
@@ -1144,7 +1298,7 @@ def compare_tree_distance_to_shm(dtree, annotation, max_frac_diff=0.25, only_che
     return len(fracs), len(pw_fracs)
 
 # ----------------------------------------------------------------------------------------
-def calculate_lb_values(dtree, tau, metrics_to_calc=None, dont_normalize=False, annotation=None, extra_str=None, iclust=None, dbgstr='', debug=False):
+def calculate_lb_values(dtree, tau, metrics_to_calc=None, dont_normalize=False, annotation=None, extra_str=None, iclust=None, dbgstr='', use_dendropy=False, debug=False):
     # note that it's a little weird to do all this tree manipulation here, but then do the dummy branch tree manipulation in set_lb_values(), but the dummy branch stuff depends on tau so it's better this way
     # <iclust> is just to give a little more granularity in dbg
 
@@ -1191,7 +1345,7 @@ def calculate_lb_values(dtree, tau, metrics_to_calc=None, dont_normalize=False,
 
     if iclust is None or iclust == 0:
         print '    calculating %s %s%s with tau %.4f' % (normstr, ' and '.join([lb_metrics.get(m, m) for m in utils.non_none([metrics_to_calc, '?'])]), dbgstr, tau)
-    lbvals = set_lb_values(dtree, tau, seq_len, metrics_to_calc=metrics_to_calc, dont_normalize=dont_normalize, multifo=multifo, debug=debug)
+    lbvals = set_lb_values(dtree, tau, seq_len, metrics_to_calc=metrics_to_calc, dont_normalize=dont_normalize, multifo=multifo, use_dendropy=use_dendropy, debug=debug)
     lbvals['tree'] = treestr
 
     return lbvals
@@ -1231,7 +1385,30 @@ def get_tree_for_lb_bounds(bound, metric, seq_len, tau, n_generations, n_offspri
     return dtree
 
 # ----------------------------------------------------------------------------------------
-def calculate_lb_bounds(seq_len, tau, n_tau_lengths=10, n_generations=None, n_offspring=2, only_metrics=None, btypes=None, debug=False):  # NOTE the min is just tau, but I don't feel like deleting this fcn just to keep clear what the min means
+def get_symmetric_tree_lb_values(seq_len, tau, n_generations, n_offspring, n_tau_lengths=10):
+    """
+    lb values for each generation of the trees from get_tree_for_lb_bounds() (in which every node has <n_offspring> children, with branch length 1/<seq_len>, for <n_generations>)
+    since every node in a generation has the same values, we only need one "node" per generation (with <n_offspring> identical children) rather than actually building the exponentially large tree
+    """
+    lengths = numpy.array([n_tau_lengths * tau] + [1. / seq_len for _ in range(n_generations)])  # first one is the dummy branch above root
+    decays = numpy.exp(-lengths / tau)
+    up, child_sums = numpy.zeros(n_generations + 1), numpy.zeros(n_generations + 1)
+    for igen in reversed(range(n_generations + 1)):  # can't use get_lb_messages() since each node's child sum has <n_offspring> copies of the next generation's up message
+        if igen < n_generations:
+            child_sums[igen] = n_offspring * up[igen + 1]
+        up[igen] = decays[igen] * child_sums[igen] + tau * (1 - decays[igen])
+    down = numpy.zeros(n_generations + 1)
+    down[0] = tau * (1 - decays[0])
+    for igen in range(1, n_generations + 1):
+        down[igen] = decays[igen] * (down[igen - 1] + child_sums[igen - 1] - up[igen]) + tau * (1 - decays[igen])
+    total_length = lengths[0] + sum(n_offspring**igen for igen in range(1, n_generations + 1)) / float(seq_len)
+    lbvals = get_lb_vals_from_messages(down, child_sums, total_length)
+    lbvals['lbr'][0] = 0.
+    return lbvals
+
+# ----------------------------------------------------------------------------------------
+# if <use_dendropy> is set, we build the actual (exponentially large) trees and run the normal lb calculation on them (which also gives you the trees and per-node values in 'vals'), otherwise use get_symmetric_tree_lb_values()
+def calculate_lb_bounds(seq_len, tau, n_tau_lengths=10, n_generations=None, n_offspring=2, only_metrics=None, btypes=None, use_dendropy=False, debug=False):  # NOTE the min is just tau, but I don't feel like deleting this fcn just to keep clear what the min means
     info = {m : {} for m in lb_metrics}
     n_generations = set_n_generations(seq_len, tau, n_tau_lengths, n_generations, debug=debug)
     for metric in [m for m in lb_metrics if only_metrics is None or m in only_metrics]:
@@ -1242,10 +1419,16 @@ def calculate_lb_bounds(seq_len, tau, n_tau_lengths=10, n_generations=None, n_of
             if debug:
                 print '    %s %s for seq len %d' % (utils.color('red', bound), utils.color('yellow', metric), seq_len)
             start = time.time()
+            bfcn = __builtins__[bound]  # min() or max()
+            if not use_dendropy:
+                gen_vals = get_symmetric_tree_lb_values(seq_len, tau, n_generations, n_offspring if bound == 'max' else 1, n_tau_lengths=n_tau_lengths)[metric]
+                info[metric][bound] = {metric : float(bfcn(gen_vals)), 'vals' : None}
+                if debug:
+                    print '     %s of %d generations\' %s values (%.1fs): %.4f' % (bound, n_generations + 1, metric, time.time() - start, info[metric][bound][metric])
+                continue
             dtree = get_tree_for_lb_bounds(bound, metric, seq_len, tau, n_generations, n_offspring, debug=debug)
             label_nodes(dtree)
             lbvals = calculate_lb_values(dtree, tau, metrics_to_calc=[metric], dont_normalize=True, debug=debug)
-            bfcn = __builtins__[bound]  # min() or max()
             info[metric][bound] = {metric : bfcn(lbvals[metric].values()), 'vals' : lbvals}
             if debug:
                 bname, bval = bfcn(lbvals[metric].items(), key=operator.itemgetter(1))
@@ -1872,7 +2055,7 @@ def check_cluster_indices(cluster_indices, ntot, inf_lines_to_use):
 
 # ----------------------------------------------------------------------------------------
 # gets new tree for each specified annotation, and add a new 'tree-info' key for each (overwriting any that's already there)
-def get_trees_for_annotations(inf_lines_to_use, treefname=None, cpath=None, workdir=None, cluster_indices=None, run_gctree=False, gctree_outdir=None, glfo=None, debug=False):
+def get_trees_for_annotations(inf_lines_to_use, treefname=None, cpath=None, workdir=None, cluster_indices=None, run_gctree=False, gctree_outdir=None, glfo=None, n_procs=1, batch_system=None, batch_options=None, tree_cachedir=None, debug=False):
     # ----------------------------------------------------------------------------------------
     def prep_gctree(iclust, line):
         if glfo is not None:  # if you don't pass in glfo, your sequences better not have fwk insertions since gctree barfs on ambiguous bases
@@ -1907,6 +2090,7 @@ def get_trees_for_annotations(inf_lines_to_use, treefname=None, cpath=None, work
     tree_origin_counts = {n : {'count' : 0, 'label' : l} for n, l in (('treefname', 'read from %s' % treefname), ('cpath', 'made from cpath'), ('fasttree', 'ran fasttree'), ('gctree', 'ran gctree'), ('no-uids', 'no uids in common between annotation and trees in file'), ('lonr', 'ran liberman lonr'))}
     n_already_there, n_skipped_uid = 0, 0
     cmdfos, treefos = [None for _ in inf_lines_to_use], [None for _ in inf_lines_to_use]
+    fasttree_iclusts, fastfos, cpath_iclusts = [], [], []  # fasttree runs (both for whole families, and for sub-clusters of trees made from the cpath) get collected and run all at once at the end
     for iclust, line in enumerate(inf_lines_to_use):
         if cluster_indices is not None and iclust not in cluster_indices:
             continue
@@ -1938,11 +2122,13 @@ def get_trees_for_annotations(inf_lines_to_use, treefname=None, cpath=None, work
             dtree = None
             origin = 'gctree'
         elif cpath is not None and cpath.i_best is not None and line['unique_ids'] in cpath.partitions[cpath.i_best]:
-            dtree = cpath.get_single_tree(line, get_fasttrees=True, debug=False)
+            cpath_iclusts.append(iclust)  # these get started below, then their fasttree runs go in the pool with everybody else's
+            dtree = None
             origin = 'cpath'
-        else:  # NOTE i sunk a bunch of time into trying to parallelize this, but since the existing fcn uses tempfile, and is called from a bunch of other places, it's pretty darn hard and probably not worth it
-            seqfos = [{'name' : uid, 'seq' : seq} for uid, seq in zip(line['unique_ids'], line['seqs'])]
-            dtree = get_fasttree_tree(seqfos, naive_seq=line['naive_seq'], debug=debug)
+        else:
+            fasttree_iclusts.append(iclust)
+            fastfos.append({'seqfos' : [{'name' : uid, 'seq' : seq} for uid, seq in zip(line['unique_ids'], line['seqs'])], 'naive_seq' : line['naive_seq']})
+            dtree = None
             origin = 'fasttree'
 
         tree_origin_counts[origin]['count'] += 1
@@ -1952,9 +2138,25 @@ def get_trees_for_annotations(inf_lines_to_use, treefname=None, cpath=None, work
             continue
         addtree(iclust, line, dtree, origin)
 
+    cpath_tfos, cpath_fasttree_strs = [], {}
+    if len(cpath_iclusts) > 0:
+        i_cpath_clusters = {cpath.best().index(inf_lines_to_use[i]['unique_ids']) : i for i in cpath_iclusts}  # index in cpath's best partition : index in <inf_lines_to_use>
+        cpath_tfos = cpath.start_trees(utils.get_annotation_dict([inf_lines_to_use[i] for i in cpath_iclusts]), i_only_clusters=i_cpath_clusters.keys(), get_fasttrees=True)
+    cpath_fastfos = [ffo for tfo in cpath_tfos for ffo in tfo['fastfos']]
+    if len(fastfos) + len(cpath_fastfos) > 0:
+        treestrs = run_fasttree_pool(fastfos + cpath_fastfos, workdir=workdir, n_procs=n_procs, batch_system=batch_system, batch_options=batch_options, cachedir=tree_cachedir, print_time=True, debug=debug)
+        for iclust, ffo, treestr in zip(fasttree_iclusts, fastfos, treestrs[ : len(fastfos)]):
+            addtree(iclust, inf_lines_to_use[iclust], get_dtree_from_fasttree(treestr, [sfo['name'] for sfo in ffo['seqfos']], debug=debug), 'fasttree')
+        cpath_fasttree_strs = {ffo['label'] : tstr for ffo, tstr in zip(cpath_fastfos, treestrs[len(fastfos) : ])}
+    if len(cpath_tfos) > 0:
+        cpath.finish_trees(cpath_tfos, cpath_fasttree_strs)
+        for tfo in cpath_tfos:
+            iclust = i_cpath_clusters[tfo['i_cluster']]
+            addtree(iclust, inf_lines_to_use[iclust], cpath.trees[tfo['i_cluster']], 'cpath')
+
     if cmdfos.count(None) != len(cmdfos):
         start = time.time()
-        utils.run_cmds(cmdfos, n_max_procs=utils.auto_n_procs(), proc_limit_str='gctree-run.py', debug='print')
+        utils.run_cmds(cmdfos, n_max_procs=utils.auto_n_procs(), debug='print')
         print '    made %d gctrees (%.1fs)' % (len(cmdfos), time.time() - start)
         assert len(inf_lines_to_use) == len(cmdfos)
         for iclust, (line, cfo) in enumerate(zip(inf_lines_to_use, cmdfos)):
@@ -1989,7 +2191,7 @@ def get_aa_lb_metrics(line, nuc_dtree, lb_tau, dont_normalize_lbi=False, extra_s
 
 # ----------------------------------------------------------------------------------------
 def add_smetrics(args, metrics_to_calc, annotations, lb_tau, cpath=None, treefname=None, reco_info=None, use_true_clusters=False, base_plotdir=None,
-                 train_dtr=False, dtr_cfg=None, ete_path=None, workdir=None, true_lines_to_use=None, outfname=None, only_use_best_partition=False, glfo=None, gctree_outdir=None, debug=False):
+                 train_dtr=False, dtr_cfg=None, ete_path=None, workdir=None, true_lines_to_use=None, outfname=None, only_use_best_partition=False, glfo=None, gctree_outdir=None, tree_cachedir=None, debug=False):
     min_cluster_size = args.min_selection_metric_cluster_size  # default_min_selection_metric_cluster_size
     print 'getting selection metrics: %s' % ' '.join(metrics_to_calc)
     if reco_info is not None:
@@ -2015,7 +2217,8 @@ def add_smetrics(args, metrics_to_calc, annotations, lb_tau, cpath=None, treefna
         n_after = len(inf_lines_to_use)  # after removing the small ones
         treefos = None
         if 'tree' in args.selection_metric_plot_cfg or any(m in metrics_to_calc for m in ['lbi', 'lbr', 'lbf', 'aa-lbi', 'aa-lbr', 'aa-lbf']):  # get the tree if we're making tree plots or if any of the requested metrics need a tree
-            treefos = get_trees_for_annotations(inf_lines_to_use, treefname=treefname, cpath=cpath, workdir=workdir, cluster_indices=args.cluster_indices, run_gctree=args.run_gctree, gctree_outdir=gctree_outdir, glfo=glfo, debug=debug)
+            treefos = get_trees_for_annotations(inf_lines_to_use, treefname=treefname, cpath=cpath, workdir=workdir, cluster_indices=args.cluster_indices, run_gctree=args.run_gctree, gctree_outdir=gctree_outdir, glfo=glfo,
+                                               n_procs=args.n_procs, batch_system=args.batch_system, batch_options=args.batch_options, tree_cachedir=tree_cachedir, debug=debug)
         print '    calculating selection metrics for %d cluster%s with size%s: %s' % (n_after, utils.plural(n_after), utils.plural(n_after), ' '.join(str(len(l['unique_ids'])) for l in inf_lines_to_use))
         print '      skipping %d smaller than %d' % (n_before - n_after, min_cluster_size)
         check_cluster_indices(args.cluster_indices, n_after, inf_lines_to_use)
@@ -3184,7 +3387,7 @@ def combine_selection_metrics(lp_infos, min_cluster_size=default_min_selection_m
             print_dbg(metric_pairs, iclust_mfos)  # note that this fcn uses a lot of local variables that we don't pass to it
     inf_lines, true_lines = (None, pair_antns) if is_simu else (utils.get_annotation_dict(pair_antns), None)
     add_smetrics(args, args.selection_metrics_to_calculate, inf_lines, args.lb_tau, true_lines_to_use=true_lines, treefname=args.treefname, base_plotdir=plotdir, ete_path=args.ete_path,
-                 workdir=args.workdir, outfname=args.selection_metric_fname) #, debug=True)
+                 workdir=args.workdir, outfname=args.selection_metric_fname, tree_cachedir=args.tree_cachedir) #, debug=True)
 # TODO will need these args in order to run gctree
                  # glfo=, gctree_outdir=None if args.outfname is None or not args.run_gctree else os.path.dirname(utils.fpath(args.outfname)),
     if args.chosen_ab_fname is not None:
@@ -17,7 +17,10 @@ from collections import OrderedDict
 import csv
 import subprocess
 import multiprocessing
+import threading
+import Queue
 import copy
+import shutil
 import traceback
 import json
 import types
@@ -3464,6 +3467,68 @@ def find_replacement_genes(param_dir, min_counts, gene_name=None, debug=False, a
     # print '    \nWARNING return default gene %s \'cause I couldn\'t find anything remotely resembling %s' % (color_gene(hackey_default_gene_versions[region]), color_gene(gene_name))
     # return hackey_default_gene_versions[region]
 
+# ----------------------------------------------------------------------------------------
+# vectorized hamming distance: each sequence is encoded as a uint8 array of its characters, except that ambiguous bases/amino acids and gap characters become 0, so the distance is the number of positions where the codes differ and neither is 0
+hamming_code_tables = {}
+hamming_loop_max_len = 50  # hamming_distance() uses a plain python loop for seqs shorter than this, since the numpy overhead dominates (see test/hamming-bench.py)
+def hamming_codes(seq, amino_acid=False):
+    if amino_acid not in hamming_code_tables:
+        table = numpy.arange(256, dtype=numpy.uint8)
+        table[[ord(c) for c in (ambiguous_amino_acids if amino_acid else all_ambiguous_bases) + gap_chars]] = 0
+        hamming_code_tables[amino_acid] = table
+    return hamming_code_tables[amino_acid][numpy.frombuffer(str(seq), dtype=numpy.uint8)]
+
+# ----------------------------------------------------------------------------------------
+def hamming_code_matrix(seqlist, amino_acid=False):  # 2d array with the codes for each of the (equal-length) seqs in <seqlist>
+    if len(set(len(s) for s in seqlist)) > 1:
+        raise Exception('unequal length sequences: %s' % ' '.join(str(l) for l in sorted(set(len(s) for s in seqlist))))
+    return numpy.array([hamming_codes(s, amino_acid=amino_acid) for s in seqlist], dtype=numpy.uint8).reshape(len(seqlist), len(seqlist[0]) if len(seqlist) > 0 else 0)
+
+# ----------------------------------------------------------------------------------------
+def hamming_distances_to_seq(seq, seqlist, amino_acid=False, return_fractions=False):  # distances (or fractions) from <seq> to each seq in <seqlist>, as a numpy array
+    dists, lengths = hamming_distance_matrix([seq], seqlist2=seqlist, amino_acid=amino_acid, return_len_excluding_ambig=True)
+    if return_fractions:
+        return hamming_fractions_from_counts(dists[0], lengths[0])
+    return dists[0]
+
+# ----------------------------------------------------------------------------------------
+def hamming_fractions_from_counts(dists, lengths):  # same convention as hamming_fraction(): zero if there's no unambiguous positions
+    return numpy.where(lengths > 0, dists / numpy.maximum(lengths, 1).astype(float), 0.)
+
+# ----------------------------------------------------------------------------------------
+# all-pairs distance matrix between each seq in <seqlist> and each seq in <seqlist2> (or <seqlist> if it's None)
+# uses matrix multiplication of one-hot encodings: the number of unambiguous positions is unambig1 . unambig2, and the number of matching positions is the sum over characters c of (seq1 == c) . (seq2 == c)
+# the float32 products are calculated for <block_size> rows of <seqlist> at a time and copied into the (preallocated) output, so apart from the output itself temporary memory is O(block_size * len(seqlist2))
+def hamming_distance_matrix(seqlist, seqlist2=None, amino_acid=False, return_len_excluding_ambig=False, return_fractions=False, block_size=1000):
+    codes1 = hamming_code_matrix(seqlist, amino_acid=amino_acid)
+    codes2 = codes1 if seqlist2 is None else hamming_code_matrix(seqlist2, amino_acid=amino_acid)
+    if seqlist2 is not None and len(seqlist) > 0 and len(seqlist2) > 0 and codes1.shape[1] != codes2.shape[1]:
+        raise Exception('unequal length sequences %d %d' % (codes1.shape[1], codes2.shape[1]))
+    def onehot(codes, char_code):
+        return (codes == char_code).astype(numpy.float32)  # float32 is exact for counts up to 2^24, and lets numpy use blas
+    return_lengths = return_len_excluding_ambig and not return_fractions
+    dists = numpy.zeros((len(codes1), len(codes2)), dtype=float if return_fractions else numpy.int32)
+    lengths = numpy.zeros(dists.shape, dtype=numpy.int32) if return_lengths else None
+    if len(codes1) > 0 and len(codes2) > 0:
+        unambig2 = (codes2 != 0).astype(numpy.float32).T
+        onehots2 = {c : onehot(codes2, c).T for c in set(numpy.unique(codes1)) & set(numpy.unique(codes2)) - set([0])}  # these are only O(len(seqlist2) * seq length)
+        for istart in range(0, len(codes1), block_size):
+            bcodes = codes1[istart : istart + block_size]
+            blengths = numpy.dot((bcodes != 0).astype(numpy.float32), unambig2)
+            bmatches = numpy.zeros(blengths.shape, dtype=numpy.float32)
+            for char_code, oh2 in onehots2.items():
+                bmatches += numpy.dot(onehot(bcodes, char_code), oh2)
+            bdists, blengths = (blengths - bmatches).astype(numpy.int32), blengths.astype(numpy.int32)
+            if return_fractions:
+                dists[istart : istart + block_size] = hamming_fractions_from_counts(bdists, blengths)
+            else:
+                dists[istart : istart + block_size] = bdists
+                if return_lengths:
+                    lengths[istart : istart + block_size] = blengths
+    if return_lengths:
+        return dists, lengths
+    return dists
+
 # ----------------------------------------------------------------------------------------
 def hamming_distance(seq1, seq2, extra_bases=None, return_len_excluding_ambig=False, return_mutated_positions=False, align=False, align_if_necessary=False, amino_acid=False):
     if extra_bases is not None:
@@ -3480,21 +3545,25 @@ def hamming_distance(seq1, seq2, extra_bases=None, return_len_excluding_ambig=Fa
         else:
             return 0
 
-    if amino_acid:
-        skip_chars = set(ambiguous_amino_acids + gap_chars)
+    if len(seq1) < hamming_loop_max_len:  # for short seqs (e.g. cdr3s and aa seqs) the numpy overhead is larger than the loop
+        skip_chars = set((ambiguous_amino_acids if amino_acid else all_ambiguous_bases) + gap_chars)
+        distance, len_excluding_ambig = 0, 0
+        mutated_positions = []
+        for ich in range(len(seq1)):  # already made sure they're the same length
+            if seq1[ich] in skip_chars or seq2[ich] in skip_chars:
+                continue
+            len_excluding_ambig += 1
+            if seq1[ich] != seq2[ich]:
+                distance += 1
+                if return_mutated_positions:
+                    mutated_positions.append(ich)
     else:
-        skip_chars = set(all_ambiguous_bases + gap_chars)
-
-    distance, len_excluding_ambig = 0, 0
-    mutated_positions = []
-    for ich in range(len(seq1)):  # already made sure they're the same length
-        if seq1[ich] in skip_chars or seq2[ich] in skip_chars:
-            continue
-        len_excluding_ambig += 1
-        if seq1[ich] != seq2[ich]:
-            distance += 1
-            if return_mutated_positions:
-                mutated_positions.append(ich)
+        codes1, codes2 = hamming_codes(seq1, amino_acid=amino_acid), hamming_codes(seq2, amino_acid=amino_acid)
+        unambig = (codes1 != 0) & (codes2 != 0)  # positions where neither is ambiguous or a gap
+        mutated = unambig & (codes1 != codes2)
+        distance, len_excluding_ambig = int(numpy.count_nonzero(mutated)), int(numpy.count_nonzero(unambig))
+        if return_mutated_positions:
+            mutated_positions = [int(i) for i in numpy.flatnonzero(mutated)]
 
     if return_len_excluding_ambig and return_mutated_positions:
         return distance, len_excluding_ambig, mutated_positions
@@ -3539,10 +3608,14 @@ def get_mut_codes(naive_seq, obs_seq, amino_acid=False, debug=False):  # return
     return mcodes
 
 # ----------------------------------------------------------------------------------------
-def mean_pairwise_hfrac(seqlist):
+def mean_pairwise_hfrac(seqlist, block_size=1000):  # go through <block_size> rows at a time, so we never have the whole matrix in memory
     if len(seqlist) < 2:
         return 0.
-    return numpy.mean([hamming_fraction(s1, s2) for s1, s2 in itertools.combinations(seqlist, 2)])
+    hfsum = 0.
+    for istart in range(0, len(seqlist), block_size):
+        hfracs = hamming_distance_matrix(seqlist[istart : istart + block_size], seqlist2=seqlist[istart : ], return_fractions=True)  # block rows vs all the columns to their right (plus the block's own diagonal, which we skip below)
+        hfsum += hfracs[numpy.triu_indices(hfracs.shape[0], k=1, m=hfracs.shape[1])].sum()
+    return hfsum / (len(seqlist) * (len(seqlist) - 1) / 2)
 
 # ----------------------------------------------------------------------------------------
 def lev_dist(s1, s2, aa=False):  # NOTE does *not* handle ambiguous characters correctly (also NOTE <aa> has no effect
@@ -4579,19 +4652,25 @@ cmdfo_defaults = {  # None means by default it's absent
     'threads' : None,  # slurm cpus per task
 }
 
+# ----------------------------------------------------------------------------------------
+def wait_for_proc(iproc, proc, finished_procs):  # target for the waiter threads in run_cmds(): block until <proc> exits, then tell the main thread which one it was
+    proc.wait()
+    finished_procs.put(iproc)
+
 # ----------------------------------------------------------------------------------------
 # notes:
 #  - set sleep to False if your commands are going to run really really really quickly
 #  - unlike everywhere else, <debug> is not a boolean, and is either None (swallow out, print err)), 'print' (print out and err), 'write' (write out and err to file called 'log' in logdir), or 'write:<log file name>' (same as 'write', but you set your own base name)
-#  - if both <n_max_procs> and <proc_limit_str> are set, it uses limit_procs() (i.e. a ps call) to count the total number of <proc_limit_str> running on the machine; whereas if only <n_max_procs> is set, it counts only subprocesses that it is itself running
+#  - if <n_max_procs> is set, at most that many of our own subprocesses run at once (the rest wait in a queue, and each is started as soon as a running one finishes)
+#  - we don't poll the running procs: each one gets a waiter thread that blocks on its exit, and the main thread blocks until one of them reports in, then runs finish_process() on it right away
 #  - debug: can be None (stdout mostly gets ignored), 'print' (printed), 'write' (written to file 'log' in logdir), or 'write:<logfname>' (same, but use <logfname>)
 def run_cmds(cmdfos, shell=False, n_max_tries=None, clean_on_success=False, batch_system=None, batch_options=None, batch_config_fname=None,
-             debug=None, ignore_stderr=False, sleep=True, n_max_procs=None, proc_limit_str=None, allow_failure=False):
+             debug=None, ignore_stderr=False, sleep=True, n_max_procs=None, allow_failure=False):
     if len(cmdfos) == 0:
         raise Exception('zero length cmdfos')
     if n_max_tries is None:
         n_max_tries = 1 if batch_system is None else 3
-    per_proc_sleep_time = 0.01 / max(1, len(cmdfos))
+    per_proc_sleep_time = 0.01 / max(1, len(cmdfos))  # only used to stagger process starts
 
     # check cmdfos and set defaults
     if len(set(cmdfo_required_keys) - set(cmdfos[0])) > 0:
@@ -4606,27 +4685,31 @@ def run_cmds(cmdfos, shell=False, n_max_tries=None, clean_on_success=False, batc
     if batch_system == 'slurm' and batch_config_fname is not None:
         set_slurm_nodelist(cmdfos, batch_config_fname)
 
-    procs, n_tries_list = [], []
-    for iproc in range(len(cmdfos)):
-        procs += [run_cmd(cmdfos[iproc], batch_system=batch_system, batch_options=batch_options, shell=shell)]
-        n_tries_list.append(1)
-        if sleep:
-            time.sleep(per_proc_sleep_time)
-        if n_max_procs is not None:
-            limit_procs(proc_limit_str, n_max_procs, procs=procs)  # NOTE now that I've added the <procs> arg, I should remove all the places where I'm using the old cmd str method (I mean, it works fine, but it's hackier/laggier, and in cases where several different parent procs are running a log of the same-named subprocs on the same machine, the old way will be wrong [i.e. limit_procs was originally intended as a global machine-wide limit, whereas in this fcn we usually call it wanting to set a specific number of subproces for this process])
-
-    while procs.count(None) != len(procs):  # we set each proc to None when it finishes
-        for iproc in range(len(cmdfos)):
-            if procs[iproc] is None:  # already finished
-                continue
-            if procs[iproc].poll() is not None:  # it just finished
-                status = finish_process(iproc, procs, n_tries_list[iproc], cmdfos[iproc], n_max_tries, dbgfo=cmdfos[iproc].get('dbgfo'), batch_system=batch_system, debug=debug, ignore_stderr=ignore_stderr, clean_on_success=clean_on_success, allow_failure=allow_failure)
-                if status == 'restart':
-                    procs[iproc] = run_cmd(cmdfos[iproc], batch_system=batch_system, batch_options=batch_options, shell=shell)
-                    n_tries_list[iproc] += 1
+    # ----------------------------------------------------------------------------------------
+    def start_proc(iproc):
+        procs[iproc] = run_cmd(cmdfos[iproc], batch_system=batch_system, batch_options=batch_options, shell=shell)
+        n_tries_list[iproc] += 1
+        wthread = threading.Thread(target=wait_for_proc, args=(iproc, procs[iproc], finished_procs))
+        wthread.daemon = True  # don't hang on exit if we're bailing because of an exception
+        wthread.start()
+
+    procs = [None for _ in cmdfos]  # we set each proc to None when it finishes successfully (in finish_process())
+    n_tries_list = [0 for _ in cmdfos]
+    waiting_procs = collections.deque(range(len(cmdfos)))  # indices of procs that haven't been started (or need to be restarted)
+    finished_procs = Queue.Queue()  # waiter threads put the index of each proc here when it exits
+    n_running = 0
+    while len(waiting_procs) > 0 or n_running > 0:
+        while len(waiting_procs) > 0 and (n_max_procs is None or n_running < n_max_procs):
+            start_proc(waiting_procs.popleft())
+            n_running += 1
+            if sleep and len(waiting_procs) > 0:
+                time.sleep(per_proc_sleep_time)
+        iproc = finished_procs.get(True, 3600 * 24 * 365)  # blocks until a proc exits (need a timeout, since otherwise in python 2 the wait can't be interrupted with ctrl-c)
+        n_running -= 1
+        status = finish_process(iproc, procs, n_tries_list[iproc], cmdfos[iproc], n_max_tries, dbgfo=cmdfos[iproc].get('dbgfo'), batch_system=batch_system, debug=debug, ignore_stderr=ignore_stderr, clean_on_success=clean_on_success, allow_failure=allow_failure)
+        if status == 'restart':
+            waiting_procs.appendleft(iproc)  # restarts get the slot that just opened up, ahead of procs that haven't started yet
         sys.stdout.flush()
-        if sleep:
-            time.sleep(per_proc_sleep_time)
 
 # ----------------------------------------------------------------------------------------
 def pad_lines(linestr, padwidth=8):
@@ -4996,6 +5079,43 @@ def get_cluster_ids(uids, partition):
                 clids[uid].append(iclust)
     return clids
 
+# ----------------------------------------------------------------------------------------
+# return a new partition in which any clusters in <partition> that share a uid have been merged (clusters that don't overlap with anybody come first, in their original order, followed by the merged clusters)
+# uses union-find on cluster indices, linking each cluster to the first cluster in which we saw each of its uids, so it's ~linear in the total number of uids
+def merge_overlapping_clusters(partition, debug=False):
+    # ----------------------------------------------------------------------------------------
+    def find(iclust):  # return the root of <iclust>'s set (with path halving)
+        while parents[iclust] != iclust:
+            parents[iclust] = parents[parents[iclust]]
+            iclust = parents[iclust]
+        return iclust
+    # ----------------------------------------------------------------------------------------
+    parents = range(len(partition))
+    first_iclusts = {}  # index of the first cluster in which we saw each uid
+    for iclust, cluster in enumerate(partition):
+        for uid in cluster:
+            if uid not in first_iclusts:
+                first_iclusts[uid] = iclust
+                continue
+            iroot, jroot = find(first_iclusts[uid]), find(iclust)
+            if iroot != jroot:
+                if debug:
+                    print '    merging clusters %d and %d (share %s)' % (iroot, jroot, uid)
+                parents[max(iroot, jroot)] = min(iroot, jroot)
+
+    cluster_groups = OrderedDict()  # root cluster index : list of cluster indices in its set
+    for iclust in range(len(partition)):
+        rootclust = find(iclust)
+        if rootclust not in cluster_groups:
+            cluster_groups[rootclust] = []
+        cluster_groups[rootclust].append(iclust)
+
+    new_partition = [partition[cgroup[0]] for cgroup in cluster_groups.values() if len(cgroup) == 1]
+    new_partition += [list(set([uid for iclust in cgroup for uid in partition[iclust]])) for cgroup in cluster_groups.values() if len(cgroup) > 1]
+    if debug:
+        print '    merged %d overlapping clusters into %d (%d --> %d total)' % (sum(len(g) for g in cluster_groups.values() if len(g) > 1), len([g for g in cluster_groups.values() if len(g) > 1]), len(partition), len(new_partition))
+    return new_partition
+
 # ----------------------------------------------------------------------------------------
 # return a new list of partitions that has no duplicate uids (choice as to which cluster gets to keep a duplicate id is entirely random [well, it's the first one that has it, so not uniform random, but you can't specify it])
 def get_deduplicated_partitions(partitions, antn_list=None, glfo=None, debug=False):  # not using this atm since i wrote it for use in clusterpath, but then ended up not needing it UPDATE now using it during paired clustering resolution, but maybe only temporarily
@@ -5044,6 +5164,33 @@ def get_deduplicated_partitions(partitions, antn_list=None, glfo=None, debug=Fal
             print '           removed uids/from clusters with size: %s (+%d singletons)' % ('  '.join(s for s in dbg_strs if s!='1/1'), n_singletons)
     return new_partitions
 
+# ----------------------------------------------------------------------------------------
+def get_contingency_table(labels_a, labels_b):  # sparse contingency table for two equal-length lists of non-negative integer labels: returns (sorted array of keys encoding each distinct (a, b) pair, count of each pair, multiplier used to encode the keys)
+    labels_a, labels_b = [numpy.array(l, dtype=numpy.int64) for l in (labels_a, labels_b)]
+    n_b = int(labels_b.max()) + 1 if len(labels_b) > 0 else 1
+    keys, counts = numpy.unique(labels_a * n_b + labels_b, return_counts=True)
+    return keys, counts, n_b
+
+# ----------------------------------------------------------------------------------------
+def contingency_table_lookup(ctable, labels_a, labels_b):  # return counts in <ctable> (from get_contingency_table()) for each (a, b) pair in <labels_a>, <labels_b> (zero for pairs that aren't there)
+    keys, counts, n_b = ctable
+    labels_a, labels_b = [numpy.array(l, dtype=numpy.int64) for l in (labels_a, labels_b)]
+    qkeys = labels_a * n_b + labels_b
+    if len(keys) == 0:
+        return numpy.zeros(len(qkeys), dtype=counts.dtype)
+    iqs = numpy.minimum(numpy.searchsorted(keys, qkeys), len(keys) - 1)
+    return numpy.where((keys[iqs] == qkeys) & (labels_b < n_b), counts[iqs], 0)
+
+# ----------------------------------------------------------------------------------------
+def get_partition_labels(part_a, part_b):  # integer cluster index in each of <part_a> and <part_b> for each uid that's in both of them (uses the first cluster for uids that're in more than one)
+    clids_a, clids_b = {}, {}
+    for tpart, tclids in [(part_a, clids_a), (part_b, clids_b)]:
+        for iclust, cluster in enumerate(tpart):
+            for uid in cluster:
+                tclids.setdefault(uid, iclust)
+    common_uids = [u for u in clids_a if u in clids_b]
+    return numpy.array([clids_a[u] for u in common_uids], dtype=numpy.int64), numpy.array([clids_b[u] for u in common_uids], dtype=numpy.int64)
+
 # ----------------------------------------------------------------------------------------
 def per_seq_correct_cluster_fractions(partition, true_partition, reco_info=None, seed_unique_id=None, dbg_str='', inf_label='inferred', true_label='true', debug=False):
     if seed_unique_id is None:
@@ -5056,25 +5203,8 @@ def per_seq_correct_cluster_fractions(partition, true_partition, reco_info=None,
     uids = set([uid for cluster in partition for uid in cluster])
     clids = get_cluster_ids(uids, partition)  # map of {uid : (index of cluster in <partition> in which that uid occurs)} (well, list of indices, in case there's duplicates)
 
-    def get_clonal_fraction(uid, inferred_cluster):
-        """ Return the fraction of seqs in <uid>'s inferred cluster which are really clonal. """
-        n_clonal = 0
-        for tmpid in inferred_cluster:  # NOTE this includes the case where tmpid equal to uid
-            if reco_ids[tmpid] == reco_ids[uid]:  # reminder (see event.py) reco ids depend only on rearrangement parameters, i.e. two different rearrangement events with the same rearrangement parameters have the same reco id
-                n_clonal += 1
-        return float(n_clonal) / len(inferred_cluster)
-
-    def get_fraction_present(inferred_cluster, true_cluster):
-        """ Return the fraction of the true clonemates in <true_cluster> that appear in <inferred_cluster>. """
-        n_present = 0
-        for tmpid in true_cluster:  # NOTE this includes the case where tmpid equal to uid
-            if tmpid in inferred_cluster:
-                n_present += 1
-        return float(n_present) / len(true_cluster)
-
-    mean_clonal_fraction, mean_fraction_present = 0., 0.
-    n_uids = 0
-    for true_cluster in true_partition:
+    avg_uids, true_iclusts = [], []  # uids over which we average, and index of the true cluster for each of them
+    for itrue, true_cluster in enumerate(true_partition):
         if seed_unique_id is not None and seed_unique_id not in true_cluster:
             continue
         for uid in true_cluster:
@@ -5084,10 +5214,24 @@ def per_seq_correct_cluster_fractions(partition, true_partition, reco_info=None,
                 if debug:
                     print '  %s found %s in multiple clusters while calculating ccfs (returning None, None)' % (color('red', 'warning'), uid)
                 return None, None
-            inferred_cluster = partition[clids[uid][0]]  # we only look at the first cluster in which it appears
-            mean_clonal_fraction += get_clonal_fraction(uid, inferred_cluster)
-            mean_fraction_present += get_fraction_present(inferred_cluster, true_cluster)
-            n_uids += 1
+            avg_uids.append(uid)
+            true_iclusts.append(itrue)
+    inf_iclusts = [clids[u][0] for u in avg_uids]  # we only look at the first cluster in which it appears
+
+    # purity: fraction of seqs in each uid's inferred cluster which are really clonal, using a table of the number of seqs in each inferred cluster with each reco id (reminder (see event.py) reco ids depend only on rearrangement parameters, i.e. two different rearrangement events with the same rearrangement parameters have the same reco id)
+    reco_codes = {r : i for i, r in enumerate(set(reco_ids.values()))}
+    clonal_table = get_contingency_table([iclust for iclust, cluster in enumerate(partition) for _ in cluster], [reco_codes[reco_ids[u]] for cluster in partition for u in cluster])
+    n_clonal = contingency_table_lookup(clonal_table, inf_iclusts, [reco_codes[reco_ids[u]] for u in avg_uids])
+    inf_sizes = numpy.array([len(c) for c in partition], dtype=numpy.float64)[inf_iclusts]
+    # completeness: fraction of each uid's true clonemates that appear in its inferred cluster, using a table of the number of seqs in each true cluster that are in each inferred cluster
+    present_pairs = [(itrue, iclust) for itrue, true_cluster in enumerate(true_partition) for u in true_cluster for iclust in clids.get(u, [])]
+    present_table = get_contingency_table(*zip(*present_pairs)) if len(present_pairs) > 0 else get_contingency_table([], [])
+    n_present = contingency_table_lookup(present_table, true_iclusts, inf_iclusts)
+    true_sizes = numpy.array([len(c) for c in true_partition], dtype=numpy.float64)[true_iclusts]
+
+    mean_clonal_fraction = sum((n_clonal / inf_sizes).tolist(), 0.)  # NOTE use python sum() so we add them up in the same order as the old per-uid loop (so results are identical)
+    mean_fraction_present = sum((n_present / true_sizes).tolist(), 0.)
+    n_uids = len(avg_uids)
 
     if n_uids > 1e6:
         raise Exception('you should start worrying about numerical precision if you\'re going to run on this many queries')
@@ -5101,6 +5245,34 @@ def per_seq_correct_cluster_fractions(partition, true_partition, reco_info=None,
         print '      completeness: %.1f / %d = %.3f' % (mean_fraction_present, n_uids, mean_fraction_present / n_uids)
     return mean_clonal_fraction / n_uids, mean_fraction_present / n_uids
 
+# ----------------------------------------------------------------------------------------
+def adjusted_rand_index(partition_a, partition_b):  # over uids that're in both partitions
+    labels_a, labels_b = get_partition_labels(partition_a, partition_b)
+    if len(labels_a) < 2:
+        return 1.
+    def n_pairs(counts): return float(numpy.sum(counts * (counts - 1) / 2))
+    _, counts, _ = get_contingency_table(labels_a, labels_b)
+    sum_both = n_pairs(counts)
+    sum_a, sum_b = [n_pairs(numpy.bincount(l)) for l in (labels_a, labels_b)]
+    expected = sum_a * sum_b / n_pairs(numpy.array([len(labels_a)]))
+    max_val = 0.5 * (sum_a + sum_b)
+    if max_val == expected:  # e.g. both partitions are all singletons, or both are one cluster
+        return 1.
+    return (sum_both - expected) / (max_val - expected)
+
+# ----------------------------------------------------------------------------------------
+def variation_of_information(partition_a, partition_b, normalize=False):  # over uids that're in both partitions (natural log; if <normalize> is set, divide by log(N) so it's between 0 and 1)
+    labels_a, labels_b = get_partition_labels(partition_a, partition_b)
+    n_uids = float(len(labels_a))
+    if n_uids < 2:
+        return 0.
+    keys, counts, n_b = get_contingency_table(labels_a, labels_b)
+    sizes_a, sizes_b = [numpy.bincount(l).astype(numpy.float64) for l in (labels_a, labels_b)]
+    both_fracs = counts / n_uids
+    vi = -numpy.sum(both_fracs * (numpy.log(counts / sizes_a[keys // n_b]) + numpy.log(counts / sizes_b[keys % n_b])))
+    vi = max(0., vi)  # avoid -0.0 for identical partitions
+    return vi / math.log(n_uids) if normalize else vi
+
 # ----------------------------------------------------------------------------------------
 def per_family_correct_cluster_fractions(partition, true_partition, debug=False):
     # The new ccfs above are pretty similar, except they're per-sequence rather than per-cluster, so they don't get all scatterbrained and shit when a sample's only got a few clusters.
@@ -5193,13 +5365,18 @@ def partition_similarity_matrix(partition_a, partition_b, n_biggest_clusters, is
 
     smatrix = [[float('nan') for _ in b_clusters] for _ in a_clusters]
     dszs, dovlps, dfracs = [], [], []
-    overlap_matrix = [[set(clust_a) & set(clust_b) for clust_b in b_clusters] for clust_a in a_clusters]
+    b_clids = get_cluster_ids(set(u for c in b_clusters for u in c), b_clusters)
+    overlap_pairs = [(ia, ib) for ia, clust_a in enumerate(a_clusters) for u in set(clust_a) for ib in b_clids.get(u, [])]  # one entry for each uid in each pair of overlapping clusters
+    overlap_matrix = numpy.zeros((len(a_clusters), len(b_clusters)), dtype=numpy.int64)  # size of intersection of each pair of clusters
+    if len(overlap_pairs) > 0:
+        ias, ibs = zip(*overlap_pairs)
+        overlap_matrix = numpy.bincount(numpy.array(ias) * len(b_clusters) + numpy.array(ibs), minlength=len(a_clusters) * len(b_clusters)).reshape(len(a_clusters), len(b_clusters))
     for ia, clust_a in enumerate(a_clusters):
         sub_szs, sub_ovlps, sub_fracs, n_found = [], [], [], 0
         for ib, clust_b in enumerate(b_clusters):
-            if len(overlap_matrix[ia][ib]) == 0:
+            if overlap_matrix[ia, ib] == 0:
                 continue
-            n_common = len(overlap_matrix[ia][ib])
+            n_common = int(overlap_matrix[ia, ib])
             ifrac = float(n_common) / norm_factor(clust_a, clust_b)
             smatrix[ia][ib] = float('nan') if ifrac==0 else ifrac  # nan gives you transparent/empty color
             if debug and n_common > 0:
@@ -5273,19 +5450,21 @@ def check_intersection_and_complement(part_a, part_b, only_warn=False, a_label='
 # ----------------------------------------------------------------------------------------
 def get_cluster_list_for_sklearn(part_a, part_b):
     # convert from partition format {cl_1 : [seq_a, seq_b], cl_2 : [seq_c]} to [cl_1, cl_1, cl_2]
-    # NOTE this will be really slow for larger partitions
+    clids_a, clids_b = [get_cluster_ids(set(u for c in p for u in c), p) for p in (part_a, part_b)]
 
     # first make sure that <part_a> has every uid in <part_b> (the converse is checked below)
-    for jclust in range(len(part_b)):
-        for uid in part_b[jclust]:
-            find_uid_in_partition(uid, part_a)  # raises exception if not found
+    for uid in clids_b:
+        if uid not in clids_a:
+            raise Exception('couldn\'t find %s in %s\n' % (uid, part_a))
 
     # then make the cluster lists
     clusts_a, clusts_b = [], []
     for iclust in range(len(part_a)):
         for uid in part_a[iclust]:
+            if uid not in clids_b:
+                raise Exception('couldn\'t find %s in %s\n' % (uid, part_b))
             clusts_a.append(iclust)
-            clusts_b.append(find_uid_in_partition(uid, part_b))
+            clusts_b.append(clids_b[uid][0])
 
     return clusts_a, clusts_b
 
@@ -6111,6 +6290,70 @@ def read_vsearch_search_file(fname, userfields, seqdict, glfo, region, get_annot
 
     return {'gene-counts' : gene_counts, 'annotations' : annotations, 'failures' : failed_queries}
 
+# ----------------------------------------------------------------------------------------
+def get_vsearch_base_cmd(threshold, match_mismatch='2:-4', no_indels=False, minseqlength=None, vsearch_binary=None):  # the parts of the vsearch command that are the same for clustering and searching
+    # figure out which vsearch binary to use
+    if vsearch_binary is None:
+        vsearch_binary = os.path.dirname(os.path.realpath(__file__)).replace('/python', '') + '/bin'
+        if platform.system() == 'Linux':
+            vsearch_binary += '/vsearch-2.4.3-linux-x86_64'
+        elif platform.system() == 'Darwin':
+            vsearch_binary += '/vsearch-2.4.3-macos-x86_64'
+        else:
+            raise Exception('%s no vsearch binary in bin/ for platform \'%s\' (you can specify your own full vsearch path with --vsearch-binary)' % (color('red', 'error'), platform.system()))
+
+    cmd = vsearch_binary
+    cmd += ' --id ' + str(1. - threshold)  # reject if identity lower than this
+    match, mismatch = [int(m) for m in match_mismatch.split(':')]
+    assert mismatch < 0  # if you give it a positive one it doesn't complain, so presumably it's actually using that positive  (at least for v identification it only makes a small difference, but vsearch's default is negative)
+    cmd += ' --match %d'  % match  # default 2
+    cmd += ' --mismatch %d' % mismatch  # default -4
+    # cmd += ' --gapext %dI/%dE' % (2, 1)  # default: (2 internal)/(1 terminal)
+    # it would be nice to clean this up
+    gap_open = 1000 if no_indels else 50
+    cmd += ' --gapopen %dI/%dE' % (gap_open, 2)  # default: (20 internal)/(2 terminal)
+    if minseqlength is not None:
+        cmd += ' --minseqlength %d' % minseqlength
+    return cmd
+
+# ----------------------------------------------------------------------------------------
+# run vsearch clustering separately on each seq dict in <seqdicts> (they're never mixed within a run, since vsearch's greedy centroid clustering would then let a seq from one dict be absorbed by a centroid from another), and return the list of resulting partitions (in the same order as <seqdicts>, so it doesn't depend on which runs finish first)
+#  - seqdicts with more than <max_job_size> seqs get their own job, while smaller ones are packed (in order) into jobs of up to that many seqs, each of which runs vsearch once for each of its seqdicts
+#  - jobs are run with up to <n_procs> at a time
+def run_vsearch_cluster_batches(seqdicts, workdir, threshold, n_procs=1, max_job_size=1000, vsearch_binary=None, **kwargs):
+    jobs = [[]]  # list of indices in <seqdicts> for each job
+    for isd, seqdict in enumerate(seqdicts):
+        if len(jobs[-1]) > 0 and sum(len(seqdicts[i]) for i in jobs[-1]) + len(seqdict) > max_job_size:
+            jobs.append([])
+        jobs[-1].append(isd)
+    prep_dir(workdir)
+    cmdfos, outfnames = [], [None for _ in seqdicts]
+    for ijob, isds in enumerate(jobs):
+        subworkdir = '%s/job-%d' % (workdir, ijob)
+        prep_dir(subworkdir)
+        cmds, workfnames = [], []
+        for isd in isds:
+            infname, outfnames[isd] = '%s/input-%d.fa' % (subworkdir, isd), '%s/vsearch-clusters-%d.txt' % (subworkdir, isd)
+            with open(infname, 'w') as fastafile:
+                for name, seq in seqdicts[isd].items():
+                    fastafile.write('>' + name + '\n' + seq + '\n')
+            cmd = get_vsearch_base_cmd(threshold, vsearch_binary=vsearch_binary, **kwargs)
+            cmd += ' --cluster_fast %s --uc %s' % (infname, outfnames[isd])
+            if len(jobs) > 1 and n_procs > 1:  # with only one job at a time we let vsearch use all the cores (see note in run_vsearch()), otherwise we split them among the concurrent jobs
+                cmd += ' --threads %d' % max(1, auto_n_procs() // min(n_procs, len(jobs)))
+            cmd += ' --quiet'
+            cmds.append(cmd)
+            workfnames += [infname, outfnames[isd]]
+        cmdfos.append({'cmd_str' : ' && '.join(cmds), 'outfname' : outfnames[isds[-1]], 'workdir' : subworkdir, 'workfnames' : workfnames})  # the runs within a job go in order, so if the last one's output is there, they all finished
+    run_cmds(cmdfos, shell=True, n_max_procs=n_procs)
+    partitions = [read_vsearch_cluster_file(ofn) for ofn in outfnames]
+    for cfo in cmdfos:
+        for fname in cfo['workfnames']:
+            os.remove(fname)
+        os.rmdir(cfo['workdir'])
+    os.rmdir(workdir)
+    return partitions
+
 # ----------------------------------------------------------------------------------------
 # ok this sucks, but the original function below is used in a bunch of places that pass in a dict of seqs, and i don't want to mess with them since they're complicated, but now i also want it to be able to run on inputs with duplicate sequence ids
 def run_vsearch_with_duplicate_uids(action, seqlist, workdir, threshold, **kwargs):
@@ -6161,29 +6404,8 @@ def run_vsearch(action, seqdict, workdir, threshold, match_mismatch='2:-4', no_i
         for name, seq in seqdict.items():
             fastafile.write('>' + name + '\n' + seq + '\n')
 
-    # figure out which vsearch binary to use
-    if vsearch_binary is None:
-        vsearch_binary = os.path.dirname(os.path.realpath(__file__)).replace('/python', '') + '/bin'
-        if platform.system() == 'Linux':
-            vsearch_binary += '/vsearch-2.4.3-linux-x86_64'
-        elif platform.system() == 'Darwin':
-            vsearch_binary += '/vsearch-2.4.3-macos-x86_64'
-        else:
-            raise Exception('%s no vsearch binary in bin/ for platform \'%s\' (you can specify your own full vsearch path with --vsearch-binary)' % (color('red', 'error'), platform.system()))
-
     # build command
-    cmd = vsearch_binary
-    cmd += ' --id ' + str(1. - threshold)  # reject if identity lower than this
-    match, mismatch = [int(m) for m in match_mismatch.split(':')]
-    assert mismatch < 0  # if you give it a positive one it doesn't complain, so presumably it's actually using that positive  (at least for v identification it only makes a small difference, but vsearch's default is negative)
-    cmd += ' --match %d'  % match  # default 2
-    cmd += ' --mismatch %d' % mismatch  # default -4
-    # cmd += ' --gapext %dI/%dE' % (2, 1)  # default: (2 internal)/(1 terminal)
-    # it would be nice to clean this up
-    gap_open = 1000 if no_indels else 50
-    cmd += ' --gapopen %dI/%dE' % (gap_open, 2)  # default: (20 internal)/(2 terminal)
-    if minseqlength is not None:
-        cmd += ' --minseqlength %d' % minseqlength
+    cmd = get_vsearch_base_cmd(threshold, match_mismatch=match_mismatch, no_indels=no_indels, minseqlength=minseqlength, vsearch_binary=vsearch_binary)
     if action == 'cluster':
         outfname = workdir + '/vsearch-clusters.txt'
         cmd += ' --cluster_fast ' + infname
@@ -6401,9 +6623,16 @@ def write_only_partition(fname, partition):
     cpath = clusterpath.ClusterPath(partition=partition)
     write_annotations(fname, None, [], None, partition_lines=cpath.get_partition_lines())
 
+# ----------------------------------------------------------------------------------------
+yaml_output_version = 0.2  # 0.2: line-based json layout (see write_json_lines())
+yaml_output_keys = ['version-info', 'germline-info', 'partitions', 'events']  # NOTE order matters for write_json_lines()/stream_yaml_output()
+yaml_output_list_keys = ['partitions', 'events']  # keys whose values are lists that get one line per entry
+
 # ----------------------------------------------------------------------------------------
 def write_annotations(fname, glfo, annotation_list, headers, synth_single_seqs=False, failed_queries=None, partition_lines=None, use_pyyaml=False, dont_write_git_info=False):
-    if os.path.exists(fname):
+    if os.path.isdir(fname) and getsuffix(fname) == '.cols':
+        shutil.rmtree(fname)
+    elif os.path.exists(fname):
         os.remove(fname)
     elif not os.path.exists(os.path.dirname(os.path.abspath(fname))):
         os.makedirs(os.path.dirname(os.path.abspath(fname)))
@@ -6415,6 +6644,10 @@ def write_annotations(fname, glfo, annotation_list, headers, synth_single_seqs=F
         if partition_lines is None:
             partition_lines = clusterpath.ClusterPath(partition=get_partition_from_annotation_list(annotation_list)).get_partition_lines()
         write_yaml_output(fname, headers, glfo=glfo, annotation_list=annotation_list, synth_single_seqs=synth_single_seqs, failed_queries=failed_queries, partition_lines=partition_lines, use_pyyaml=use_pyyaml, dont_write_git_info=dont_write_git_info)
+    elif getsuffix(fname) == '.cols':
+        if partition_lines is None:
+            partition_lines = clusterpath.ClusterPath(partition=get_partition_from_annotation_list(annotation_list)).get_partition_lines()
+        write_columnar_output(fname, headers, glfo=glfo, annotation_list=annotation_list, failed_queries=failed_queries, partition_lines=partition_lines, dont_write_git_info=dont_write_git_info)
     else:
         raise Exception('unhandled file extension \'%s\' on %s' % (getsuffix(fname), fname))
 
@@ -6467,7 +6700,7 @@ def write_yaml_output(fname, headers, glfo=None, annotation_list=None, synth_sin
         partition_lines = []
     check_ids()
 
-    version_info = {'partis-yaml' : 0.1, 'partis-git' : '' if dont_write_git_info else get_version_info()}
+    version_info = {'partis-yaml' : yaml_output_version, 'partis-git' : '' if dont_write_git_info else get_version_info()}
     yaml_annotations = [get_yamlfo_for_output(l, headers, glfo=glfo) for l in annotation_list]
     if failed_queries is not None:
         yaml_annotations += failed_queries
@@ -6479,30 +6712,63 @@ def write_yaml_output(fname, headers, glfo=None, annotation_list=None, synth_sin
         if use_pyyaml:  # slower, but easier to read by hand for debugging (use this instead of the json version to make more human-readable files)
             yaml.dump(yamldata, yamlfile, width=400, Dumper=Dumper, default_flow_style=False, allow_unicode=False)  # set <allow_unicode> to false so the file isn't cluttered up with !!python.unicode stuff
         else:  # way tf faster than full yaml (only lost information is ordering in ordered dicts, but that's only per-gene support and germline info, neither of whose order we care much about)
-            json.dump(yamldata, yamlfile) #, sort_keys=True, indent=4)
-
-# ----------------------------------------------------------------------------------------
-def parse_yaml_annotations(glfo, yamlfo, n_max_queries, synth_single_seqs, dont_add_implicit_info):
-    annotation_list = []
-    n_queries_read = 0
-    for line in yamlfo['events']:
-        if not line['invalid']:
-            transfer_indel_reversed_seqs(line)
-            if 'all_matches' in line and isinstance(line['all_matches'], dict):  # it used to be per-family, but then I realized it should be per-sequence, so any old cache files lying around have it as per-family
-                line['all_matches'] = [line['all_matches']]  # also, yes, it makes me VERY ANGRY that this needs to be here, but i just ran into a couple of these old files and otherwise they cause crashes
-            if not dont_add_implicit_info:  # it's kind of slow, although most of the time you probably want all the extra info
-                add_implicit_info(glfo, line)  # don't use the germline info in <yamlfo>, in case we decide we want to modify it in the calling fcn
-        if synth_single_seqs and len(line['unique_ids']) > 1:
-            for iseq in range(len(line['unique_ids'])):
-                annotation_list.append(synthesize_single_seq_line(line, iseq))
+            write_json_lines(yamlfile, yamldata)
+
+# ----------------------------------------------------------------------------------------
+# it's still a single valid json object (so json.load() works fine), but each top-level key starts on its own line (in the order of <yaml_output_keys>), and each partition and each event is on its own line, so stream_yaml_output() can read one line at a time
+# (json.dumps() escapes newlines within strings, so there's never a newline inside any of the pieces)
+def write_json_lines(yamlfile, yamldata):
+    yamlfile.write('{')
+    for ikey, key in enumerate(yaml_output_keys):
+        yamlfile.write('%s%s: ' % (',\n' if ikey > 0 else '', json.dumps(key)))
+        if key in yaml_output_list_keys:
+            yamlfile.write('[')
+            for iline, line in enumerate(yamldata[key]):
+                yamlfile.write('%s\n%s' % (',' if iline > 0 else '', json.dumps(line)))
+            yamlfile.write('\n]')
         else:
-            annotation_list.append(line)
+            json.dump(yamldata[key], yamlfile)
+    yamlfile.write('}\n')
 
-        n_queries_read += len(line['unique_ids'])
-        if n_max_queries > 0 and n_queries_read >= n_max_queries:
-            break
+# ----------------------------------------------------------------------------------------
+# columnar output: <fname> (with suffix .cols) is a directory with version/germline info, partitions, and column names in <columnar_meta_fname>, then one json file for each annotation column (each of which is a list with one entry per event, where per-seq columns' entries are themselves lists).
+# This is much faster to read if you only need a few columns, since you only parse the files for those columns (see read_columnar_output()).
+columnar_meta_fname = 'meta.json'
+def columnar_column_fname(fname, column):
+    return '%s/%s.json' % (fname, column)
 
-    return annotation_list
+# ----------------------------------------------------------------------------------------
+def write_columnar_output(fname, headers, glfo=None, annotation_list=None, failed_queries=None, partition_lines=None, dont_write_git_info=False):
+    if annotation_list is None:
+        annotation_list = []
+    yaml_annotations = [get_yamlfo_for_output(l, headers, glfo=glfo) for l in annotation_list]
+    if failed_queries is not None:
+        yaml_annotations += failed_queries
+    columns = []
+    for yfo in yaml_annotations:  # keep the order of the first event that has each column
+        columns += [k for k in yfo if k not in columns]
+    missing = {c : [i for i, yfo in enumerate(yaml_annotations) if c not in yfo] for c in columns}  # e.g. failed queries only have a few columns, and optional input meta info columns are only in some events
+    metafo = {'version-info' : {'partis-yaml' : yaml_output_version, 'partis-git' : '' if dont_write_git_info else get_version_info()},
+              'germline-info' : glfo,
+              'partitions' : [] if partition_lines is None else partition_lines,
+              'n-events' : len(yaml_annotations),
+              'columns' : columns,
+              'missing' : {c : m for c, m in missing.items() if len(m) > 0}}
+    os.makedirs(fname)
+    with open(fname + '/' + columnar_meta_fname, 'w') as mfile:
+        json.dump(metafo, mfile)
+    for col in columns:
+        with open(columnar_column_fname(fname, col), 'w') as cfile:
+            json.dump([yfo.get(col) for yfo in yaml_annotations], cfile)
+
+# ----------------------------------------------------------------------------------------
+def process_yaml_annotation(glfo, line, dont_add_implicit_info):
+    if not line['invalid']:
+        transfer_indel_reversed_seqs(line)
+        if 'all_matches' in line and isinstance(line['all_matches'], dict):  # it used to be per-family, but then I realized it should be per-sequence, so any old cache files lying around have it as per-family
+            line['all_matches'] = [line['all_matches']]  # also, yes, it makes me VERY ANGRY that this needs to be here, but i just ran into a couple of these old files and otherwise they cause crashes
+        if not dont_add_implicit_info:  # it's kind of slow, although most of the time you probably want all the extra info
+            add_implicit_info(glfo, line)  # don't use the germline info in <yamlfo>, in case we decide we want to modify it in the calling fcn
 
 # ----------------------------------------------------------------------------------------
 def read_cpath(fname, n_max_queries=-1, seed_unique_id=None, skip_annotations=False):
@@ -6510,7 +6776,7 @@ def read_cpath(fname, n_max_queries=-1, seed_unique_id=None, skip_annotations=Fa
     return cpath
 
 # ----------------------------------------------------------------------------------------
-def read_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, seed_unique_id=None, cpath=None, skip_annotations=False, glfo=None, glfo_dir=None, locus=None, skip_failed_queries=False, is_partition_file=False, debug=False):
+def read_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, seed_unique_id=None, cpath=None, skip_annotations=False, glfo=None, glfo_dir=None, locus=None, skip_failed_queries=False, is_partition_file=False, columns=None, debug=False):  # NOTE <columns> only has an effect for columnar (.cols) files
     annotation_list = None
 
     if getsuffix(fname) == '.csv':
@@ -6541,6 +6807,9 @@ def read_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_impli
     elif getsuffix(fname) == '.yaml':  # NOTE this replaces any <glfo> that was passed (well, only within the local name table of this fcn, unless the calling fcn replaces it themselves, since we return this glfo)
         glfo, annotation_list, cpath = read_yaml_output(fname, n_max_queries=n_max_queries, synth_single_seqs=synth_single_seqs,
                                                         dont_add_implicit_info=dont_add_implicit_info, seed_unique_id=seed_unique_id, cpath=cpath, skip_annotations=skip_annotations, debug=debug)
+    elif getsuffix(fname) == '.cols':
+        glfo, annotation_list, cpath = read_columnar_output(fname, columns=columns, n_max_queries=n_max_queries, synth_single_seqs=synth_single_seqs,
+                                                            dont_add_implicit_info=dont_add_implicit_info, seed_unique_id=seed_unique_id, cpath=cpath, skip_annotations=skip_annotations, debug=debug)
     else:
         raise Exception('unhandled file extension \'%s\' on %s' % (getsuffix(fname), fname))
 
@@ -6594,20 +6863,98 @@ def read_json_yaml(fname):  # try to read <fname> as json (since it's faster), o
     return yamlfo
 
 # ----------------------------------------------------------------------------------------
-def read_yaml_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, seed_unique_id=None, cpath=None, skip_annotations=False, debug=False):
-    yamlfo = read_json_yaml(fname)
+def stream_yaml_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, skip_partitions=False, skip_annotations=False, only_uids=None, min_cluster_size=None, max_cluster_size=None):
+    """
+    Generator yielding (key, value) for each piece of partis yaml/json output file <fname>, in this order: ('version-info', dict), ('germline-info', glfo), ('partition', partition line) for each partition, then ('event', annotation) for each annotation.
+    For files written with write_json_lines() this only reads one line at a time, so memory use is set by the largest single partition/annotation rather than the whole file; other (older, or pyyaml) files get read all at once, then yielded in the same order.
+    Annotations that fail the <only_uids>/cluster size filters are skipped before doing anything else with them, and if you set <dont_add_implicit_info> you can call add_implicit_info() yourself on only the ones you end up needing.
+    """
+    # ----------------------------------------------------------------------------------------
+    def keep_line(line):
+        if only_uids is not None and len(set(line['unique_ids']) & only_uids) == 0:
+            return False
+        if min_cluster_size is not None and len(line['unique_ids']) < min_cluster_size:
+            return False
+        if max_cluster_size is not None and len(line['unique_ids']) > max_cluster_size:
+            return False
+        return True
+    # ----------------------------------------------------------------------------------------
+    def process_events(glfo, lines):
+        n_queries_read = 0
+        for line in lines:
+            if not keep_line(line):
+                continue
+            process_yaml_annotation(glfo, line, dont_add_implicit_info)
+            if synth_single_seqs and len(line['unique_ids']) > 1:
+                for iseq in range(len(line['unique_ids'])):
+                    yield 'event', synthesize_single_seq_line(line, iseq)
+            else:
+                yield 'event', line
+            n_queries_read += len(line['unique_ids'])
+            if n_max_queries > 0 and n_queries_read >= n_max_queries:
+                break
+    # ----------------------------------------------------------------------------------------
+    def read_list_lines(yfile):  # read the partition/event lines of one of the <yaml_output_list_keys> (we're already past its opening line)
+        for line in iter(yfile.readline, ''):  # NOTE can't use 'for line in yfile', since in python 2 its read-ahead buffer doesn't play nice with readline()
+            if line[0] == ']':
+                break
+            yield json.loads(line.rstrip(',\n'))
+    # ----------------------------------------------------------------------------------------
+    if only_uids is not None:
+        only_uids = set(only_uids)
+    with open(fname) as yfile:
+        first_line = yfile.readline()
+        first_prefix = '{"version-info": '
+        if first_line.startswith(first_prefix) and first_line[-2:] == ',\n':  # line-based layout from write_json_lines()
+            version_info = json.loads(first_line[len(first_prefix) : -2])
+            yield 'version-info', version_info
+            glfo = None
+            for key in yaml_output_keys[1:]:
+                keystr = yfile.readline()
+                assert keystr.startswith('"%s": ' % key)  # if this fails, write_json_lines() must've changed without this fcn being updated
+                if key == 'germline-info':
+                    glfo = json.loads(keystr[len('"%s": ' % key) : ].rstrip(',\n'))
+                    yield key, glfo
+                elif key == 'partitions':
+                    for pline in read_list_lines(yfile):
+                        if not skip_partitions:
+                            yield 'partition', pline
+                elif key == 'events':
+                    if skip_annotations:
+                        break
+                    for kv in process_events(glfo, read_list_lines(yfile)):
+                        yield kv
+                else:
+                    assert False
+            return
+
+    yamlfo = read_json_yaml(fname)  # not the line-based layout, so we have to read the whole thing
     if isinstance(yamlfo, list):
         raise Exception('read list of seqfos from file, instead of the expected standard yaml output with germline-info, annotations, and partitions. Run read_seqfos() instead: %s' % fname)
-    if debug:
-        print '  read yaml version %s from %s' % (yamlfo['version-info']['partis-yaml'], fname)
-
-    glfo = yamlfo['germline-info']  # it would probably be good to run the glfo through the checks that glutils.read_glfo() does, but on the other hand since we're reading from our own yaml file, those have almost certainly already been done
-
-    annotation_list = None
-    if not skip_annotations:  # may not really be worthwhile, but oh well
-        annotation_list = parse_yaml_annotations(glfo, yamlfo, n_max_queries, synth_single_seqs, dont_add_implicit_info)
+    yield 'version-info', yamlfo['version-info']
+    yield 'germline-info', yamlfo['germline-info']
+    if not skip_partitions:
+        for pline in yamlfo['partitions']:
+            yield 'partition', pline
+    if not skip_annotations:
+        for kv in process_events(yamlfo['germline-info'], yamlfo['events']):
+            yield kv
+
+# ----------------------------------------------------------------------------------------
+def read_yaml_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, seed_unique_id=None, cpath=None, skip_annotations=False, only_uids=None, min_cluster_size=None, max_cluster_size=None, debug=False):
+    glfo, annotation_list, partition_lines = None, None if skip_annotations else [], []
+    for key, val in stream_yaml_output(fname, n_max_queries=n_max_queries, synth_single_seqs=synth_single_seqs, dont_add_implicit_info=dont_add_implicit_info, skip_annotations=skip_annotations,
+                                       only_uids=only_uids, min_cluster_size=min_cluster_size, max_cluster_size=max_cluster_size):
+        if key == 'version-info':
+            if debug:
+                print '  read yaml version %s from %s' % (val['partis-yaml'], fname)
+        elif key == 'germline-info':
+            glfo = val  # it would probably be good to run the glfo through the checks that glutils.read_glfo() does, but on the other hand since we're reading from our own yaml file, those have almost certainly already been done
+        elif key == 'partition':
+            partition_lines.append(val)
+        elif key == 'event':
+            annotation_list.append(val)
 
-    partition_lines = yamlfo['partitions']
     if cpath is None:   # allowing the caller to pass in <cpath> is kind of awkward, but it's used for backward compatibility in clusterpath.readfile()
         cpath = clusterpath.ClusterPath(seed_unique_id=seed_unique_id)  # NOTE I'm not sure if I really want to pass in the seed here -- it should be stored in the file -- but if it's in both places it should be the same. um, should.
     if len(partition_lines) > 0:  # *don't* combine this with the cluster path constructor, since then we won't modify the path passed in the arguments
@@ -6615,6 +6962,59 @@ def read_yaml_output(fname, n_max_queries=-1, synth_single_seqs=False, dont_add_
 
     return glfo, annotation_list, cpath  # NOTE if you want a dict of annotations, use utils.get_annotation_dict() above
 
+# ----------------------------------------------------------------------------------------
+# if <columns> is set (and they're all in the file), only read those columns (plus 'unique_ids' and 'invalid'), and don't add implicit info, since that needs most of the columns
+def read_columnar_output(fname, columns=None, n_max_queries=-1, synth_single_seqs=False, dont_add_implicit_info=False, seed_unique_id=None, cpath=None, skip_annotations=False, debug=False):
+    with open(fname + '/' + columnar_meta_fname) as mfile:
+        metafo = json.load(mfile)
+    if debug:
+        print '  read columnar version %s from %s' % (metafo['version-info']['partis-yaml'], fname)
+    glfo = metafo['germline-info']
+    if cpath is None:
+        cpath = clusterpath.ClusterPath(seed_unique_id=seed_unique_id)
+    if len(metafo['partitions']) > 0:
+        cpath.readlines(metafo['partitions'])
+    if skip_annotations:
+        return glfo, None, cpath
+
+    if columns is not None:
+        columns = add_lists(['unique_ids', 'invalid'], [c for c in columns if c not in ['unique_ids', 'invalid']])
+        missing_cols = [c for c in columns if c not in metafo['columns']]
+        if len(missing_cols) > 0:  # they may be things that we can get from implicit info, so fall back to reading everything
+            print '    columns %s not in %s, so reading all columns' % (' '.join(missing_cols), fname)
+            columns = None
+    read_all = columns is None
+    if read_all:
+        columns = metafo['columns']
+
+    n_events = metafo['n-events']
+    if n_max_queries > 0 and n_events > 0:  # figure out how many events we need before reading any of the other columns (if there's no events, there's no column files)
+        with open(columnar_column_fname(fname, 'unique_ids')) as cfile:
+            uid_lists = json.load(cfile)
+        n_queries_read = 0
+        for ievt, uids in enumerate(uid_lists):
+            n_queries_read += len(uids)
+            if n_queries_read >= n_max_queries:
+                n_events = ievt + 1
+                break
+
+    annotation_list = [{} for _ in range(n_events)]
+    for col in columns:
+        missing = set(metafo['missing'].get(col, []))
+        with open(columnar_column_fname(fname, col)) as cfile:
+            colvals = json.load(cfile)
+        for ievt in range(n_events):
+            if ievt not in missing:
+                annotation_list[ievt][col] = colvals[ievt]
+
+    if read_all:
+        for line in annotation_list:
+            process_yaml_annotation(glfo, line, dont_add_implicit_info)
+    if synth_single_seqs:
+        annotation_list = [synthesize_single_seq_line(l, i) if len(l['unique_ids']) > 1 else l for l in annotation_list for i in range(len(l['unique_ids']))]
+
+    return glfo, annotation_list, cpath
+
 # ----------------------------------------------------------------------------------------
 def get_gene_counts_from_annotations(annotations, only_regions=None):
     gene_counts = {r : {} for r in (only_regions if only_regions is not None else regions)}
@@ -35,7 +35,7 @@ class Waterer(object):
     """ Run smith-waterman on the query sequences in <infname> """
     def __init__(self, args, glfo, input_info, simglfo, reco_info,
                  count_parameters=False, parameter_out_dir=None, plot_annotation_performance=False,
-                 duplicates=None, pre_failed_queries=None, aligned_gl_seqs=None, vs_info=None, locus=None):
+                 duplicates=None, pre_failed_queries=None, aligned_gl_seqs=None, vs_info=None, locus=None, rerun_cache=None, keep_rerun_cache=False):
         self.args = args
         self.input_info = input_info if input_info is not None else OrderedDict()  # NOTE do *not* modify <input_info>, since it's this original input info from partitiondriver
         self.reco_info = reco_info
@@ -53,6 +53,7 @@ class Waterer(object):
 
         self.gap_open_penalty = self.args.gap_open_penalty  # not modifying it now, but just to make sure we don't in the future
         self.match_score = 5  # see commented table above ^
+        self.max_drop = 50  # within each region, keep all matches within this much of the best score
         if self.vs_info is None:
             self.mismatch = 4
         else:
@@ -80,13 +81,24 @@ class Waterer(object):
 
         self.skipped_unproductive_queries, self.kept_unproductive_queries = set(), set()
 
+        # per-query alignment info from a previous sw pass (with a different germline set) from which we carry forward queries that wouldn't change (see carry_forward_queries())
+        self.prev_rerun_cache = rerun_cache
+        self.keep_rerun_cache = keep_rerun_cache
+        self.rerun_cache = None  # same, but for this pass (set in finalize() if <keep_rerun_cache> is set)
+        self.sw_params = {}  # mismatch and gap open for each query in the current sw iteration
+        self.alignment_rounds = {}  # list with the raw matches (and the seq, mismatch, and gap open) for each sw iteration that each query went through
+        self.result_cache = None  # cross-run cache of raw sw matches (see swresultcache.py)
+        if self.args.sw_result_cachedir is not None and self.glfo is not None:
+            import swresultcache
+            self.result_cache = swresultcache.SWResultCache(self.args.sw_result_cachedir, self.glfo, self.match_score, self.max_drop, self.args.sw_backend)
+
         self.my_gldir = self.args.workdir + '/sw-' + glutils.glfo_dir
         if self.glfo is None:  # reading cache file from bin/partis, rather than normal operation from python/partitiondriver.py
             self.args.locus = locus
         else:  # default, normal operation
             glutils.write_glfo(self.my_gldir, self.glfo)  # NOTE gets overwritten by read_cachefile()
 
-        if not os.path.exists(self.args.ig_sw_binary):
+        if self.args.sw_backend == 'ig-sw' and not os.path.exists(self.args.ig_sw_binary):
             raise Exception('ig-sw binary d.n.e: %s' % self.args.ig_sw_binary)
 
     # ----------------------------------------------------------------------------------------
@@ -97,26 +109,173 @@ class Waterer(object):
 
         if self.vs_info is not None:  # if we're reading a cache file, we should make sure to read the exact same info from there
             self.add_vs_indels()
+        if self.prev_rerun_cache is not None:
+            self.carry_forward_queries()
 
         itry = 0
         while True:  # if we're not running vsearch, we still gotta run twice to get shm indeld sequences
-            mismatches, gap_opens, queries_for_each_proc = self.split_queries(self.args.n_procs)  # NOTE can tell us to run more than <self.args.n_procs> (we run at least one proc for each different mismatch score)
-            self.write_input_files(base_infname, queries_for_each_proc)
+            if len(self.remaining_queries) == 0:  # can only happen if we carried forward everybody
+                self.ig_sw_time, processing_start = 0., time.time()
+                break
+            queries_to_run, cached_results = self.check_result_cache()
+            if len(queries_to_run) == 0:
+                self.ig_sw_time, processing_start = 0., time.time()
+            elif self.args.sw_backend == 'numpy':
+                processing_start = self.run_numpy_sw(queries_to_run)
+            else:
+                mismatches, gap_opens, queries_for_each_proc = self.split_queries(self.args.n_procs, queries_to_run)  # NOTE can tell us to run more than <self.args.n_procs> (we run at least one proc for each different mismatch score)
+                self.sw_params = {q : (m, g) for m, g, queries in zip(mismatches, gap_opens, queries_for_each_proc) for q in queries}
+                self.write_input_files(base_infname, queries_for_each_proc)
 
-            print '    running %d proc%s for %d seq%s' % (len(mismatches), utils.plural(len(mismatches)), len(self.remaining_queries), utils.plural(len(self.remaining_queries)))
-            sys.stdout.flush()
-            self.execute_commands(base_infname, base_outfname, mismatches, gap_opens)
+                print '    running %d proc%s for %d seq%s' % (len(mismatches), utils.plural(len(mismatches)), len(queries_to_run), utils.plural(len(queries_to_run)))
+                sys.stdout.flush()
+                self.execute_commands(base_infname, base_outfname, mismatches, gap_opens)
 
-            processing_start = time.time()
-            self.read_output(base_outfname, len(mismatches))
+                processing_start = time.time()
+                self.read_output(base_outfname, queries_to_run, len(mismatches))
+            for query, (mismatch, gap_open, seq, matches) in cached_results.items():  # have to do these after running sw, since it resets <self.indel_reruns>
+                self.sw_params[query] = (mismatch, gap_open)
+                self.summarize_query(self.get_qinfo(query, seq, matches))
 
             if itry > 1 or len(self.indel_reruns) == 0:
                 break
             itry += 1
 
+        if self.result_cache is not None:
+            self.result_cache.write()
         self.finalize(cachefname)
         print '    water time: %.1f  (ig-sw %.1f  processing %.1f)' % (time.time() - start, time.time() - processing_start, self.ig_sw_time)
 
+    # ----------------------------------------------------------------------------------------
+    def check_result_cache(self):  # look up each remaining query in the cross-run result cache (with the mismatch and gap open it'd get this iteration), returning the queries that weren't there (which we need to run), and the cached results for those that were
+        if self.result_cache is None:
+            return set(self.remaining_queries), {}
+        queries_to_run, cached_results = set(), {}
+        for query in self.remaining_queries:
+            mismatch = self.get_query_mismatch(query)
+            gap_open = self.args.no_indel_gap_open_penalty if query in self.indel_reruns else self.gap_open_penalty
+            seq, matches = self.result_cache.get(self.get_query_seq(query), mismatch, gap_open)
+            if matches is None:
+                queries_to_run.add(query)
+            else:
+                cached_results[query] = (mismatch, gap_open, seq, matches)
+        self.indel_reruns -= set(cached_results)
+        print '    found %d / %d seq%s in sw result cache' % (len(cached_results), len(self.remaining_queries), utils.plural(len(self.remaining_queries)))
+        return queries_to_run, cached_results
+
+    # ----------------------------------------------------------------------------------------
+    def run_numpy_sw(self, queries_to_run):  # in-process alternative to running ig-sw subprocs (with --sw-backend numpy): each query gets its own mismatch and gap open, so we don't need to split into separate procs for each mismatch value, and there's no writing/reading of fasta/sam files
+        import swaligner
+        start = time.time()
+        query_names = sorted(queries_to_run)
+        mismatches = {q : self.get_query_mismatch(q) for q in query_names}
+        gap_opens = {q : self.args.no_indel_gap_open_penalty if q in self.indel_reruns else self.gap_open_penalty for q in query_names}
+        self.sw_params = {q : (mismatches[q], gap_opens[q]) for q in query_names}
+        self.indel_reruns.clear()
+        print '    running numpy sw for %d seq%s' % (len(query_names), utils.plural(len(query_names)))
+        sys.stdout.flush()
+        all_matches = swaligner.align_queries([(q, self.get_query_seq(q)) for q in query_names], self.glfo, self.match_score, mismatches, gap_opens, max_drop=self.max_drop, debug=self.debug)
+        self.ig_sw_time = time.time() - start
+
+        processing_start = time.time()
+        not_read = [q for q in query_names if len(all_matches[q]) == 0]
+        for query_name in [q for q in query_names if len(all_matches[q]) > 0]:
+            self.summarize_query(self.get_qinfo(query_name, self.get_query_seq(query_name), all_matches[query_name]))  # returns before adding to <self.info> if it thinks we should rerun the query
+        if len(not_read) > 0:
+            print '\n%s no matches for %s' % (utils.color('red', 'warning'), ' '.join(not_read))
+        sys.stdout.flush()
+        return processing_start
+
+    # ----------------------------------------------------------------------------------------
+    def get_gene_fingerprints(self):  # hash of everything about each gene that can affect a query's sw annotation (if a gene isn't in a query's matches, it can only affect it by having a better score)
+        fprints = {}
+        for region in utils.regions:
+            codon = utils.conserved_codons[self.args.locus].get(region)
+            for gene, seq in self.glfo['seqs'][region].items():
+                fprints[gene] = utils.uidhashstr('%s %s' % (seq, self.glfo[codon + '-positions'][gene] if codon is not None else ''))
+        return fprints
+
+    # ----------------------------------------------------------------------------------------
+    def set_rerun_cache(self):  # keep everything we need to carry forward this pass's queries to a later sw pass (has to happen before finalize() modifies the annotations)
+        self.rerun_cache = {'gene-fingerprints' : self.get_gene_fingerprints(), 'queries' : {}}
+        for query in self.info['passed-queries'] | self.skipped_unproductive_queries:
+            self.rerun_cache['queries'][query] = {
+                'rounds' : self.alignment_rounds[query],
+                'line' : copy.deepcopy(self.info[query]) if query in self.info['passed-queries'] else None,
+                'indelfo' : copy.deepcopy(self.info['indels'].get(query)),
+                'vs-indelfo' : copy.deepcopy(self.vs_info['annotations'][query]['indelfo']) if query in self.vs_indels else None,
+            }
+
+    # ----------------------------------------------------------------------------------------
+    def get_changed_queries(self, candidates, debug=False):
+        """
+        Return the queries in <candidates> whose sw result could differ from that in the previous pass, given the germline changes since then.
+        A query's result only depends on its own sequence and scores, and on the germline genes that it matched (those within <self.max_drop> of the best score in each region), so it'll be the same if, in each sw iteration it went through:
+          - none of its matched genes were removed or changed, and
+          - none of the added/changed genes would have been matched, which we check by aligning it against only those genes (using the same bit of the query as the full sw would have, i.e. right of the best v for j, and between v and j for d).
+        """
+        import swaligner
+        old_fprints, new_fprints = self.prev_rerun_cache['gene-fingerprints'], self.get_gene_fingerprints()
+        removed_genes = set(g for g in old_fprints if new_fprints.get(g) != old_fprints[g])  # removed or changed
+        new_genes = {r : [g for g in self.glfo['seqs'][r] if old_fprints.get(g) != new_fprints[g]] for r in utils.regions}  # added or changed
+        cached_queries = self.prev_rerun_cache['queries']
+
+        changed_queries = set()
+        screens = {r : [] for r in utils.regions}  # (query, subseq, mismatch, gap open, min score that would make it a match) for each query/iteration that we need to align against the new genes
+        for query in candidates:
+            rounds = cached_queries[query]['rounds']
+            if self.get_query_seq(query) != rounds[0]['seq'] or self.get_query_mismatch(query) != rounds[0]['mismatch'] or self.info['indels'].get(query) != cached_queries[query]['vs-indelfo']:  # new vsearch info changed what we'd give to sw
+                changed_queries.add(query)
+                continue
+            for rfo in rounds:
+                if any(g in removed_genes for r in utils.regions for g, _, _ in rfo['matches'][r]):
+                    changed_queries.add(query)
+                    break
+                if 'd' in utils.getregions(self.args.locus) and len(rfo['matches']['d']) == 0 and (len(new_genes['d']) > 0 or any(utils.get_region(g) == 'd' for g in removed_genes)):  # summarize_query() gives these all the d genes
+                    changed_queries.add(query)
+                    break
+                seq, best = rfo['seq'], {r : rfo['matches'][r][0] for r in utils.regions if len(rfo['matches'][r]) > 0}
+                subseqs = {'v' : seq}
+                if 'v' in best and len(seq) - best['v'][2][1] > 2:
+                    subseqs['j'] = seq[best['v'][2][1] : ]
+                    if 'j' in best and best['j'][2][0] - best['v'][2][1] > 0:
+                        subseqs['d'] = seq[best['v'][2][1] : best['j'][2][0]]
+                for region in [r for r in subseqs if len(new_genes[r]) > 0]:
+                    min_score = best[region][1] - self.max_drop if region in best else 1  # NOTE scores are never negative, so if the best score is less than <self.max_drop> every gene is a match
+                    screens[region].append((query, subseqs[region], rfo['mismatch'], rfo['gap_open'], min_score))
+
+        for region in [r for r in utils.regions if len(screens[r]) > 0]:
+            _, subseqs, mismatches, gap_opens, _ = zip(*screens[region])
+            scores = swaligner.score_queries(subseqs, [self.glfo['seqs'][region][g] for g in new_genes[region]], self.match_score, mismatches, gap_opens)
+            changed_queries |= set(sfo[0] for sfo, smax in zip(screens[region], scores.max(axis=1)) if smax >= sfo[4])
+
+        if debug:
+            print '      %d removed/changed genes: %s' % (len(removed_genes), ' '.join(utils.color_gene(g) for g in sorted(removed_genes)))
+            print '      %d added/changed genes: %s' % (sum(len(gl) for gl in new_genes.values()), ' '.join(utils.color_gene(g) for r in utils.regions for g in new_genes[r]))
+        return changed_queries
+
+    # ----------------------------------------------------------------------------------------
+    def carry_forward_queries(self):  # take the results from the previous sw pass for any queries that aren't affected by germline changes since then
+        start = time.time()
+        cached_queries = self.prev_rerun_cache['queries']
+        candidates = [q for q in self.remaining_queries if q in cached_queries]
+        unchanged_queries = set(candidates) - self.get_changed_queries(candidates, debug=self.debug)
+        for query in unchanged_queries:
+            qcache = cached_queries[query]
+            self.alignment_rounds[query] = qcache['rounds']
+            if qcache['indelfo'] is not None:
+                self.info['indels'][query] = copy.deepcopy(qcache['indelfo'])
+            if qcache['line'] is None:  # skipped unproductive
+                self.skipped_unproductive_queries.add(query)
+                self.remaining_queries.remove(query)
+                continue
+            line = copy.deepcopy(qcache['line'])
+            if query in self.info['indels']:
+                line['indelfos'] = [self.info['indels'][query]]  # keep them as the same object (see convert_qinfo())
+            line['duplicates'] = [self.duplicates.get(query, []), ]  # duplicates can change between passes
+            self.add_to_info(line)
+        print '    carrying forward %d / %d queries unaffected by germline changes since previous sw pass (%.1f sec)' % (len(unchanged_queries), len(candidates), time.time() - start)
+
     # ----------------------------------------------------------------------------------------
     def clean_cache(self, cache_path):
         for suffix in ['.csv', '.yaml']:
@@ -193,6 +352,9 @@ class Waterer(object):
         if self.debug:
             print '%s' % utils.color('green', 'finalizing')
 
+        if self.keep_rerun_cache and not just_read_cachefile:
+            self.set_rerun_cache()
+
         self.info['queries'] = [q for q in self.input_info if q in self.info['passed-queries']]  # it might be cleaner eventually to just make self.info['queries'] a set, but it's used in so many other places that I'm worried about changing it
         self.info['failed-queries'] |= set(self.remaining_queries)  # perhaps it doesn't make sense to keep both of 'em around after finishing?
 
@@ -316,21 +478,22 @@ class Waterer(object):
         self.ig_sw_time = time.time() - start
 
     # ----------------------------------------------------------------------------------------
-    def split_queries_by_match_mismatch(self, input_queries, n_procs, debug=False):
-        def get_query_mfreq(q):
-            return self.vs_info['annotations'][q]['v_mut_freq'] if q in self.vs_info['annotations'] else self.default_mfreq
-        def best_mismatch(q):
-            mfreq_q = self.vs_info['annotations'][q]['v_mut_freq'] if q in self.vs_info['annotations'] else self.default_mfreq
-            def keyfunc(pair):
-                mf, mm = pair
-                return abs(mf - mfreq_q)
-            nearest_mfreq, nearest_mismatch = min(self.mfreq_mismatch_vals, key=keyfunc)  # take the optimized value whose mfreq is closest to this sequence's mfreq
-            return nearest_mismatch
+    def get_query_mismatch(self, q):
+        if self.vs_info is None:
+            return self.mismatch
+        mfreq_q = self.vs_info['annotations'][q]['v_mut_freq'] if q in self.vs_info['annotations'] else self.default_mfreq
+        def keyfunc(pair):
+            mf, mm = pair
+            return abs(mf - mfreq_q)
+        nearest_mfreq, nearest_mismatch = min(self.mfreq_mismatch_vals, key=keyfunc)  # take the optimized value whose mfreq is closest to this sequence's mfreq
+        return nearest_mismatch
 
-        query_groups = utils.group_seqs_by_value(input_queries, best_mismatch)
-        mismatch_vals = [best_mismatch(queries[0]) for queries in query_groups]
+    # ----------------------------------------------------------------------------------------
+    def split_queries_by_match_mismatch(self, input_queries, n_procs, debug=False):
+        query_groups = utils.group_seqs_by_value(input_queries, self.get_query_mismatch)
+        mismatch_vals = [self.get_query_mismatch(queries[0]) for queries in query_groups]
 
-        # note: it'd be nice to be able to give ig-sw a different match:mismatch for each sequence (rather than running separate procs for each match:mismatch), but it initializes a matrix using the match:mismatch values before looping over sequences, so that's probably infeasible
+        # note: it'd be nice to be able to give ig-sw a different match:mismatch for each sequence (rather than running separate procs for each match:mismatch), but it initializes a matrix using the match:mismatch values before looping over sequences, so that's probably infeasible (the numpy backend, on the other hand, takes a separate scoring matrix for each query, see run_numpy_sw())
 
         if debug:
             print 'start'
@@ -382,8 +545,8 @@ class Waterer(object):
         return mismatches, gap_opens, queries_for_each_proc
 
     # ----------------------------------------------------------------------------------------
-    def split_queries(self, n_procs):
-        input_queries = list(self.remaining_queries)
+    def split_queries(self, n_procs, queries_to_run):
+        input_queries = list(queries_to_run)
         if self.vs_info is None:
             mismatches, queries_for_each_proc = self.split_queries_evenly_among_procs(input_queries, n_procs)
         else:
@@ -391,7 +554,7 @@ class Waterer(object):
 
         mismatches, gap_opens, queries_for_each_proc = self.get_gap_opens(mismatches, queries_for_each_proc)  # they're all the same unless we have some indel fails
 
-        missing_queries = self.remaining_queries - set([q for proc_queries in queries_for_each_proc for q in proc_queries])
+        missing_queries = queries_to_run - set([q for proc_queries in queries_for_each_proc for q in proc_queries])
         if len(missing_queries) > 0:
             raise Exception('didn\'t write %s to %s' % (':'.join(missing_queries), self.args.workdir))
 
@@ -406,12 +569,15 @@ class Waterer(object):
                 utils.prep_dir(workdir)
             with open(workdir + '/' + base_infname, 'w') as sub_infile:
                 for query_name in queries_for_each_proc[iproc]:
-                    if query_name in self.info['indels']:
-                        seq = self.info['indels'][query_name]['reversed_seq']  # use the query sequence with shm insertions and deletions reversed
-                    else:
-                        assert len(self.input_info[query_name]['seqs']) == 1  # sw can't handle multiple simultaneous sequences, but it's nice to have the same headers/keys everywhere, so we use the plural versions (with lists) even here (where "it's nice" means "it used to be the other way and it fucking sucked and a fuckton of effort went into synchronizing the treatments")
-                        seq = self.input_info[query_name]['seqs'][0]
-                    sub_infile.write('>%s NUKES\n%s\n' % (query_name, seq))
+                    sub_infile.write('>%s NUKES\n%s\n' % (query_name, self.get_query_seq(query_name)))
+
+    # ----------------------------------------------------------------------------------------
+    def get_query_seq(self, query_name):
+        if query_name in self.info['indels']:
+            return self.info['indels'][query_name]['reversed_seq']  # use the query sequence with shm insertions and deletions reversed
+        else:
+            assert len(self.input_info[query_name]['seqs']) == 1  # sw can't handle multiple simultaneous sequences, but it's nice to have the same headers/keys everywhere, so we use the plural versions (with lists) even here (where "it's nice" means "it used to be the other way and it fucking sucked and a fuckton of effort went into synchronizing the treatments")
+            return self.input_info[query_name]['seqs'][0]
 
     # # ----------------------------------------------------------------------------------------
     # def get_vdjalign_cmd_str(self, workdir, base_infname, base_outfname, mismatch):
@@ -433,7 +599,7 @@ class Waterer(object):
         # match score larger than (negative) mismatch score: we want to *encourage* some level of shm. If they're equal, we tend to end up with short unmutated alignments, which screws everything up
         cmd_str = self.args.ig_sw_binary
         cmd_str += ' -l ' + self.args.locus.upper()
-        cmd_str += ' -d 50'  # max drop
+        cmd_str += ' -d %d' % self.max_drop
         cmd_str += ' -m ' + str(self.match_score) + ' -u ' + str(mismatch)
         cmd_str += ' -o ' + str(gap_open)
         cmd_str += ' -p ' + self.my_gldir + '/' + self.args.locus + '/'  # NOTE needs the trailing slash
@@ -482,7 +648,7 @@ class Waterer(object):
     #     print '        time to rewrite same file: %.2f' % (time.time() - start)
 
     # ----------------------------------------------------------------------------------------
-    def read_output(self, base_outfname, n_procs=1):
+    def read_output(self, base_outfname, queries_to_run, n_procs=1):
         if self.debug:
             print '%s' % utils.color('green', 'reading output')
 
@@ -501,7 +667,7 @@ class Waterer(object):
                     self.summarize_query(qinfo)  # returns before adding to <self.info> if it thinks we should rerun the query
                     queries_read_from_file.add(qinfo['name'])
 
-        not_read = self.remaining_queries - queries_read_from_file
+        not_read = queries_to_run - queries_read_from_file
         if len(not_read) > 0:  # ig-sw (now) doesn't write matches for cases in which cigar and read length differ, which means there are now queries for which it finds zero matches (well, it didn't seem to happen before... but not sure that it couldn't have)
             print '\n%s didn\'t read %s from %s' % (utils.color('red', 'warning'), ' '.join(not_read), self.args.workdir)
 
@@ -533,9 +699,21 @@ class Waterer(object):
     def read_query(self, references, reads):
         """ convert bam crap to python dict """
         primary = next((r for r in reads if not r.is_secondary), None)
+        matches = []
+        for read in reads:  # loop over the matches found for each query sequence
+            read.seq = primary.seq  # only the first one has read.seq set by default, so we need to set the rest by hand
+            matches.append({'gene' : references[read.tid], 'score' : read.tags[0][1], 'qrbounds' : (read.qstart, read.qend), 'glbounds' : (read.pos, read.aend), 'cigarstr' : read.cigarstring})
+        return self.get_qinfo(primary.qname, primary.seq, matches)
+
+    # ----------------------------------------------------------------------------------------
+    def get_qinfo(self, name, seq, matches):  # <matches>: list of dicts (one for each gene match, in the order ig-sw would write them to its sam file)
+        mismatch, gap_open = self.sw_params[name]
+        if self.result_cache is not None:
+            self.result_cache.add(self.get_query_seq(name), mismatch, gap_open, seq, matches)
+        self.alignment_rounds.setdefault(name, []).append({'seq' : seq, 'mismatch' : mismatch, 'gap_open' : gap_open, 'matches' : {r : [(m['gene'], m['score'], m['qrbounds']) for m in matches if utils.get_region(m['gene']) == r] for r in utils.regions}})  # raw matches, in case a later sw pass wants to carry this query forward
         qinfo = {
-            'name' : primary.qname,
-            'seq' : primary.seq,
+            'name' : name,
+            'seq' : seq,
             'matches' : {r : [] for r in utils.regions},
             'qrbounds' : {},
             'glbounds' : {},
@@ -543,15 +721,11 @@ class Waterer(object):
         }
 
         last_scores = {r : None for r in utils.regions}
-        for read in reads:  # loop over the matches found for each query sequence
-            read.seq = qinfo['seq']  # only the first one has read.seq set by default, so we need to set the rest by hand
-            gene = references[read.tid]
+        for match in matches:
+            gene, score, qrbounds, glbounds = match['gene'], match['score'], match['qrbounds'], match['glbounds']
             region = utils.get_region(gene)
-            qrbounds = (read.qstart, read.qend)
-            glbounds = (read.pos, read.aend)
-            score = read.tags[0][1]
             if last_scores[region] is not None and score > last_scores[region]:
-                raise Exception('[sb]am file from smith-waterman not ordered by match score')
+                raise Exception('smith-waterman matches not ordered by match score')
             last_scores[region] = score
 
             # NOTE it is very important not to ever skip the best match for a region, since we need its qrbounds later to know how much was trimmed
@@ -560,7 +734,7 @@ class Waterer(object):
                 assert len(qinfo['matches'][region]) == self.args.n_max_per_region[utils.regions.index(region)]  # there better not be a way to get more than we asked for
                 continue
 
-            indelfo = indelutils.get_indelfo_from_cigar(read.cigarstring, qinfo['seq'], qrbounds, self.glfo['seqs'][region][gene], glbounds, {region : gene}, uid=qinfo['name'])  # note that qinfo['seq'] differs from self.input_info[qinfo['name']]['seqs'][0] if we've already reversed an indel in this sequence
+            indelfo = indelutils.get_indelfo_from_cigar(match['cigarstr'], qinfo['seq'], qrbounds, self.glfo['seqs'][region][gene], glbounds, {region : gene}, uid=qinfo['name'])  # note that qinfo['seq'] differs from self.input_info[qinfo['name']]['seqs'][0] if we've already reversed an indel in this sequence
             if indelutils.has_indels(indelfo):
                 if len(qinfo['matches'][region]) > 0:  # skip any gene matches with indels after the first one for each region (if we want to handle [i.e. reverse] an indel, we will have stored the indel info for the first match, and we'll be rerunning)
                     continue
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# micro-benchmark for the vectorized hamming distance functions in utils: checks them against the old pure python loop, then prints per-pair and per-matrix throughput
+import argparse
+import itertools
+import random
+import sys
+import time
+import numpy
+import colored_traceback.always
+
+sys.path.insert(1, './python')
+import utils
+
+# ----------------------------------------------------------------------------------------
+def loop_hamming_distance(seq1, seq2, amino_acid=False):  # the old pure python version of utils.hamming_distance()
+    skip_chars = set((utils.ambiguous_amino_acids if amino_acid else utils.all_ambiguous_bases) + utils.gap_chars)
+    distance, len_excluding_ambig = 0, 0
+    for ich in range(len(seq1)):
+        if seq1[ich] in skip_chars or seq2[ich] in skip_chars:
+            continue
+        len_excluding_ambig += 1
+        if seq1[ich] != seq2[ich]:
+            distance += 1
+    return distance, len_excluding_ambig
+
+# ----------------------------------------------------------------------------------------
+def mutate(seq, mfreq, ambig_frac):
+    chars = list(seq)
+    for ich in range(len(chars)):
+        if random.random() < mfreq:
+            chars[ich] = random.choice(utils.nukes)
+        if random.random() < ambig_frac:
+            chars[ich] = random.choice([utils.ambig_base] + utils.gap_chars)
+    return ''.join(chars)
+
+# ----------------------------------------------------------------------------------------
+def timeit(fcn, n_calls):
+    start = time.time()
+    for _ in range(n_calls):
+        fcn()
+    return (time.time() - start) / n_calls
+
+# ----------------------------------------------------------------------------------------
+parser = argparse.ArgumentParser()
+parser.add_argument('--seq-len', type=int, default=400)
+parser.add_argument('--short-seq-lens', default='10:20:40:60', help='colon-separated list of (short, e.g. cdr3 or aa) seq lengths for which to also check and time per-pair calls')
+parser.add_argument('--n-seqs', type=int, default=1000, help='number of sequences for the all-pairs matrix')
+parser.add_argument('--mut-freq', type=float, default=0.1)
+parser.add_argument('--ambig-frac', type=float, default=0.02)
+parser.add_argument('--n-pair-calls', type=int, default=20000)
+parser.add_argument('--random-seed', type=int, default=1)
+args = parser.parse_args()
+args.short_seq_lens = utils.get_arg_list(args.short_seq_lens, intify=True)
+random.seed(args.random_seed)
+
+naive_seq = ''.join(random.choice(utils.nukes) for _ in range(args.seq_len))
+seqs = [mutate(naive_seq, args.mut_freq, args.ambig_frac) for _ in range(args.n_seqs)]
+
+short_seqs = {}
+for slen in args.short_seq_lens:
+    short_naive = ''.join(random.choice(utils.nukes) for _ in range(slen))
+    short_seqs[slen] = [mutate(short_naive, args.mut_freq, args.ambig_frac) for _ in range(200)]
+
+print '  checking against pure python loop'
+for tseqs in [seqs] + [short_seqs[l] for l in args.short_seq_lens]:
+    for s1, s2 in zip(tseqs[:200], tseqs[1:201]):
+        if utils.hamming_distance(s1, s2, return_len_excluding_ambig=True) != loop_hamming_distance(s1, s2):
+            raise Exception('hamming_distance() differs from loop version for\n    %s\n    %s' % (s1, s2))
+nsub = 100
+for block_size in [1000, 7]:  # also check that blocking over rows doesn't change anything
+    dmat, lmat = utils.hamming_distance_matrix(seqs[:nsub], return_len_excluding_ambig=True, block_size=block_size)
+    for i in range(nsub):
+        for j in range(nsub):
+            if (dmat[i, j], lmat[i, j]) != loop_hamming_distance(seqs[i], seqs[j]):
+                raise Exception('hamming_distance_matrix() differs from loop version at %d %d (block size %d)' % (i, j, block_size))
+if not numpy.allclose(utils.hamming_distances_to_seq(seqs[0], seqs[:nsub], return_fractions=True), [utils.hamming_fraction(seqs[0], s) for s in seqs[:nsub]]):
+    raise Exception('hamming_distances_to_seq() differs from hamming_fraction()')
+loop_mean_hfrac = numpy.mean([float(d) / l if l > 0 else 0. for s1, s2 in itertools.combinations(seqs[:nsub], 2) for d, l in [loop_hamming_distance(s1, s2)]])
+if not numpy.isclose(utils.mean_pairwise_hfrac(seqs[:nsub], block_size=7), loop_mean_hfrac):
+    raise Exception('mean_pairwise_hfrac() differs from loop version')
+
+for slen, tseqs in sorted(short_seqs.items()) + [(args.seq_len, seqs)]:
+    print '  per-pair (seq len %d):' % slen
+    t_loop = timeit(lambda: loop_hamming_distance(tseqs[0], tseqs[1]), args.n_pair_calls)
+    t_vec = timeit(lambda: utils.hamming_distance(tseqs[0], tseqs[1]), args.n_pair_calls)
+    print '      loop             %6.1f us/pair' % (1e6 * t_loop)
+    print '      hamming_distance %6.1f us/pair  (%.1fx)%s' % (1e6 * t_vec, t_loop / t_vec, ' (uses loop)' if slen < utils.hamming_loop_max_len else '')
+
+n_pairs = args.n_seqs * (args.n_seqs - 1) / 2
+print '  all-pairs matrix (%d seqs, %d pairs):' % (args.n_seqs, n_pairs)
+start = time.time()
+for s1, s2 in zip(seqs[:1000], seqs[1:1001]):  # time the loop on a subset, and extrapolate
+    loop_hamming_distance(s1, s2)
+t_loop = (time.time() - start) / min(1000, args.n_seqs - 1) * n_pairs
+start = time.time()
+utils.hamming_distance_matrix(seqs)
+t_vec = time.time() - start
+print '      loop        %6.2f sec  (extrapolated)' % t_loop
+print '      vectorized  %6.2f sec  (%.0fx, %.2f us/pair)' % (t_vec, t_loop / t_vec, 1e6 * t_vec / n_pairs)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# regression benchmark for utils.merge_overlapping_clusters() (used by PartitionDriver.merge_shared_clusters() with --max-cluster-size): checks it against the old brute force pairwise version on small partitions, then times it on a big synthetic partition
+import argparse
+import itertools
+import random
+import sys
+import time
+import colored_traceback.always
+
+sys.path.insert(1, './python')
+import utils
+
+# ----------------------------------------------------------------------------------------
+def make_partition(n_clusters, mean_size, overlap_frac):  # make a partition with <n_clusters> clusters, in which a fraction <overlap_frac> of them share a uid with some earlier cluster (so they form chains/groups that need merging)
+    partition = []
+    iuid = 0
+    for iclust in range(n_clusters):
+        size = max(1, int(random.expovariate(1. / mean_size)))
+        cluster = ['u%d' % (iuid + i) for i in range(size)]
+        iuid += size
+        if iclust > 0 and random.random() < overlap_frac:
+            cluster.append(random.choice(partition[random.randint(max(0, iclust - 50), iclust - 1)]))  # share with a nearby-ish earlier cluster
+        partition.append(cluster)
+    random.shuffle(partition)
+    return partition
+
+# ----------------------------------------------------------------------------------------
+def brute_force_merge(partition):  # the old quadratic-then-cubic implementation from PartitionDriver.merge_shared_clusters()
+    partition = [list(c) for c in partition]
+    cluster_groups = []
+    for iclust in range(len(partition)):
+        for jclust in range(iclust + 1, len(partition)):
+            if len(set(partition[iclust]) & set(partition[jclust])) > 0:
+                cluster_groups.append(set([iclust, jclust]))
+    while True:
+        no_more_merges = True
+        for cp1, cp2 in itertools.combinations(cluster_groups, 2):
+            if len(cp1 & cp2) > 0:
+                cluster_groups.append(cp1 | cp2)
+                cluster_groups.remove(cp1)
+                cluster_groups.remove(cp2)
+                no_more_merges = False
+                break
+        if no_more_merges:
+            break
+    new_clusters = [list(set([uid for iclust in cgroup for uid in partition[iclust]])) for cgroup in cluster_groups]
+    for iclust in sorted([i for cgroup in cluster_groups for i in cgroup], reverse=True):
+        partition.pop(iclust)
+    return partition + new_clusters
+
+# ----------------------------------------------------------------------------------------
+def ptnset(partition):
+    return set(frozenset(c) for c in partition)
+
+# ----------------------------------------------------------------------------------------
+parser = argparse.ArgumentParser()
+parser.add_argument('--n-clusters', type=int, default=100000, help='number of clusters in the big (timed) synthetic partition')
+parser.add_argument('--mean-cluster-size', type=float, default=3.)
+parser.add_argument('--overlap-frac', type=float, default=0.2, help='fraction of clusters that share a uid with another cluster')
+parser.add_argument('--n-check-partitions', type=int, default=20, help='number of small partitions on which to check that we get the same result as the old brute force version')
+parser.add_argument('--max-time', type=float, default=10., help='fail if merging the big partition takes longer than this (seconds)')
+parser.add_argument('--random-seed', type=int, default=1)
+args = parser.parse_args()
+random.seed(args.random_seed)
+
+print '  checking against brute force on %d small partitions' % args.n_check_partitions
+for _ in range(args.n_check_partitions):
+    partition = make_partition(random.randint(1, 200), args.mean_cluster_size, args.overlap_frac)
+    if ptnset(utils.merge_overlapping_clusters(partition)) != ptnset(brute_force_merge(partition)):
+        raise Exception('merge_overlapping_clusters() result differs from brute force result for partition:\n%s' % partition)
+
+partition = make_partition(args.n_clusters, args.mean_cluster_size, args.overlap_frac)
+start = time.time()
+new_partition = utils.merge_overlapping_clusters(partition)
+merge_time = time.time() - start
+print '  merged %d clusters (%d uids) into %d in %.2f sec' % (len(partition), sum(len(c) for c in partition), len(new_partition), merge_time)
+if len(set(u for c in new_partition for u in c)) != sum(len(c) for c in new_partition):
+    raise Exception('merged partition still has overlapping clusters')
+if merge_time > args.max_time:
+    raise Exception('merging took longer than --max-time (%.2f > %.2f sec)' % (merge_time, args.max_time))
+print '  %s' % utils.color('green', 'ok')
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# compare --mutation-simulator bppseqgen and --mutation-simulator numpy: simulates the same events (same seed, so same rearrangements and trees) with each, then compares timing, overall mutation frequency, per-position mutation frequencies, and mutation spectra (germline base --> mutated base)
+import argparse
+import os
+import sys
+import time
+import numpy
+import colored_traceback.always
+
+sys.path.insert(1, './python')
+import utils
+
+# ----------------------------------------------------------------------------------------
+def run_simu(msim):
+    outfname = '%s/%s/simu.yaml' % (args.outdir, msim)
+    cmd = './bin/partis simulate --parameter-dir %s --outfname %s --n-sim-events %d --n-leaves %d --random-seed %d --mutation-simulator %s --n-procs %d' % (args.parameter_dir, outfname, args.n_sim_events, args.n_leaves, args.random_seed, msim, args.n_procs)
+    if args.no_per_base_mutation:
+        cmd += ' --no-per-base-mutation'
+    start = time.time()
+    utils.simplerun(cmd, debug=False)
+    simu_time = time.time() - start
+    _, annotation_list, _ = utils.read_output(outfname)
+    return simu_time, annotation_list
+
+# ----------------------------------------------------------------------------------------
+def get_mutation_info(annotation_list):  # per-position mutation fractions (keyed by gene and germline position, so different events line up), and overall germline --> mutated base spectrum
+    nukes = sorted(utils.nukes)
+    pos_counts = {}  # (gene, position) : [n mutated, n total]
+    spectrum = numpy.zeros((len(nukes), len(nukes)))
+    n_muts, n_total = 0, 0
+    for line in annotation_list:
+        naive_seq = line['naive_seq']
+        for region in utils.regions:
+            gene = line[region + '_gene']
+            bounds = line['regional_bounds'][region]
+            for seq in line['seqs']:
+                if len(seq) != len(naive_seq):  # shm indels
+                    continue
+                for ipos in range(bounds[0], bounds[1]):
+                    key = (gene, ipos - bounds[0] + line[region + '_5p_del'])
+                    if key not in pos_counts:
+                        pos_counts[key] = [0, 0]
+                    pos_counts[key][1] += 1
+                    if seq[ipos] != naive_seq[ipos] and seq[ipos] in nukes and naive_seq[ipos] in nukes:
+                        pos_counts[key][0] += 1
+                        spectrum[nukes.index(naive_seq[ipos]), nukes.index(seq[ipos])] += 1
+        for seq in line['seqs']:
+            if len(seq) == len(naive_seq):
+                n_muts += utils.hamming_distance(naive_seq, seq)
+                n_total += len(seq)
+    return pos_counts, spectrum / max(1., spectrum.sum()), n_muts / float(max(1, n_total))
+
+# ----------------------------------------------------------------------------------------
+parser = argparse.ArgumentParser()
+parser.add_argument('--parameter-dir', default='test/ref-results/test/parameters/simu')
+parser.add_argument('--outdir', default='/tmp/%s/mutation-simulator-bench' % os.getenv('USER'))
+parser.add_argument('--n-sim-events', type=int, default=500)
+parser.add_argument('--n-leaves', type=int, default=10)
+parser.add_argument('--n-procs', type=int, default=1)
+parser.add_argument('--random-seed', type=int, default=1)
+parser.add_argument('--no-per-base-mutation', action='store_true')
+parser.add_argument('--min-position-counts', type=int, default=500, help='only compare per-position mutation frequencies for positions with at least this many observations in each')
+parser.add_argument('--max-freq-diff', type=float, default=0.01, help='fail if the overall mutation frequencies differ by more than this')
+parser.add_argument('--max-spectrum-diff', type=float, default=0.03, help='fail if any entry in the (normalized) mutation spectra differs by more than this')
+parser.add_argument('--min-position-correlation', type=float, default=0.8, help='fail if the correlation between per-position mutation frequencies is less than this')
+args = parser.parse_args()
+utils.prep_dir(args.outdir)
+
+msims = ['bppseqgen', 'numpy']
+mfos = {}
+for msim in msims:
+    simu_time, annotation_list = run_simu(msim)
+    pos_counts, spectrum, mean_freq = get_mutation_info(annotation_list)
+    mfos[msim] = {'pos_counts' : pos_counts, 'spectrum' : spectrum, 'mean_freq' : mean_freq}
+    print '  %-9s  %6.1f sec  (%d events)   mean mut freq %.4f' % (msim, simu_time, len(annotation_list), mean_freq)
+
+failures = []
+freq_diff = abs(mfos['bppseqgen']['mean_freq'] - mfos['numpy']['mean_freq'])
+if freq_diff > args.max_freq_diff:
+    failures.append('overall mutation frequency differs by %.4f' % freq_diff)
+
+print '  mutation spectra (rows: germline base, columns: mutated base):'
+print '            %s' % '       '.join(sorted(utils.nukes))
+for inuke, nuke in enumerate(sorted(utils.nukes)):
+    print '      %s   %s' % (nuke, '   '.join('%.3f/%.3f' % (mfos['bppseqgen']['spectrum'][inuke, j], mfos['numpy']['spectrum'][inuke, j]) for j in range(len(utils.nukes))))
+max_spec_diff = numpy.max(numpy.abs(mfos['bppseqgen']['spectrum'] - mfos['numpy']['spectrum']))
+if max_spec_diff > args.max_spectrum_diff:
+    failures.append('mutation spectra differ by up to %.3f' % max_spec_diff)
+
+common_keys = [k for k in set(mfos['bppseqgen']['pos_counts']) & set(mfos['numpy']['pos_counts']) if all(mfos[m]['pos_counts'][k][1] >= args.min_position_counts for m in msims)]
+pos_freqs = {m : numpy.array([mfos[m]['pos_counts'][k][0] / float(mfos[m]['pos_counts'][k][1]) for k in common_keys]) for m in msims}
+if len(common_keys) > 1:
+    pcorr = numpy.corrcoef(pos_freqs['bppseqgen'], pos_freqs['numpy'])[0, 1]
+    print '  per-position mutation freqs: correlation %.3f over %d positions (mean abs diff %.4f)' % (pcorr, len(common_keys), numpy.mean(numpy.abs(pos_freqs['bppseqgen'] - pos_freqs['numpy'])))
+    if pcorr < args.min_position_correlation:
+        failures.append('per-position mutation freq correlation %.3f less than %.3f' % (pcorr, args.min_position_correlation))
+else:
+    print '  not enough positions with at least %d observations to compare per-position freqs (increase --n-sim-events)' % args.min_position_counts
+
+if len(failures) > 0:
+    raise Exception('mutation simulators differ:\n    %s' % '\n    '.join(failures))
+print '  %s' % utils.color('green', 'ok')
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# regression benchmark for the contingency table-based partition metrics in utils (per_seq_correct_cluster_fractions(), partition_similarity_matrix(), adjusted_rand_index(), variation_of_information()): checks purity/completeness for numerical identity against the old per-uid list membership version, and ari/vi against brute force pair counting, on small random partitions, then times them on a big one
+import argparse
+import collections
+import copy
+import itertools
+import math
+import random
+import sys
+import time
+import colored_traceback.always
+
+sys.path.insert(1, './python')
+import utils
+
+# ----------------------------------------------------------------------------------------
+def make_partition(uids, mean_size):
+    uids = list(uids)
+    random.shuffle(uids)
+    partition = []
+    while len(uids) > 0:
+        size = max(1, int(random.expovariate(1. / mean_size)))
+        partition.append(uids[:size])
+        uids = uids[size:]
+    return partition
+
+# ----------------------------------------------------------------------------------------
+def perturb_partition(partition, frac):  # move a fraction <frac> of uids to a random other (or new) cluster
+    partition = [list(c) for c in partition]
+    for _ in range(int(frac * sum(len(c) for c in partition))):
+        iclust = random.randrange(len(partition))
+        if len(partition[iclust]) == 0:
+            continue
+        uid = partition[iclust].pop(random.randrange(len(partition[iclust])))
+        jclust = random.randrange(len(partition) + 1)
+        if jclust == len(partition):
+            partition.append([uid])
+        else:
+            partition[jclust].append(uid)
+    return [c for c in partition if len(c) > 0]
+
+# ----------------------------------------------------------------------------------------
+def old_ccfs(partition, true_partition, reco_info):  # the old per-uid version of utils.per_seq_correct_cluster_fractions() (without seed uid handling)
+    reco_ids = {uid : reco_info[uid]['reco_id'] for cluster in partition for uid in cluster}
+    clids = utils.get_cluster_ids(set(u for c in partition for u in c), partition)
+    mean_clonal_fraction, mean_fraction_present, n_uids = 0., 0., 0
+    for true_cluster in true_partition:
+        for uid in true_cluster:
+            if len(clids[uid]) != 1:
+                return None, None
+            inferred_cluster = partition[clids[uid][0]]
+            mean_clonal_fraction += float(len([t for t in inferred_cluster if reco_ids[t] == reco_ids[uid]])) / len(inferred_cluster)
+            mean_fraction_present += float(len([t for t in true_cluster if t in inferred_cluster])) / len(true_cluster)
+            n_uids += 1
+    return mean_clonal_fraction / n_uids, mean_fraction_present / n_uids
+
+# ----------------------------------------------------------------------------------------
+def brute_force_ari_vi(partition_a, partition_b):
+    labels_a, labels_b = [{u : i for i, c in enumerate(p) for u in c} for p in (partition_a, partition_b)]
+    n_same = collections.Counter((labels_a[u1] == labels_a[u2], labels_b[u1] == labels_b[u2]) for u1, u2 in itertools.combinations(sorted(labels_a), 2))
+    n_a, n_b = n_same[(True, True)] + n_same[(True, False)], n_same[(True, True)] + n_same[(False, True)]
+    expected, max_val = n_a * n_b / float(sum(n_same.values())), 0.5 * (n_a + n_b)
+    ari = 1. if max_val == expected else (n_same[(True, True)] - expected) / (max_val - expected)
+    sizes_a, sizes_b = collections.Counter(labels_a.values()), collections.Counter(labels_b.values())
+    n_uids = float(len(labels_a))
+    vi = -sum(n / n_uids * (math.log(n / float(sizes_a[ia])) + math.log(n / float(sizes_b[ib]))) for (ia, ib), n in collections.Counter((labels_a[u], labels_b[u]) for u in labels_a).items())
+    return ari, vi
+
+# ----------------------------------------------------------------------------------------
+parser = argparse.ArgumentParser()
+parser.add_argument('--n-uids', type=int, default=100000, help='number of uids in the big (timed) partitions')
+parser.add_argument('--mean-cluster-size', type=float, default=30.)
+parser.add_argument('--perturb-frac', type=float, default=0.2, help='fraction of uids to move to different clusters when making the "inferred" partition')
+parser.add_argument('--n-check-partitions', type=int, default=100, help='number of small partitions on which to check against the old/brute force versions')
+parser.add_argument('--max-time', type=float, default=10., help='fail if the big partition metrics take longer than this (seconds)')
+parser.add_argument('--random-seed', type=int, default=1)
+args = parser.parse_args()
+random.seed(args.random_seed)
+
+print '  checking against old/brute force versions on %d small partitions' % args.n_check_partitions
+for _ in range(args.n_check_partitions):
+    uids = ['u%d' % i for i in range(random.randint(2, 150))]
+    true_partition = make_partition(uids, random.choice([1, 3, 20]))
+    partition = perturb_partition(true_partition, random.random())
+    reco_info = {u : {'reco_id' : random.randint(0, len(true_partition) // 2)} for u in uids}  # reco ids can be shared between true clusters
+    for tc in true_partition:
+        for uid in tc:
+            reco_info[uid]['reco_id'] = reco_info[tc[0]]['reco_id']
+    if utils.per_seq_correct_cluster_fractions(partition, true_partition, reco_info=reco_info) != old_ccfs(partition, true_partition, reco_info):  # NOTE checking for exact equality
+        raise Exception('per_seq_correct_cluster_fractions() result differs from old version for partitions:\n  %s\n  %s' % (partition, true_partition))
+    ari, vi = brute_force_ari_vi(partition, true_partition)
+    if abs(ari - utils.adjusted_rand_index(partition, true_partition)) > 1e-10 or abs(vi - utils.variation_of_information(partition, true_partition)) > 1e-10:
+        raise Exception('adjusted rand index or variation of information differs from brute force for partitions:\n  %s\n  %s' % (partition, true_partition))
+
+true_partition = make_partition(['u%d' % i for i in range(args.n_uids)], args.mean_cluster_size)
+partition = perturb_partition(true_partition, args.perturb_frac)
+start = time.time()
+purity, completeness = utils.per_seq_correct_cluster_fractions(partition, true_partition)
+ari, vi = utils.adjusted_rand_index(partition, true_partition), utils.variation_of_information(partition, true_partition)
+utils.partition_similarity_matrix(partition, true_partition, 100)
+metric_time = time.time() - start
+print '  %d uids in %d true and %d inferred clusters: purity %.3f  completeness %.3f  ari %.3f  vi %.3f  (%.2f sec)' % (args.n_uids, len(true_partition), len(partition), purity, completeness, ari, vi, metric_time)
+if metric_time > args.max_time:
+    raise Exception('partition metrics took longer than --max-time (%.2f > %.2f sec)' % (metric_time, args.max_time))
+print '  %s' % utils.color('green', 'ok')
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# compare --sw-backend ig-sw and --sw-backend numpy: runs smith-waterman with each on the same input, then prints the time for each and how often they agree on the best v/d/j genes and boundaries
+import argparse
+import os
+import sys
+import time
+import colored_traceback.always
+
+sys.path.insert(1, './python')
+import utils
+
+# ----------------------------------------------------------------------------------------
+def run_sw(backend):
+    cachefname = '%s/sw-cache-%s.yaml' % (args.outdir, backend)
+    if os.path.exists(cachefname):
+        os.remove(cachefname)
+    cmd = './bin/partis annotate --only-smith-waterman --dont-write-parameters --infname %s --parameter-dir %s --sw-cachefname %s --sw-backend %s --n-procs %d --n-max-queries %d' % (args.infname, args.parameter_dir, cachefname, backend, args.n_procs, args.n_max_queries)
+    start = time.time()
+    utils.simplerun(cmd, debug=False)
+    sw_time = time.time() - start
+    _, annotation_list, _ = utils.read_yaml_output(fname=cachefname)
+    return sw_time, {l['unique_ids'][0] : l for l in annotation_list}
+
+# ----------------------------------------------------------------------------------------
+parser = argparse.ArgumentParser()
+parser.add_argument('--infname', default='test/example.fa')
+parser.add_argument('--parameter-dir', default='test/ref-results/test/parameters/data', help='we only use the germline info from here')
+parser.add_argument('--outdir', default='/tmp/%s/sw-backend-bench' % os.getenv('USER'))
+parser.add_argument('--n-procs', type=int, default=1)
+parser.add_argument('--n-max-queries', type=int, default=-1)
+args = parser.parse_args()
+utils.prep_dir(args.outdir)
+
+times, annotations = {}, {}
+for backend in ['ig-sw', 'numpy']:
+    times[backend], annotations[backend] = run_sw(backend)
+    print '  %-6s  %5.1f sec  (%d annotations)' % (backend, times[backend], len(annotations[backend]))
+
+common_uids = set(annotations['ig-sw']) & set(annotations['numpy'])
+print '  %d uids in both (%d only in ig-sw, %d only in numpy)' % (len(common_uids), len(set(annotations['ig-sw']) - common_uids), len(set(annotations['numpy']) - common_uids))
+for key in [r + '_gene' for r in utils.regions] + [r + '_5p_del' for r in utils.regions] + [r + '_3p_del' for r in utils.regions] + [b + '_insertion' for b in utils.boundaries]:
+    n_same = len([u for u in common_uids if annotations['ig-sw'][u].get(key) == annotations['numpy'][u].get(key)])
+    print '    %-14s %5.3f' % (key, n_same / float(max(1, len(common_uids))))
@@ -855,6 +855,164 @@ class Tester(object):
         else:
             compare_files(self.ptn_cachefn(input_stype))
 
+# ----------------------------------------------------------------------------------------
+# scaling benchmarks: simulate (with fixed seed) samples of increasing size, run each inference method on each of them with one proc, and compare the resulting time and memory curves (and fitted scaling exponents) to those in the reference dir
+class Bencher(object):
+    # ----------------------------------------------------------------------------------------
+    def __init__(self):
+        self.partis = '%s/bin/partis' % utils.get_partis_dir()
+        self.sizes = utils.get_arg_list(args.bench_sizes, intify=True)
+        self.n_leaves = 5
+        self.common_extras = ['--random-seed', '1', '--n-procs', '1', '--dont-write-git-info']
+        self.methods = OrderedDict([  # method name : (action, extra args)
+            ('annotate', ('annotate', [])),
+            ('partition', ('partition', [])),
+            ('fast', ('partition', ['--fast'])),
+            ('naive-vsearch', ('partition', ['--naive-vsearch'])),
+            ('paired-loci', ('partition', ['--paired-loci'])),
+        ])
+        self.methods = OrderedDict([(m, self.methods[m]) for m in utils.get_arg_list(args.bench_methods, choices=self.methods.keys())])
+        self.ref_param_dirs = {'single' : 'test/ref-results/test/parameters', 'paired' : 'test/paired/ref-results/test/parameters'}  # we copy these to the new dir so nothing (e.g. sw cache files) gets written to the reference dirs
+        self.logfname = self.dir('new') + '/bench.log'
+
+    # ----------------------------------------------------------------------------------------
+    def dir(self, tstr):
+        assert tstr in ['ref', 'new']
+        return 'test/bench/%s-results' % tstr
+
+    # ----------------------------------------------------------------------------------------
+    def pdir(self, ptype, dtype):  # copied parameter dir
+        return '%s/parameters/%s/%s' % (self.dir('new'), ptype, dtype)
+
+    # ----------------------------------------------------------------------------------------
+    def simpath(self, size, paired):
+        return '%s/simu-%d%s' % (self.dir('new'), size, '-paired' if paired else '.yaml')
+
+    # ----------------------------------------------------------------------------------------
+    def run_cmd(self, name, cmd_str):  # returns wall time and peak rss (in mb) for the command (including all its subprocesses)
+        logstr = '%s   %s' % (utils.color('green', name, width=30, padside='right'), cmd_str)
+        print logstr if utils.len_excluding_colors(logstr) < args.print_width else logstr[:args.print_width] + '[...]'
+        if args.dry_run:
+            return None, None
+        with open(self.logfname, 'a') as logfile:
+            logfile.write(logstr + '\n')
+        start = time.time()
+        proc = Popen(cmd_str + ' 1>>' + self.logfname + ' 2>>' + self.logfname, shell=True)
+        _, status, rusage = os.wait4(proc.pid, 0)  # unlike getrusage(RUSAGE_CHILDREN), this gives us the peak for only this command (ru_maxrss is the largest of the process and any of its waited-for descendants)
+        wall_time = time.time() - start
+        if status != 0:
+            print '  log tail:'
+            print utils.pad_lines(check_output(['tail', self.logfname]))
+            sys.exit(1)
+        return wall_time, rusage.ru_maxrss / 1024.  # kb on linux
+
+    # ----------------------------------------------------------------------------------------
+    def simulate(self, size, paired):
+        if os.path.exists(self.simpath(size, paired)):  # same seed, so no need to rerun
+            return
+        n_events = max(1, int(size / float(self.n_leaves)))
+        cmd_str = '%s simulate --parameter-dir %s/data --%s %s' % (self.partis, self.ref_param_dirs['paired' if paired else 'single'], 'paired-outdir' if paired else 'outfname', self.simpath(size, paired))
+        cmd_str += ' --n-sim-events %d --n-trees %d --n-leaf-distribution geometric --n-leaves %d --mutation-simulator numpy' % (n_events, n_events, self.n_leaves)  # numpy mutation simulator so we don't need bppseqgen
+        if paired:
+            cmd_str += ' --paired-loci --min-observations-per-gene 5 --mean-cells-per-droplet 1.5 --constant-cells-per-droplet --fraction-of-reads-to-remove 0.15'  # same as in Tester
+        cmd_str += ' ' + ' '.join(self.common_extras)
+        self.run_cmd('simulate-%d%s' % (size, '-paired' if paired else ''), cmd_str)
+
+    # ----------------------------------------------------------------------------------------
+    def run_method(self, method, size):
+        action, extras = self.methods[method]
+        paired = '--paired-loci' in extras
+        ptype = 'paired' if paired else 'single'
+        for scfn in glob.glob(self.pdir(ptype, 'simu') + '/sw-cache*') + glob.glob(self.pdir(ptype, 'simu') + '/*/sw-cache*'):  # make sure we rerun sw every time
+            os.remove(scfn)
+        ofn = '%s/%s-%d%s' % (self.dir('new'), method, size, '' if paired else '.yaml')
+        cmd_str = '%s %s --%s %s --parameter-dir %s' % (self.partis, action, 'paired-indir' if paired else 'infname', self.simpath(size, paired), self.pdir(ptype, 'simu'))
+        cmd_str += ' --%s %s --timeline-fname %s/%s-%d-timeline.json' % ('paired-outdir' if paired else 'outfname', ofn, self.dir('new'), method, size)
+        if not paired:
+            cmd_str += ' --sw-cachefname %s/sw-cache.yaml' % self.pdir(ptype, 'simu')
+        cmd_str += ' %s' % ' '.join(extras + self.common_extras)
+        return self.run_cmd('%s-%d' % (method, size), cmd_str)
+
+    # ----------------------------------------------------------------------------------------
+    def fit_exponent(self, times):  # slope of log(time) vs log(size)
+        svals, tvals = zip(*[(s, t) for s, t in zip(self.sizes, times) if t is not None and t > 0])
+        if len(svals) < 2:
+            return None
+        return float(numpy.polyfit(numpy.log(svals), numpy.log(tvals), 1)[0])
+
+    # ----------------------------------------------------------------------------------------
+    def run(self):
+        if not args.dry_run:
+            if not os.path.exists(self.dir('new')):
+                os.makedirs(self.dir('new'))
+            open(self.logfname, 'w').close()
+        ptypes = sorted(set('paired' if '--paired-loci' in extras else 'single' for _, extras in self.methods.values()))
+        for ptype in ptypes:
+            if not os.path.exists(self.pdir(ptype, 'simu')) and not args.dry_run:
+                shutil.copytree(self.ref_param_dirs[ptype] + '/simu', self.pdir(ptype, 'simu'))
+            for size in self.sizes:
+                self.simulate(size, ptype == 'paired')
+        benchfo = {'sizes' : self.sizes, 'methods' : OrderedDict()}
+        for method in self.methods:
+            times, mems = [], []
+            for size in self.sizes:
+                wall_time, peak_mem = self.run_method(method, size)
+                times.append(wall_time)
+                mems.append(peak_mem)
+            benchfo['methods'][method] = {'times' : times, 'peak_rss_mb' : mems, 'exponent' : self.fit_exponent(times) if not args.dry_run else None}
+        if not args.dry_run:
+            with open(self.dir('new') + '/bench.yaml', 'w') as bfile:
+                yaml.safe_dump({'sizes' : benchfo['sizes'], 'methods' : dict(benchfo['methods'])}, bfile, width=200)
+        return benchfo
+
+    # ----------------------------------------------------------------------------------------
+    def compare(self, newfo):
+        ref_fname = self.dir('ref') + '/bench.yaml'
+        if not os.path.exists(ref_fname):
+            print '  no reference benchmark file %s (run with --bench --bust-cache to make one)' % ref_fname
+            return
+        with open(ref_fname) as bfile:
+            reffo = yaml.safe_load(bfile)
+        failures = []
+        print 'comparing to reference benchmarks (time tolerance %.2f, exponent tolerance %.2f)' % (args.bench_time_tolerance, args.bench_exponent_tolerance)
+        print '  %-15s %7s   %17s   %17s' % ('', 'size', 'time (sec)', 'peak mem (mb)')
+        for method, mfo in newfo['methods'].items():
+            if method not in reffo['methods']:
+                print '  %-15s no reference values' % method
+                continue
+            rfo = reffo['methods'][method]
+            for size, new_time, new_mem in zip(newfo['sizes'], mfo['times'], mfo['peak_rss_mb']):
+                if size not in reffo['sizes']:
+                    print '  %-15s %7d   no reference values' % (method, size)
+                    continue
+                isize = reffo['sizes'].index(size)
+                ref_time, ref_mem = rfo['times'][isize], rfo['peak_rss_mb'][isize]
+                fchange = (new_time - ref_time) / ref_time
+                tstr = '%7.1f --> %-7.1f' % (ref_time, new_time)
+                if fchange > args.bench_time_tolerance and new_time - ref_time > args.bench_min_time_diff:
+                    failures.append('%s with %d seqs took %.1fs (reference %.1fs)' % (method, size, new_time, ref_time))
+                    tstr = utils.color('red', tstr)
+                print '  %-15s %7d   %s   %7.0f --> %-7.0f' % (method, size, tstr, ref_mem, new_mem)
+            if None not in [rfo['exponent'], mfo['exponent']]:
+                estr = 'exponent %.2f --> %.2f' % (rfo['exponent'], mfo['exponent'])
+                if mfo['exponent'] - rfo['exponent'] > args.bench_exponent_tolerance:
+                    failures.append('%s scaling exponent %.2f (reference %.2f)' % (method, mfo['exponent'], rfo['exponent']))
+                    estr = utils.color('red', estr)
+                print '  %-15s %7s   %s' % (method, '', estr)
+        if len(failures) > 0:
+            print '%s benchmarks regressed:\n    %s' % (utils.color('red', 'failure'), '\n    '.join(failures))
+            sys.exit(1)
+        print '  %s' % utils.color('green', 'ok')
+
+    # ----------------------------------------------------------------------------------------
+    def bust_cache(self):
+        if args.dry_run:
+            return
+        if not os.path.exists(self.dir('ref')):
+            os.makedirs(self.dir('ref'))
+        print '  mv %s/bench.yaml   -->  %s/' % (self.dir('new'), self.dir('ref'))
+        shutil.move(self.dir('new') + '/bench.yaml', self.dir('ref') + '/bench.yaml')
+
 # ----------------------------------------------------------------------------------------
 parser = argparse.ArgumentParser()
 parser.add_argument('--dont-run', action='store_true', help='don\'t actually run anything, just check the results')
@@ -872,6 +1030,12 @@ parser.add_argument('--print-width', type=int, default=300, help='set to 0 for i
 # example to make comparison plots:
 #   ./bin/compare-plotdirs.py --plotdirs test/reference-results/simu-new-performance/sw:test/new-results/simu-new-performance/sw --names ref:new --outdir $www/partis/tmp/test-plots
 
+parser.add_argument('--bench', action='store_true', help='instead of the regular tests, run scaling benchmarks: simulate samples of each size in --bench-sizes, run each of --bench-methods on them with one proc, and compare time and memory to the reference values in test/bench/ref-results (set --bust-cache to replace the reference values with the new ones)')
+parser.add_argument('--bench-sizes', default='100:300:1000:3000', help='colon-separated list of sample sizes (number of sequences) for --bench')
+parser.add_argument('--bench-methods', default='annotate:partition:fast:naive-vsearch:paired-loci', help='colon-separated list of methods to run for --bench')
+parser.add_argument('--bench-time-tolerance', type=float, default=0.3, help='with --bench, fail if any time is more than this fraction larger than the reference (and also more than --bench-min-time-diff seconds larger)')
+parser.add_argument('--bench-min-time-diff', type=float, default=2., help='see --bench-time-tolerance')
+parser.add_argument('--bench-exponent-tolerance', type=float, default=0.2, help='with --bench, fail if the fitted scaling exponent (slope of log time vs log size) for any method is more than this much larger than the reference')
 parser.add_argument('--glfo-dir', default='data/germlines/human')
 parser.add_argument('--locus', default='igh')
 args = parser.parse_args()
@@ -880,6 +1044,15 @@ assert not (args.quick and args.slow)  # it just doesn't make sense
 if args.print_width == 0:
     args.print_width = 99999
 
+if args.bench:
+    bencher = Bencher()
+    benchfo = bencher.run()
+    if args.bust_cache:
+        bencher.bust_cache()
+    elif not args.dry_run:
+        bencher.compare(benchfo)
+    sys.exit(0)
+
 if args.run_all or (args.bust_cache and not args.only_bust_current):  # run all four combos
     for slowval in [False, True]:
         for pairedval in [False, True]: